@@ -0,0 +1,139 @@
+# python_shift_solver/availability_index.py
+from datetime import date
+
+
+def build_capable_teachers(teachers_status):
+    """(所属, 科目) -> 担当可能講師IDリスト (teachers_status の順序を保持)。"""
+    capable_teachers = {}
+    for t_id, t_stat in teachers_status.items():
+        teachable_subjects_by_aff = t_stat.obj.get('teachableSubjectsByAffiliation', {})
+        for affiliation, subjects in teachable_subjects_by_aff.items():
+            for subject in set(subjects):
+                capable_teachers.setdefault((affiliation, subject), []).append(t_id)
+    return capable_teachers
+
+
+def shift_periods(admin_settings):
+    """開講され得る時限の一覧 (defaultShiftPeriodsByDay の全曜日の和集合、昇順)。"""
+    period_values = set()
+    for periods in admin_settings.get('defaultShiftPeriodsByDay', {}).values():
+        period_values.update(periods)
+    return sorted(period_values)
+
+
+class RosterAvailability:
+    """
+    名簿 (講師・生徒リスト) と時限の一覧だけから決まる事前計算。日付の範囲や休日には依存しないので、
+    期間だけが違うシナリオ間で共有できる (batch_solver)。変更しないこと。
+
+    - (所属, 科目) -> 担当可能な講師IDリスト
+    - 講師/生徒ごとの 日付 -> 空き時限のビットマスク (ビット位置は時限インデックス)
+    """
+
+    def __init__(self, teachers_status, students_status, periods):
+        self.periods = periods
+        self.period_bit = {p: i for i, p in enumerate(periods)}
+        self.capable_teachers = build_capable_teachers(teachers_status)
+        self.teacher_day_masks = {
+            t_id: self._build_day_masks(t_stat.obj.get('selectedDateSlots', {}))
+            for t_id, t_stat in teachers_status.items()
+        }
+        self.student_day_masks = {
+            s_id: self._build_day_masks(s_stat.obj.get('availableLectureSlots', {}))
+            for s_id, s_stat in students_status.items()
+        }
+
+    def _build_day_masks(self, slots_by_date):
+        day_masks = {}
+        for date_str, slots in slots_by_date.items():
+            day_mask = 0
+            for p in slots:
+                bit = self.period_bit.get(p)
+                if bit is not None:
+                    day_mask |= 1 << bit
+            if day_mask:
+                day_masks[date_str] = day_mask
+        return day_masks
+
+
+class AvailabilityIndex:
+    """
+    generate_actual_shifts 用の事前コンパイル済み空き状況インデックス。
+    リクエストごとに1回だけ構築し、候補探索をビット演算で行う。
+
+    - (所属, 科目) -> 担当可能な講師IDリスト (teachers_status の順序を保持)
+    - 日付ごとの開講可能コマのビットマスク (defaultShiftPeriodsByDay)
+    - 講師/生徒ごとの空きコマビットマスク (割り当て時に差分更新)
+
+    ビット位置は「日付インデックス * 時限数 + 時限インデックス」。
+    下位ビットから走査すると (日付順, 時限昇順) になり、従来のループ順と一致する。
+    teachers_status / students_status は solver_state の {id: TeacherState / StudentState}。
+    """
+
+    def __init__(self, teachers_status, students_status, available_dates, admin_settings, days_of_week_jp,
+                 roster=None):
+        self.available_dates = available_dates
+        default_periods_by_day = admin_settings.get('defaultShiftPeriodsByDay', {})
+
+        # 名簿から決まる部分 (担当可能講師と日付ごとの空き時限)。バッチ実行時は共有のものを渡す
+        if roster is None:
+            roster = RosterAvailability(teachers_status, students_status, shift_periods(admin_settings))
+        self.periods = roster.periods
+        self.period_bit = roster.period_bit
+        self.num_periods = len(self.periods)
+        self.capable_teachers = roster.capable_teachers
+
+        # 日付ごとの開講可能コマ (defaultShiftPeriodsByDay) のビットマスク
+        self.date_index = {date_str: d_idx for d_idx, date_str in enumerate(available_dates)}
+        self.allowed_mask_by_date = {}
+        for d_idx, date_str in enumerate(available_dates):
+            day_jp_str = days_of_week_jp[date.fromisoformat(date_str).isoweekday() % 7]
+            default_periods = default_periods_by_day.get(day_jp_str, [])
+            mask = 0
+            for p in default_periods:
+                mask |= 1 << self.period_bit[p]
+            self.allowed_mask_by_date[date_str] = (d_idx, mask)
+
+        # 講師/生徒ごとの空きコマビットマスク
+        self.teacher_free = {t_id: self._build_mask(roster.teacher_day_masks[t_id]) for t_id in teachers_status}
+        self.student_free = {s_id: self._build_mask(roster.student_day_masks[s_id]) for s_id in students_status}
+
+    def _build_mask(self, day_masks):
+        mask = 0
+        for date_str, day_mask in day_masks.items():
+            entry = self.allowed_mask_by_date.get(date_str)
+            if entry is None:
+                continue
+            d_idx, allowed = entry
+            mask |= (day_mask & allowed) << (d_idx * self.num_periods)
+        return mask
+
+    def get_capable_teachers(self, student_affiliation, subject):
+        if not subject or not student_affiliation:
+            return []
+        return self.capable_teachers.get((student_affiliation, subject), [])
+
+    def iter_common_slots(self, teacher_id, student_id):
+        """講師と生徒が共に空いている (date_str, period) を日付順・時限昇順で返す。"""
+        common = self.teacher_free[teacher_id] & self.student_free[student_id]
+        while common:
+            low = common & -common
+            bit = low.bit_length() - 1
+            common ^= low
+            d_idx, p_idx = divmod(bit, self.num_periods)
+            yield self.available_dates[d_idx], self.periods[p_idx]
+
+    def count_common_slots(self, teacher_id, student_id):
+        """講師と生徒が共に空いているコマ数。"""
+        return (self.teacher_free[teacher_id] & self.student_free[student_id]).bit_count()
+
+    def slot_bit(self, date_str, period):
+        return self.date_index[date_str] * self.num_periods + self.period_bit[period]
+
+    def mark_assigned(self, teacher_id, student_id, date_str, period):
+        d_idx = self.date_index[date_str]
+        clear = ~(1 << (d_idx * self.num_periods + self.period_bit[period]))
+        if teacher_id in self.teacher_free:
+            self.teacher_free[teacher_id] &= clear
+        if student_id in self.student_free:
+            self.student_free[student_id] &= clear
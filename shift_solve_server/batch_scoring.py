@@ -0,0 +1,145 @@
+# python_shift_solver/batch_scoring.py
+import numpy as np
+
+IDLE_PREF_NO_GAP = '空きコマなし希望'
+IDLE_PREF_GAP_OK = '空きコマ許容'
+
+
+def _mask_to_bool_array(mask, num_bits):
+    """AvailabilityIndex のビットマスク (int) を長さ num_bits の bool 配列に変換する。"""
+    if num_bits == 0:
+        return np.zeros(0, dtype=bool)
+    raw = np.frombuffer(mask.to_bytes((num_bits + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder='little')[:num_bits].astype(bool)
+
+
+class BatchScorer:
+    """
+    フェーズ2の候補スコアリングを NumPy で一括計算するエンジン。
+
+    1ユニット (生徒, 科目) の候補を (講師idx, 日付idx, 時限idx) の配列として持ち、
+    get_score_for_assignment と minDesiredPeriods ペナルティを同時に計算する。
+    候補の並びは (講師順, 日付順, 時限昇順) で、np.argmax は最初の最大値を返すため
+    スカラー版の「score > best」による選択と同じ結果になる。
+    """
+
+    def __init__(self, availability, teachers_status, students_status):
+        self.availability = availability
+        self.available_dates = availability.available_dates
+        self.num_dates = len(self.available_dates)
+        self.num_periods = availability.num_periods
+        num_bits = self.num_dates * self.num_periods
+
+        self.teacher_ids = list(teachers_status.keys())
+        self.teacher_idx = {t_id: i for i, t_id in enumerate(self.teacher_ids)}
+        self.student_idx = {s_id: i for i, s_id in enumerate(students_status.keys())}
+        self.date_idx = {d: i for i, d in enumerate(self.available_dates)}
+        self.candidates_evaluated = 0
+
+        # 空きコマ (フェーズ1の割り当て反映済み) を bool 行列に展開
+        self.teacher_free = np.array(
+            [_mask_to_bool_array(availability.teacher_free[t_id], num_bits) for t_id in self.teacher_ids],
+            dtype=bool).reshape(len(self.teacher_ids), num_bits)
+        self.student_free = np.array(
+            [_mask_to_bool_array(availability.student_free[s_id], num_bits) for s_id in students_status],
+            dtype=bool).reshape(len(self.student_idx), num_bits)
+
+        # 講師の日別担当コマ数・希望コマ数・minDesiredPeriods
+        self.teacher_day_count = np.zeros((len(self.teacher_ids), self.num_dates), dtype=np.int64)
+        self.teacher_requested_count = np.zeros((len(self.teacher_ids), self.num_dates), dtype=np.int64)
+        self.teacher_min_desired = np.ones(len(self.teacher_ids), dtype=np.int64)
+        for i, t_id in enumerate(self.teacher_ids):
+            t_stat = teachers_status[t_id]
+            teacher = t_stat.obj
+            self.teacher_min_desired[i] = teacher.get('minDesiredPeriods', 1)
+            selected = teacher.get('selectedDateSlots', {})
+            for d_idx, date_str in enumerate(self.available_dates):
+                self.teacher_requested_count[i, d_idx] = len(selected.get(date_str, []))
+            self.teacher_day_count[i] = t_stat.day_counts
+
+        # 生徒の日別割り当て済み時限 (時限idx)
+        self.student_assigned = np.array(
+            [_mask_to_bool_array(s_stat.assigned_mask, num_bits) for s_stat in students_status.values()],
+            dtype=bool).reshape(len(self.student_idx), self.num_dates, self.num_periods)
+
+        # 時限の値と、値が ±1 の時限idx (存在しない場合は番兵列 num_periods)
+        self.period_values = np.array(availability.periods, dtype=np.int64)
+        self.prev_period_idx = np.array(
+            [availability.period_bit.get(p - 1, self.num_periods) for p in availability.periods], dtype=np.int64)
+        self.next_period_idx = np.array(
+            [availability.period_bit.get(p + 1, self.num_periods) for p in availability.periods], dtype=np.int64)
+
+    def _idle_penalty(self, student, s_idx):
+        """生徒の空きコマ希望によるペナルティを (日付idx, 時限idx) の行列で返す。"""
+        penalty = np.zeros((self.num_dates, self.num_periods), dtype=np.int64)
+        idle_pref = student.get('idleTimePreference')
+        if idle_pref not in (IDLE_PREF_NO_GAP, IDLE_PREF_GAP_OK):
+            return penalty
+
+        occupied = self.student_assigned[s_idx]
+        has_assignments = occupied.any(axis=1)[:, None]
+
+        if idle_pref == IDLE_PREF_NO_GAP:
+            # 直前/直後のコマが埋まっているか、既存コマの間 (空きを埋める形) なら連続とみなす
+            padded = np.concatenate([occupied, np.zeros((self.num_dates, 1), dtype=bool)], axis=1)
+            adjacent = padded[:, self.prev_period_idx] | padded[:, self.next_period_idx]
+            big = np.iinfo(np.int64).max
+            first = np.where(occupied, self.period_values, big).min(axis=1, initial=big)[:, None]
+            last = np.where(occupied, self.period_values, -big).max(axis=1, initial=-big)[:, None]
+            between = (first < self.period_values) & (self.period_values < last)
+            penalty[has_assignments & ~(adjacent | between)] = -200
+            return penalty
+
+        # 空きコマ許容: 候補コマを加えたときの最大空きコマ数
+        with_candidate = occupied[:, None, :] | np.eye(self.num_periods, dtype=bool)[None, :, :]
+        low = np.iinfo(np.int64).min
+        values = np.where(with_candidate, self.period_values, low)
+        prev_values = np.maximum.accumulate(values, axis=2)
+        prev_values = np.concatenate(
+            [np.full(prev_values.shape[:2] + (1,), low, dtype=np.int64), prev_values[:, :, :-1]], axis=2)
+        gaps = np.where(with_candidate & (prev_values > low), self.period_values - prev_values - 1, 0)
+        max_idle = gaps.max(axis=2, initial=0)
+        penalty[(max_idle == 1) & has_assignments] = -10
+        penalty[(max_idle == 2) & has_assignments] = -50
+        penalty[(max_idle > 2) & has_assignments] = -1000
+        return penalty
+
+    def best_candidate(self, student_id, student, capable_teacher_ids):
+        """
+        最良の候補を (score, date_str, period_num, teacher_id) で返す。候補がなければ None。
+        """
+        s_idx = self.student_idx[student_id]
+        cap_idx = np.array([self.teacher_idx[t_id] for t_id in capable_teacher_ids], dtype=np.int64)
+        common = self.teacher_free[cap_idx] & self.student_free[s_idx]
+        rows, bits = np.nonzero(common)
+        self.candidates_evaluated += rows.size
+        if rows.size == 0:
+            return None
+
+        t_arr = cap_idx[rows]
+        d_arr, p_arr = np.divmod(bits, self.num_periods)
+
+        # 1. 生徒の空きコマ希望
+        scores = 100 + self._idle_penalty(student, s_idx)[d_arr, p_arr]
+        # 2. 講師の負荷分散
+        current = self.teacher_day_count[t_arr, d_arr]
+        scores -= current * 5
+        # 3. 講師の minDesiredPeriods ペナルティ (この日がこのコマだけになる場合)
+        min_desired = self.teacher_min_desired[t_arr]
+        only_slot = (current + 1 < min_desired) & (self.teacher_requested_count[t_arr, d_arr] == current + 1) & (min_desired > 1)
+        scores -= only_slot * 500
+
+        best = int(np.argmax(scores))
+        return (int(scores[best]), self.available_dates[int(d_arr[best])],
+                self.availability.periods[int(p_arr[best])], self.teacher_ids[int(t_arr[best])])
+
+    def mark_assigned(self, teacher_id, student_id, date_str, period):
+        t_idx = self.teacher_idx[teacher_id]
+        s_idx = self.student_idx[student_id]
+        d_idx = self.date_idx[date_str]
+        p_idx = self.availability.period_bit[period]
+        bit = d_idx * self.num_periods + p_idx
+        self.teacher_free[t_idx, bit] = False
+        self.student_free[s_idx, bit] = False
+        self.teacher_day_count[t_idx, d_idx] += 1
+        self.student_assigned[s_idx, d_idx, p_idx] = True
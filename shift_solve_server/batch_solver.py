@@ -0,0 +1,213 @@
+# python_shift_solver/batch_solver.py
+"""
+複数シナリオ (教室・期間ごとの adminSettings の違いや、同じ名簿での what-if) の一括シフト生成。
+
+リクエストの teachers / students / adminSettings / constants / solverOptions を共通の入力とし、
+各シナリオはその一部を上書きする:
+  name: シナリオ名 (省略時は "scenario-<番号>")
+  adminSettings / solverOptions: 共通の値に項目単位で上書きする
+  teachers / students / constants: 指定した場合はリストごと置き換える
+
+名簿を置き換えないシナリオ同士では、日付の展開・担当可能講師インデックス・日付ごとの空き時限を
+ScenarioPrecompute で1回だけ計算して共有する (期間が違うシナリオ同士でも共有する)。シナリオは
+ワーカープロセスで並列に解き、共通の入力と親で作った事前計算はワーカーの初期化時に1回だけ送る。
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+from availability_index import AvailabilityIndex, RosterAvailability, shift_periods
+from job_queue import get_mp_context
+from metrics import new_solve_stats
+from schedule_quality import evaluate_schedule, schedule_cost
+from shift_generater import generate_actual_shifts, get_available_dates
+from solver_state import build_solver_state
+
+SCENARIO_FIELDS = ('teachers', 'students', 'adminSettings', 'constants', 'solverOptions')
+SCENARIO_FIELD_TYPES = {'teachers': list, 'students': list, 'adminSettings': dict, 'constants': dict,
+                        'solverOptions': dict}
+COMPARISON_METRICS = ('cost', 'units_assigned', 'units_unassigned', 'idle_gap_violations', 'idle_periods',
+                      'min_desired_shortfalls')
+
+logger = logging.getLogger(__name__)
+
+
+class ScenarioPrecompute:
+    """
+    シナリオ間で共有する事前計算のキャッシュ (generate_actual_shifts(precomputed=...) に渡す)。
+    日付の展開は期間・休日ごとに、RosterAvailability (担当可能講師と日付ごとの空き時限) は
+    名簿と時限の一覧ごとに1回だけ作る。期間だけが違うシナリオも同じ RosterAvailability を使い、
+    空き状況インデックスはシナリオごとにそこから日付の範囲の分だけ組み立てる。
+    講師・生徒リストはオブジェクトの同一性で見分けるので、同じ名簿のシナリオには同じリストを渡すこと。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dates = {}  # (開始日, 終了日, 休日) -> 日付リスト
+        self._rosters = {}  # (id(teachers), id(students), 時限の一覧) -> (teachers, students, RosterAvailability)
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # ワーカーへ initargs で送るとき用。id() は受け取ったプロセスでは変わるので、リストへの参照ごと送って付け直す
+        # (共通の入力と同じ initargs で送れば、リストは受け取り側でも共通の入力のものと同一になる)
+        return {'dates': self._dates, 'rosters': [(key[2], entry) for key, entry in self._rosters.items()]}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self._dates = state['dates']
+        for periods_key, (teachers, students, roster) in state['rosters']:
+            self._rosters[(id(teachers), id(students), periods_key)] = (teachers, students, roster)
+
+    def available_dates(self, admin_settings):
+        key = (admin_settings.get('commonShiftStartDate'), admin_settings.get('commonShiftEndDate'),
+               tuple(sorted(admin_settings.get('holidays', []))))
+        with self._lock:
+            if key not in self._dates:
+                self._dates[key] = get_available_dates(admin_settings)
+            return self._dates[key]
+
+    def roster_availability(self, teachers, students, teachers_status, students_status, admin_settings):
+        periods = shift_periods(admin_settings)
+        key = (id(teachers), id(students), tuple(periods))
+        with self._lock:
+            entry = self._rosters.get(key)
+            if entry is None:
+                self.misses += 1
+                # リストへの参照を持っておき、id が別のリストに再利用されないようにする
+                entry = self._rosters[key] = (teachers, students,
+                                              RosterAvailability(teachers_status, students_status, periods))
+            else:
+                self.hits += 1
+        return entry[2]
+
+    def availability_index(self, teachers, students, teachers_status, students_status, available_dates,
+                           admin_settings, days_of_week_jp):
+        roster = self.roster_availability(teachers, students, teachers_status, students_status, admin_settings)
+        return AvailabilityIndex(teachers_status, students_status, available_dates, admin_settings, days_of_week_jp,
+                                 roster=roster)
+
+    def prepare(self, base_input, scenarios):
+        """名簿を置き換えないシナリオの日付の展開と RosterAvailability を先に作っておく (プールを起動する前に親で呼ぶ)。"""
+        for scenario in scenarios:
+            if 'teachers' in scenario or 'students' in scenario:
+                continue
+            input_data = build_scenario_input(base_input, scenario)
+            admin_settings = input_data.get('adminSettings') or {}
+            teachers, students = input_data.get('teachers', []), input_data.get('students', [])
+            self.available_dates(admin_settings)
+            teachers_status, students_status = build_solver_state(teachers, students, 0)
+            self.roster_availability(teachers, students, teachers_status, students_status, admin_settings)
+
+
+def scenario_name(scenario, index):
+    return scenario.get('name') or f"scenario-{index}"
+
+
+def find_invalid_field(input_data):
+    """SCENARIO_FIELDS のうち型が正しくない項目 (teachers / students はリスト、ほかは dict) の名前。なければ None。"""
+    for field, expected_type in SCENARIO_FIELD_TYPES.items():
+        if field in input_data and not isinstance(input_data[field], expected_type):
+            return field
+    return None
+
+
+def build_scenario_input(base_input, scenario):
+    """共通の入力にシナリオの上書きを適用した入力 (名簿を置き換えない場合は同じリストを共有する)。"""
+    input_data = {field: base_input.get(field) for field in SCENARIO_FIELDS if field in base_input}
+    for field in ('teachers', 'students', 'constants'):
+        if field in scenario:
+            input_data[field] = scenario[field]
+    for field in ('adminSettings', 'solverOptions'):
+        if field in scenario or field in base_input:
+            input_data[field] = {**(base_input.get(field) or {}), **(scenario.get(field) or {})}
+    return input_data
+
+
+def solve_scenario(base_input, scenario, index, precomputed=None):
+    """1シナリオを解いて、割り当て・計測値・診断情報・品質指標を返す (失敗時は error)。"""
+    name = scenario_name(scenario, index)
+    input_data = build_scenario_input(base_input, scenario)
+    stats = new_solve_stats()
+    diagnostics = {}
+    try:
+        assignments = generate_actual_shifts(input_data, stats=stats, diagnostics=diagnostics,
+                                             precomputed=precomputed)
+    except Exception as e:
+        logger.exception("Scenario %s failed", name)
+        return {'index': index, 'name': name, 'error': f"{type(e).__name__}: {e}", 'details': traceback.format_exc()}
+    quality = evaluate_schedule(input_data, assignments)
+    return {'index': index, 'name': name, 'assignments': assignments, 'stats': stats, 'diagnostics': diagnostics,
+            'quality': quality, 'cost': schedule_cost(quality)}
+
+
+# ワーカープロセスの共通入力と事前計算 (親で作ったものをプールの初期化時に1回だけ受け取り、シナリオごとには送らない)
+_worker_input = None
+_worker_precompute = None
+
+
+def _init_worker(base_input, precomputed):
+    global _worker_input, _worker_precompute
+    _worker_input = base_input
+    _worker_precompute = precomputed
+
+
+def _solve_scenario_in_worker(scenario, index):
+    result = solve_scenario(_worker_input, scenario, index, _worker_precompute)
+    logger.debug("Worker %d shared roster availability: %d hits, %d misses", os.getpid(),
+                 _worker_precompute.hits, _worker_precompute.misses)
+    return result
+
+
+def solve_batch(base_input, scenarios, num_workers=None):
+    """
+    シナリオを解いて、結果をシナリオの順に返す。num_workers (既定は CPU 数) 個のワーカープロセスで並列に解く。
+    1プロセスの場合やジョブのワーカー (daemon プロセス) からの呼び出しでは、このプロセスで順に解く。
+    """
+    num_workers = max(1, int(num_workers or os.cpu_count() or 1))
+    started = time.perf_counter()
+    parallel = num_workers > 1 and len(scenarios) > 1 and not multiprocessing.current_process().daemon
+    precomputed = ScenarioPrecompute()
+    if parallel:
+        precomputed.prepare(base_input, scenarios)
+        pool = get_mp_context(['shift_generater', 'batch_solver']).Pool(
+            processes=min(num_workers, len(scenarios)), initializer=_init_worker, initargs=(base_input, precomputed))
+        try:
+            pending = [pool.apply_async(_solve_scenario_in_worker, (scenario, index))
+                       for index, scenario in enumerate(scenarios)]
+            results = [result.get() for result in pending]
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [solve_scenario(base_input, scenario, index, precomputed) for index, scenario in enumerate(scenarios)]
+        logger.debug("Shared roster availability: %d hits, %d misses", precomputed.hits, precomputed.misses)
+    logger.info("Batch: solved %d scenarios in %.0f ms (%s).", len(scenarios),
+                (time.perf_counter() - started) * 1000, f"{num_workers} workers" if parallel else "sequential")
+    return results
+
+
+def compare_scenarios(results):
+    """
+    シナリオの比較表。metrics はシナリオ名 -> 指標の値、delta_vs_first は最初のシナリオとの差
+    (コストは小さいほど良い)。失敗したシナリオは除く。
+    """
+    solved = [r for r in results if 'error' not in r]
+    if not solved:
+        return {'best': None, 'metrics': {}, 'delta_vs_first': {}, 'failed': [r['name'] for r in results]}
+    baseline = solved[0]
+
+    def metric_value(result, metric):
+        return result['cost'] if metric == 'cost' else result['quality'][metric]
+
+    best = min(solved, key=lambda r: (r['cost'], r['index']))
+    return {
+        'best': best['name'],
+        'metrics': {metric: {r['name']: metric_value(r, metric) for r in solved} for metric in COMPARISON_METRICS},
+        'delta_vs_first': {metric: {r['name']: metric_value(r, metric) - metric_value(baseline, metric) for r in solved}
+                           for metric in COMPARISON_METRICS},
+        'failed': [r['name'] for r in results if 'error' in r],
+    }
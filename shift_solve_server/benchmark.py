@@ -0,0 +1,189 @@
+# python_shift_solver/benchmark.py
+"""
+generate_actual_shifts のベンチマーク。
+
+season_generator で生成した入力 (seed 固定) を解き、ケースごとに
+実行時間・ピークメモリ・評価した候補数・品質指標 (schedule_quality) を表示して、
+保存済みのベースライン (benchmark_baseline.json) と比べる。
+
+    python benchmark.py                       # standard スイートを実行してベースラインと比較
+    python benchmark.py --suite full --repeat 3
+    python benchmark.py --save-baseline       # 現在の結果をベースラインとして保存
+    python benchmark.py --check-timing        # 実行時間・メモリの増加も悪化とみなす
+
+品質指標が悪化した場合は終了コード 1 を返す。実行時間・メモリが許容幅 (--tolerance) を超えて増えた場合は
+表示するだけで、--check-timing を付けたときだけ悪化とみなす (ベースラインと同じ環境で計測するとき用)。
+割り当てが変わっていないこと (scalar 版・ベースラインとの一致) は check_equivalence.py で確認する。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from metrics import new_solve_stats
+from schedule_quality import assignments_digest, evaluate_schedule
+from season_generator import generate_season
+from shift_generater import generate_actual_shifts
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# (ケース名, seed, 人数, 日数)
+BENCHMARK_CASES = [
+    ('tiny', 1, 10, 1),
+    ('small', 2, 60, 14),
+    ('medium', 3, 300, 30),
+    ('large', 4, 1000, 60),
+    ('xlarge', 5, 2000, 90),
+]
+SUITES = {
+    'quick': ['tiny', 'small', 'medium'],
+    'standard': ['tiny', 'small', 'medium', 'large'],
+    'full': [name for name, _, _, _ in BENCHMARK_CASES],
+}
+# 増えたら悪化とみなす品質指標
+QUALITY_METRICS = ('units_unassigned', 'idle_gap_violations', 'min_desired_shortfalls', 'conflicts')
+# 小さいケースの計測誤差で悪化と判定しないよう、これ未満の時間の増加は無視する
+MIN_TIME_INCREASE_MS = 5.0
+
+
+def run_case(seed, num_people, num_days, solver_options, repeat=1, measure_memory=True):
+    input_data = generate_season(seed, num_people=num_people, num_days=num_days)
+    input_data['solverOptions'] = dict(solver_options)
+
+    # 実行時間は tracemalloc なしで計測し、repeat 回のうち最小値を採る
+    timings = []
+    for _ in range(repeat):
+        stats = new_solve_stats()
+        started = time.perf_counter()
+        assignments = generate_actual_shifts(input_data, stats=stats)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    peak_memory_mb = None
+    if measure_memory:
+        tracemalloc.start()
+        generate_actual_shifts(input_data)
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    return {
+        'seed': seed,
+        'num_teachers': len(input_data['teachers']),
+        'num_students': len(input_data['students']),
+        'num_days': num_days,
+        'total_ms': min(timings),
+        'timings_ms': stats['timings_ms'],
+        'peak_memory_mb': peak_memory_mb,
+        'candidates_evaluated': stats['counters'].get('candidates_evaluated', 0),
+        'quality': evaluate_schedule(input_data, assignments),
+        'digest': assignments_digest(assignments),
+    }
+
+
+def compare_to_baseline(result, baseline, tolerance, check_timing=False):
+    """
+    ベースラインからの悪化を (問題の一覧, 参考の一覧, 結果が変わったか) で返す。
+    品質指標の悪化は常に問題とする。実行時間・メモリの増加は計測する環境や負荷で揺れるので、
+    check_timing のときだけ問題とし、それ以外は参考として表示するだけにする。
+    """
+    problems = []
+    resource_changes = []
+    if result['total_ms'] > baseline['total_ms'] * (1 + tolerance) and \
+            result['total_ms'] - baseline['total_ms'] >= MIN_TIME_INCREASE_MS:
+        resource_changes.append(f"time {baseline['total_ms']:.1f} -> {result['total_ms']:.1f} ms")
+    if result['peak_memory_mb'] is not None and baseline.get('peak_memory_mb') and \
+            result['peak_memory_mb'] > baseline['peak_memory_mb'] * (1 + tolerance):
+        resource_changes.append(f"memory {baseline['peak_memory_mb']:.1f} -> {result['peak_memory_mb']:.1f} MB")
+    for metric in QUALITY_METRICS:
+        before, after = baseline['quality'].get(metric, 0), result['quality'][metric]
+        if after > before:
+            problems.append(f"{metric} {before} -> {after}")
+    if check_timing:
+        return problems + resource_changes, [], result['digest'] != baseline.get('digest')
+    return problems, resource_changes, result['digest'] != baseline.get('digest')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="シフト生成のベンチマーク")
+    parser.add_argument('--suite', choices=list(SUITES), default='standard')
+    parser.add_argument('--case', action='append', help="実行するケース名 (複数指定可。--suite より優先)")
+    parser.add_argument('--repeat', type=int, default=1, help="実行時間を計測する回数 (最小値を採る)")
+    parser.add_argument('--scoring', choices=['vectorized', 'scalar'], default='vectorized')
+    parser.add_argument('--solver', choices=['greedy', 'cpsat', 'multistart'], default='greedy')
+    parser.add_argument('--local-search', action='store_true', help="フェーズ4の局所探索 (solverOptions.localSearch) を有効にする")
+    parser.add_argument('--no-memory', action='store_true', help="ピークメモリを計測しない (tracemalloc の実行を省く)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="結果をベースラインとして保存する")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="実行時間・メモリの許容増加率")
+    parser.add_argument('--check-timing', action='store_true',
+                        help="実行時間・メモリの増加も悪化とみなす (ベースラインと同じ環境で計測するときに使う)")
+    parser.add_argument('--output', help="結果を JSON で書き出すファイル")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.environ.get("SHIFT_LOG_LEVEL", "ERROR"),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    case_names = args.case or SUITES[args.suite]
+    cases = [case for case in BENCHMARK_CASES if case[0] in case_names]
+    solver_options = {'scoring': args.scoring, 'solver': args.solver}
+    if args.local_search:
+        solver_options['localSearch'] = True
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('solver_options') != solver_options:
+            print(f"Note: baseline was recorded with {baseline.get('solver_options')}, running with {solver_options}")
+
+    print(f"{'case':<8} {'teachers':>8} {'students':>8} {'days':>5} {'total_ms':>10} {'peak_MB':>8} "
+          f"{'candidates':>11} {'unassigned':>10} {'idle_viol':>9} {'min_short':>9}  baseline")
+    results = {}
+    num_regressions = 0
+    for name, seed, num_people, num_days in cases:
+        result = run_case(seed, num_people, num_days, solver_options,
+                          repeat=args.repeat, measure_memory=not args.no_memory)
+        results[name] = result
+        quality = result['quality']
+        status = ''
+        if baseline is not None and name in baseline['cases']:
+            problems, notes, changed = compare_to_baseline(result, baseline['cases'][name], args.tolerance,
+                                                           check_timing=args.check_timing)
+            if result['quality']['conflicts']:
+                problems.append(f"{result['quality']['conflicts']} double bookings")
+            num_regressions += bool(problems)
+            if changed:
+                notes.insert(0, 'assignments changed')
+            status = 'REGRESSION: ' + ', '.join(problems) if problems else 'ok' + (f" ({', '.join(notes)})" if notes else '')
+        peak = f"{result['peak_memory_mb']:.1f}" if result['peak_memory_mb'] is not None else '-'
+        print(f"{name:<8} {result['num_teachers']:>8} {result['num_students']:>8} {num_days:>5} "
+              f"{result['total_ms']:>10.1f} {peak:>8} {result['candidates_evaluated']:>11} "
+              f"{quality['units_unassigned']:>10} {quality['idle_gap_violations']:>9} "
+              f"{quality['min_desired_shortfalls']:>9}  {status}")
+
+    report = {
+        'solver_options': solver_options,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cases': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            # 今回実行しなかったケースは既存のベースラインを残す
+            with open(args.baseline, encoding='utf-8') as f:
+                report['cases'] = {**json.load(f).get('cases', {}), **results}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    return 1 if num_regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# python_shift_solver/check_equivalence.py
+"""
+高速化した実装が元の実装と同じ結果を返すことの確認。
+
+- 貪欲法: scoring "vectorized" と "scalar" の割り当てが一致し、ベースライン (benchmark_baseline.json の
+  digest) とも一致すること
+- 局所探索: 差分で更新した LocalSearch.objective が、実行後に compute_objective() で計算し直した値と一致すること
+  (seed を変えて複数回)
+
+    python check_equivalence.py                     # quick スイートと seed 1-3 の局所探索
+    python check_equivalence.py --suite standard --seeds 1 2 3 4 5
+
+一致しないものがあれば終了コード 1 を返す。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import local_search
+from benchmark import BENCHMARK_CASES, DEFAULT_BASELINE_PATH, SUITES
+from schedule_quality import assignments_digest
+from season_generator import generate_season
+from shift_generater import generate_actual_shifts
+
+DEFAULT_SEEDS = (1, 2, 3)
+LOCAL_SEARCH_CASES = ('small', 'medium')
+LOCAL_SEARCH_TIME_LIMIT_SECONDS = 1.0
+
+
+def check_scoring(name, seed, num_people, num_days, baseline_digest):
+    """vectorized / scalar の digest を比べて、問題の一覧を返す。"""
+    input_data = generate_season(seed, num_people=num_people, num_days=num_days)
+    digests = {}
+    for scoring in ('vectorized', 'scalar'):
+        input_data['solverOptions'] = {'scoring': scoring}
+        digests[scoring] = assignments_digest(generate_actual_shifts(input_data))
+    problems = []
+    if digests['vectorized'] != digests['scalar']:
+        problems.append(f"vectorized {digests['vectorized'][:12]} != scalar {digests['scalar'][:12]}")
+    if baseline_digest is not None and digests['vectorized'] != baseline_digest:
+        problems.append(f"vectorized {digests['vectorized'][:12]} != baseline {baseline_digest[:12]}")
+    return problems
+
+
+def check_local_search(name, seed, num_people, num_days, search_seeds):
+    """局所探索を seed ごとに実行し、実行後の objective と compute_objective() の食い違いを返す。"""
+    input_data = generate_season(seed, num_people=num_people, num_days=num_days)
+    mismatches = []
+    original_run = local_search.LocalSearch.run
+
+    def checked_run(self, *args, **kwargs):
+        summary = original_run(self, *args, **kwargs)
+        recomputed = self.compute_objective()
+        if recomputed != self.objective:
+            mismatches.append(f"objective {self.objective} != recomputed {recomputed} "
+                              f"after {summary['iterations']} iterations")
+        return summary
+
+    # generate_actual_shifts は local_search.LocalSearch を実行時に import するので、ここで差し替えれば使われる
+    local_search.LocalSearch.run = checked_run
+    try:
+        problems = []
+        for search_seed in search_seeds:
+            input_data['solverOptions'] = {'localSearch': True, 'randomSeed': search_seed,
+                                           'localSearchTimeLimitSeconds': LOCAL_SEARCH_TIME_LIMIT_SECONDS}
+            mismatches.clear()
+            generate_actual_shifts(input_data)
+            problems.extend(f"seed {search_seed}: {mismatch}" for mismatch in mismatches)
+        return problems
+    finally:
+        local_search.LocalSearch.run = original_run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="高速化した実装と元の実装の結果の一致を確認する")
+    parser.add_argument('--suite', choices=list(SUITES), default='quick')
+    parser.add_argument('--case', action='append', help="実行するケース名 (複数指定可。--suite より優先)")
+    parser.add_argument('--seeds', type=int, nargs='+', default=list(DEFAULT_SEEDS), help="局所探索の randomSeed")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.environ.get("SHIFT_LOG_LEVEL", "ERROR"),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    case_names = args.case or SUITES[args.suite]
+    cases = [case for case in BENCHMARK_CASES if case[0] in case_names]
+    baseline_cases = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        # ベースラインの digest は貪欲法 (vectorized) のもの
+        if baseline.get('solver_options', {}).get('solver', 'greedy') == 'greedy':
+            baseline_cases = baseline['cases']
+        else:
+            print(f"Note: baseline was recorded with {baseline.get('solver_options')}; digests are not compared")
+
+    num_failures = 0
+    for name, seed, num_people, num_days in cases:
+        baseline_digest = baseline_cases.get(name, {}).get('digest')
+        checks = [('scoring', check_scoring(name, seed, num_people, num_days, baseline_digest))]
+        if name in LOCAL_SEARCH_CASES:
+            checks.append(('local_search', check_local_search(name, seed, num_people, num_days, args.seeds)))
+        for check_name, problems in checks:
+            status = 'FAIL: ' + '; '.join(problems) if problems else 'ok'
+            print(f"{name:<8} {check_name:<13} {status}")
+            num_failures += bool(problems)
+
+    if num_failures:
+        print(f"{num_failures} check(s) failed.")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
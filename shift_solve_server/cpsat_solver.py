@@ -0,0 +1,276 @@
+# python_shift_solver/cpsat_solver.py
+import logging
+import threading
+import time
+
+from ortools.sat.python import cp_model
+
+from availability_index import AvailabilityIndex
+from regular_pairing import RegularPairingIndex
+from solver_state import build_solver_state
+
+# 目的関数の重み (大きいほど優先)
+WEIGHT_ASSIGNED_UNIT = 1000      # 希望コマを1コマ割り当てる
+WEIGHT_REGULAR_PAIRING = 50      # レギュラー講師との組み合わせ
+WEIGHT_IDLE_NO_GAP = 200         # 空きコマなし希望の生徒の空きコマ1つあたり
+WEIGHT_IDLE_GAP_OK = 10          # 空きコマ許容の生徒の空きコマ1つあたり
+WEIGHT_IDLE_OVER_LIMIT = 1500    # 空きコマ許容の生徒の3コマ以上の空き (割り当て1コマより重い)
+WEIGHT_MIN_DESIRED_SHORTFALL = 100  # 講師の minDesiredPeriods 不足1コマあたり
+
+DEFAULT_TIME_LIMIT_SECONDS = 30.0
+# 1ワーカーの探索はヒントからほとんど進まない (小さなモデルでも貪欲法の解のまま終わる) ので、CPU が少なくても
+# LNS を含む複数の探索を並べる (ワーカーは CPU を分け合う)
+DEFAULT_NUM_WORKERS = 8
+# 変数がこれより多いモデルは組み立てに時間がかかり制限時間内に解けないので、貪欲法の解をそのまま返す
+DEFAULT_MAX_VARIABLES = 200_000
+# 制限時間1秒あたりに扱える変数の数の目安。これより大きなモデルは組み立て (2万変数/秒程度) と探索に時間を取られ、
+# 制限時間内に貪欲法の解をほとんど改善できないので、組み立てずに貪欲法の解を返す
+# (1 CPU・30秒で、9.8万変数では目的関数が +1200、13万変数では +100 だった)
+VARIABLES_PER_SECOND = 3_500
+# モデル構築後の残り時間がこれ未満なら解かずに貪欲法の解を返す
+MIN_SOLVE_SECONDS = 0.5
+# 変数がこれより多いモデルは前処理とプロービングを省き、ヒント (完全な実行可能解) を直ちに初期解として採用させる
+# (大きなモデルでは前処理だけで制限時間の大半を使い、ヒントを使う前に時間切れになる)
+LIGHT_PRESOLVE_VARIABLES = 20_000
+# 前処理ありのときにヒントを修復する衝突数の上限 (repair_hint は前処理なしでは使えない)
+HINT_CONFLICT_LIMIT = 100
+# 探索中に cancel_event を確認する間隔 (秒)
+CANCEL_POLL_SECONDS = 0.2
+
+logger = logging.getLogger(__name__)
+
+
+def solve_with_cpsat(input_data, greedy_assignments, available_dates, solver_options, summary=None,
+                     cancel_event=None):
+    """
+    CP-SAT で全体最適化したシフトを返す。greedy_assignments を初期解のヒントに使う。
+    実行可能解が見つからない場合は greedy_assignments をそのまま返す。
+
+    timeLimitSeconds はモデル構築を含めた上限で、ソルバーには構築後の残り時間だけを渡す。
+    変数が maxVariables か timeLimitSeconds * VARIABLES_PER_SECOND を超える場合や、構築中に時間切れになった場合も
+    greedy_assignments を返す。
+    summary (dict) を渡すと、変数の数・状態・貪欲法の解 (ヒント) と結果の目的関数値、
+    貪欲法の解を返した場合はその理由 (fallback) を書き込む。
+    cancel_event (threading.Event) がセットされると、構築中なら greedy_assignments を返し、探索中なら探索を止めて
+    それまでの最良解を返す。
+
+    ハード制約: 所属ごとの担当可能科目、講師/生徒の空きコマ、ダブルブッキング禁止、
+    希望コマ数の上限。
+    目的関数: 割り当てコマ数、レギュラー講師との組み合わせ、空きコマ (空きコマ許容の生徒の3コマ以上の空きは
+    大きなペナルティ)、minDesiredPeriods 不足。
+    """
+    started = time.perf_counter()
+    if summary is None:
+        summary = {}
+    summary.update({'variables': None, 'status': None, 'greedy_objective': None, 'objective': None,
+                    'improvement': 0, 'fallback': None})
+    time_limit = float(solver_options.get('timeLimitSeconds', DEFAULT_TIME_LIMIT_SECONDS))
+    max_variables = int(solver_options.get('maxVariables', DEFAULT_MAX_VARIABLES))
+    deadline = started + time_limit
+    teachers_orig = input_data.get('teachers', [])
+    students_orig = input_data.get('students', [])
+    admin_settings = input_data.get('adminSettings', {})
+    days_of_week_jp = input_data.get('constants', {}).get('DAYS_OF_WEEK_JP', [])
+
+    teachers_status, students_status = build_solver_state(teachers_orig, students_orig, len(available_dates))
+    availability = AvailabilityIndex(teachers_status, students_status, available_dates, admin_settings, days_of_week_jp)
+    periods = availability.periods
+    regular_pairings = RegularPairingIndex(teachers_status, students_status)
+
+    # 変数 (割り当て候補) の数はビットマスクから数えられるので、組み立てる前に上限を確認する
+    num_candidates = 0
+    for s_id, s_stat in students_status.items():
+        student = s_stat.obj
+        for course in student.get('desiredCourses', []):
+            if course['units'] <= 0:
+                continue
+            for t_id in availability.get_capable_teachers(student.get('affiliation'), course['subject']):
+                num_candidates += availability.count_common_slots(t_id, s_id)
+    summary['variables'] = num_candidates
+    if num_candidates > max_variables:
+        logger.warning("CP-SAT: %d variables exceed the limit of %d. Falling back to greedy assignments.",
+                       num_candidates, max_variables)
+        summary['fallback'] = 'too_many_variables'
+        return greedy_assignments
+    if num_candidates > time_limit * VARIABLES_PER_SECOND:
+        logger.warning("CP-SAT: %d variables are too many to improve on the greedy assignments within %.1fs "
+                       "(up to %d). Falling back to greedy assignments.",
+                       num_candidates, time_limit, int(time_limit * VARIABLES_PER_SECOND))
+        summary['fallback'] = 'model_too_large_for_time_limit'
+        return greedy_assignments
+
+    # 貪欲法の解 (warm start 用)。補助変数のヒントもここから計算して完全な初期解にする
+    greedy_keys = {(a['studentId'], a['subject'], a['teacherId'], a['date'], a['period']) for a in greedy_assignments}
+    greedy_student_slots = {(a['studentId'], a['date'], a['period']) for a in greedy_assignments}
+    greedy_teacher_day_count = {}
+    for a in greedy_assignments:
+        key = (a['teacherId'], a['date'])
+        greedy_teacher_day_count[key] = greedy_teacher_day_count.get(key, 0) + 1
+
+    model = cp_model.CpModel()
+    x = {}  # (student_id, subject, teacher_id, date_str, period) -> BoolVar
+    by_teacher_slot = {}  # (teacher_id, date_str, period) -> [var]
+    by_student_slot = {}  # (student_id, date_str, period) -> [var]
+    by_teacher_date = {}  # (teacher_id, date_str) -> [var]
+    objective = []  # (変数, 係数)。式の足し算を繰り返すと遅いので最後に WeightedSum でまとめる
+    hint_values = {}  # 変数の index -> ヒントの値 (貪欲法の解の目的関数値を求める)
+
+    def add_hint(var, value):
+        model.AddHint(var, value)
+        hint_values[var.Index()] = int(value)
+
+    for s_id, s_stat in students_status.items():
+        if time.perf_counter() > deadline:
+            logger.warning("CP-SAT: Time limit reached while building the model. Falling back to greedy assignments.")
+            summary['fallback'] = 'build_time_limit'
+            return greedy_assignments
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info("CP-SAT: Cancelled while building the model. Returning greedy assignments.")
+            summary['fallback'] = 'cancelled'
+            return greedy_assignments
+        student = s_stat.obj
+        desired_units = {course['subject']: course['units'] for course in student.get('desiredCourses', [])}
+        regular = regular_pairings.get(s_id, student)
+        for subject, units in desired_units.items():
+            if units <= 0:
+                continue
+            unit_vars = []
+            for t_id in availability.get_capable_teachers(student.get('affiliation'), subject):
+                for date_str, period in availability.iter_common_slots(t_id, s_id):
+                    key = (s_id, subject, t_id, date_str, period)
+                    var = model.NewBoolVar(f"x_{s_id}_{subject}_{t_id}_{date_str}_{period}")
+                    add_hint(var, key in greedy_keys)
+                    x[key] = var
+                    unit_vars.append(var)
+                    by_teacher_slot.setdefault((t_id, date_str, period), []).append(var)
+                    by_student_slot.setdefault((s_id, date_str, period), []).append(var)
+                    by_teacher_date.setdefault((t_id, date_str), []).append(var)
+                    weight = WEIGHT_ASSIGNED_UNIT
+                    if regular.get(subject) == t_id:
+                        weight += WEIGHT_REGULAR_PAIRING
+                    objective.append((var, weight))
+            if unit_vars:
+                model.Add(cp_model.LinearExpr.Sum(unit_vars) <= units)
+
+    # ダブルブッキング禁止 (生徒側はコマの占有変数 y を定義して兼ねる)
+    for slot_vars in by_teacher_slot.values():
+        if len(slot_vars) > 1:
+            model.AddAtMostOne(slot_vars)
+    student_occupied = {}  # (student_id, date_str, period) -> BoolVar
+    for (s_id, date_str, period), slot_vars in by_student_slot.items():
+        occ = model.NewBoolVar(f"y_{s_id}_{date_str}_{period}")
+        model.Add(occ == cp_model.LinearExpr.Sum(slot_vars))
+        add_hint(occ, (s_id, date_str, period) in greedy_student_slots)
+        student_occupied[(s_id, date_str, period)] = occ
+
+    # 生徒の空きコマ: idle >= last - first + 1 - (その日のコマ数)
+    low, high = (periods[0] - 1, periods[-1] + 1) if periods else (0, 0)
+    for s_id, s_stat in students_status.items():
+        idle_pref = s_stat.obj.get('idleTimePreference')
+        if idle_pref not in ('空きコマなし希望', '空きコマ許容'):
+            continue
+        for date_str in available_dates:
+            occupied = {p: student_occupied[(s_id, date_str, p)] for p in periods if (s_id, date_str, p) in student_occupied}
+            if len(occupied) < 2:
+                continue
+            hinted = sorted(p for p in occupied if (s_id, date_str, p) in greedy_student_slots)
+            first = model.NewIntVar(low, high, f"first_{s_id}_{date_str}")
+            last = model.NewIntVar(low, high, f"last_{s_id}_{date_str}")
+            for period, occ in occupied.items():
+                model.Add(first <= period).OnlyEnforceIf(occ)
+                model.Add(last >= period).OnlyEnforceIf(occ)
+            idle = model.NewIntVar(0, high - low, f"idle_{s_id}_{date_str}")
+            model.Add(idle >= last - first + 1 - cp_model.LinearExpr.Sum(list(occupied.values())))
+            add_hint(first, hinted[0] if hinted else high)
+            add_hint(last, hinted[-1] if hinted else low)
+            add_hint(idle, hinted[-1] - hinted[0] + 1 - len(hinted) if hinted else 0)
+            if idle_pref == '空きコマなし希望':
+                objective.append((idle, -WEIGHT_IDLE_NO_GAP))
+            else:
+                objective.append((idle, -WEIGHT_IDLE_GAP_OK))
+                # 3コマ以上の空きは実質不可 (スカラー版の -1000 に相当)。
+                # フェーズ1の割り当てが違反している場合でも初期解が実行可能になるよう、ソフト制約にする
+                occupied_periods = sorted(occupied)
+                for i, p_from in enumerate(occupied_periods):
+                    for p_to in occupied_periods[i + 1:]:
+                        if p_to - p_from - 1 > 2:
+                            between = [occupied[p] for p in occupied_periods if p_from < p < p_to]
+                            violated = model.NewBoolVar(f"idle_over_{s_id}_{date_str}_{p_from}_{p_to}")
+                            model.Add(occupied[p_from] + occupied[p_to] - 1 <= sum(between) + violated)
+                            add_hint(violated, p_from in hinted and p_to in hinted and
+                                          not any(p_from < p < p_to for p in hinted))
+                            objective.append((violated, -WEIGHT_IDLE_OVER_LIMIT))
+
+    # 講師の minDesiredPeriods: 出勤した日のコマ数の不足分をペナルティ
+    for (t_id, date_str), day_vars in by_teacher_date.items():
+        min_desired = teachers_status[t_id].obj.get('minDesiredPeriods', 1)
+        if min_desired <= 1:
+            continue
+        hinted_count = greedy_teacher_day_count.get((t_id, date_str), 0)
+        works = model.NewBoolVar(f"works_{t_id}_{date_str}")
+        model.AddMaxEquality(works, day_vars)
+        shortfall = model.NewIntVar(0, min_desired, f"shortfall_{t_id}_{date_str}")
+        model.Add(shortfall >= min_desired * works - cp_model.LinearExpr.Sum(day_vars))
+        add_hint(works, hinted_count > 0)
+        add_hint(shortfall, max(0, min_desired - hinted_count) if hinted_count > 0 else 0)
+        objective.append((shortfall, -WEIGHT_MIN_DESIRED_SHORTFALL))
+
+    model.Maximize(cp_model.LinearExpr.WeightedSum([var for var, _ in objective], [coeff for _, coeff in objective]))
+    summary['greedy_objective'] = sum(coeff * hint_values.get(var.Index(), 0) for var, coeff in objective)
+
+    remaining = deadline - time.perf_counter()
+    if remaining < MIN_SOLVE_SECONDS:
+        logger.warning("CP-SAT: Only %.2fs left after building the model. Falling back to greedy assignments.",
+                       max(remaining, 0.0))
+        summary['fallback'] = 'no_time_left'
+        return greedy_assignments
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = remaining
+    solver.parameters.num_workers = int(solver_options.get('numWorkers', DEFAULT_NUM_WORKERS))
+    if len(x) > LIGHT_PRESOLVE_VARIABLES:
+        solver.parameters.cp_model_presolve = False
+        solver.parameters.cp_model_probing_level = 0
+    else:
+        solver.parameters.repair_hint = True
+        solver.parameters.hint_conflict_limit = HINT_CONFLICT_LIMIT
+    if 'randomSeed' in solver_options:
+        solver.parameters.random_seed = int(solver_options['randomSeed'])
+
+    logger.info("CP-SAT: %d variables, built in %.2fs, time limit %.2fs, %d workers",
+                len(x), time.perf_counter() - started, solver.parameters.max_time_in_seconds,
+                solver.parameters.num_workers)
+    solve_finished = threading.Event()
+    if cancel_event is not None:
+        def stop_on_cancel():
+            while not solve_finished.wait(CANCEL_POLL_SECONDS):
+                if cancel_event.is_set():
+                    logger.info("CP-SAT: Cancelled. Stopping the search.")
+                    solver.stop_search()
+                    return
+        threading.Thread(target=stop_on_cancel, name="cpsat-cancel-watcher", daemon=True).start()
+    try:
+        status = solver.Solve(model)
+    finally:
+        solve_finished.set()
+    summary['status'] = solver.StatusName(status)
+    logger.info("CP-SAT: status=%s, objective=%s (greedy %d), wall_time=%.2fs", solver.StatusName(status),
+                solver.ObjectiveValue() if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else 'N/A',
+                summary['greedy_objective'], solver.WallTime())
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        logger.warning("CP-SAT: No feasible solution found. Falling back to greedy assignments.")
+        summary['fallback'] = 'no_solution'
+        return greedy_assignments
+    summary['objective'] = int(solver.ObjectiveValue())
+    summary['improvement'] = summary['objective'] - summary['greedy_objective']
+
+    assignments = []
+    for (s_id, subject, t_id, date_str, period), var in x.items():
+        if solver.Value(var):
+            assignments.append({
+                "date": date_str, "period": period, "teacherId": t_id,
+                "teacherName": teachers_status[t_id].obj.get('name'), "studentId": s_id,
+                "studentName": students_status[s_id].obj.get('name'), "subject": subject
+            })
+    assignments.sort(key=lambda a: (a['date'], a['period']))
+    return assignments
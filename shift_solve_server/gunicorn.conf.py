@@ -0,0 +1,25 @@
+# python_shift_solver/gunicorn.conf.py
+# 本番用の gunicorn 設定: gunicorn -c gunicorn.conf.py wsgi:app
+import os
+
+bind = os.environ.get("SHIFT_BIND", "0.0.0.0:5001")
+# /generate_schedule はリクエストを受けたワーカーで解くので、CPU 数だけワーカーを起動して並列に解く
+workers = int(os.environ.get("SHIFT_WEB_WORKERS", str(os.cpu_count() or 1)))
+# ストリーミング (/generate_schedule/stream) で1リクエストがワーカーを占有しないようスレッドで並行処理する
+worker_class = "gthread"
+threads = int(os.environ.get("SHIFT_WEB_THREADS", "4"))
+
+# 結果キャッシュとジョブ (/jobs) の状態はディスクに置いてワーカー間で共有する
+# (どのワーカーに届いても /jobs/<id> が見つかり、キャッシュも共有される)。SHIFT_STATE_DIR で置き場所を変えられる
+state_dir = os.environ.get("SHIFT_STATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "server_state"))
+os.environ.setdefault("SHIFT_CACHE_DIR", os.path.join(state_dir, "result_cache"))
+os.environ.setdefault("SHIFT_JOB_STATE_DIR", os.path.join(state_dir, "jobs"))
+# ジョブのワーカープロセスは Web ワーカーごとに起動するので、合計が CPU 数程度になるよう分ける
+os.environ.setdefault("SHIFT_JOB_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
+# ソルバーと OR-Tools の import をマスタープロセスで1回だけ行う (wsgi.py)
+preload_app = True
+# 大きな入力の求解は数十秒かかることがある
+timeout = int(os.environ.get("SHIFT_WEB_TIMEOUT_SECONDS", "660"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
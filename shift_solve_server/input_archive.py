@@ -0,0 +1,237 @@
+# python_shift_solver/input_archive.py
+"""
+受け取った入力のアーカイブ。
+
+/generate_schedule の入力を、リクエスト処理とは別のバックグラウンドスレッドで
+gzip 圧縮した JSON (<キー>.json.gz) として保存する。キーは入力の内容ハッシュ
+(result_cache.make_cache_key) なので、同じ入力は1ファイルにまとまる。
+件数・経過日数・合計サイズの上限を超えたものは古い順に削除する。
+
+保存した入力はコマンドラインからソルバーに流し直せる (回帰・性能確認用):
+
+    python input_archive.py list
+    python input_archive.py replay --limit 20 --scoring scalar
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FILE_SUFFIX = '.json.gz'
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input_archive')
+
+
+def _entry_key(file_name):
+    return file_name[:-len(ARCHIVE_FILE_SUFFIX)]
+
+
+def list_entries(archive_dir):
+    """アーカイブ内のエントリを [(key, path, mtime, size)] で古い順に返す。"""
+    entries = []
+    try:
+        file_names = os.listdir(archive_dir)
+    except FileNotFoundError:
+        return entries
+    for file_name in file_names:
+        if not file_name.endswith(ARCHIVE_FILE_SUFFIX):
+            continue
+        path = os.path.join(archive_dir, file_name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # 削除と競合した
+        entries.append((_entry_key(file_name), path, st.st_mtime, st.st_size))
+    entries.sort(key=lambda entry: entry[2])
+    return entries
+
+
+def load_entry(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class InputArchive:
+    """
+    入力スナップショットの非同期ライター。submit() はキューに積むだけで、
+    シリアライズ・圧縮・書き込み・古いエントリの削除はライタースレッドが行う。
+    キューが一杯のとき (書き込みが追いつかないとき) はリクエストを遅らせず、そのスナップショットを捨てる。
+    """
+
+    def __init__(self, archive_dir=DEFAULT_ARCHIVE_DIR, max_entries=1000, max_age_days=30,
+                 max_total_mb=512, queue_size=64, compresslevel=6):
+        self.archive_dir = archive_dir
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 3600 if max_age_days else None
+        self.max_total_bytes = int(max_total_mb * 1024 * 1024) if max_total_mb else None
+        self.compresslevel = compresslevel
+        self.num_written = 0
+        self.num_deduplicated = 0
+        self.num_dropped = 0
+        self.num_failed = 0
+        os.makedirs(archive_dir, exist_ok=True)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = threading.Thread(target=self._write_loop, name='input-archive-writer', daemon=True)
+        self._writer.start()
+
+    def submit(self, key, input_data):
+        """入力をアーカイブに積む。キューが一杯で捨てた場合は False。"""
+        try:
+            self._queue.put_nowait((key, input_data, time.time()))
+            return True
+        except queue.Full:
+            self.num_dropped += 1
+            logger.warning("Input archive queue is full; dropped snapshot %s", key)
+            return False
+
+    def flush(self):
+        """キューに積まれた分の書き込みが終わるまで待つ。"""
+        self._queue.join()
+
+    def stats(self):
+        return {
+            'archive_dir': self.archive_dir,
+            'pending': self._queue.qsize(),
+            'written': self.num_written,
+            'deduplicated': self.num_deduplicated,
+            'dropped': self.num_dropped,
+            'failed': self.num_failed,
+        }
+
+    def _write_loop(self):
+        self._prune()
+        while True:
+            key, input_data, received_at = self._queue.get()
+            try:
+                self._write_entry(key, input_data, received_at)
+                self._prune()
+            except Exception:
+                self.num_failed += 1
+                logger.exception("Failed to archive input %s", key)
+            finally:
+                self._queue.task_done()
+
+    def _write_entry(self, key, input_data, received_at):
+        path = os.path.join(self.archive_dir, key + ARCHIVE_FILE_SUFFIX)
+        if os.path.exists(path):
+            # 同じ内容は書き直さず、最終受信時刻 (保持期間の基準) だけ更新する
+            os.utime(path, (received_at, received_at))
+            self.num_deduplicated += 1
+            return
+        tmp_path = path + '.tmp'
+        data = json.dumps(input_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        with gzip.open(tmp_path, 'wb', compresslevel=self.compresslevel) as f:
+            f.write(data)
+        os.utime(tmp_path, (received_at, received_at))
+        os.replace(tmp_path, path)
+        self.num_written += 1
+        logger.debug("Archived input %s (%d bytes -> %d bytes)", key, len(data), os.path.getsize(path))
+
+    def _prune(self):
+        """保持ポリシー (件数・経過日数・合計サイズ) を超えたエントリを古い順に削除する。"""
+        entries = list_entries(self.archive_dir)
+        now = time.time()
+        total_bytes = sum(entry[3] for entry in entries)
+        remaining = len(entries)
+        for key, path, mtime, size in entries:
+            expired = self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+            too_many = self.max_entries is not None and remaining > self.max_entries
+            too_large = self.max_total_bytes is not None and total_bytes > self.max_total_bytes
+            if not (expired or too_many or too_large):
+                break  # 古い順なので、これ以降は保持対象
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            remaining -= 1
+            total_bytes -= size
+            logger.debug("Pruned archived input %s", key)
+
+
+def _replay(args):
+    from metrics import new_solve_stats
+    from shift_generater import generate_actual_shifts
+
+    entries = list_entries(args.archive_dir)
+    if args.key:
+        entries = [entry for entry in entries if entry[0].startswith(tuple(args.key))]
+    if args.limit:
+        entries = entries[-args.limit:]
+    if not entries:
+        print(f"No archived inputs found in {args.archive_dir}")
+        return 1
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    print(f"{'key':<16} {'teachers':>8} {'students':>8} {'assigned':>8} {'unassigned':>10} {'total_ms':>10}")
+    num_failed = 0
+    for key, path, _, _ in entries:
+        input_data = load_entry(path)
+        solver_options = dict(input_data.get('solverOptions') or {})
+        if args.scoring:
+            solver_options['scoring'] = args.scoring
+        if args.solver:
+            solver_options['solver'] = args.solver
+        input_data['solverOptions'] = solver_options
+
+        stats = new_solve_stats()
+        record = {'key': key, 'num_teachers': len(input_data.get('teachers', [])),
+                  'num_students': len(input_data.get('students', []))}
+        try:
+            assignments = generate_actual_shifts(input_data, stats=stats)
+            record['num_assignments'] = len(assignments)
+        except Exception as e:
+            num_failed += 1
+            record['error'] = f"{type(e).__name__}: {e}"
+        record['stats'] = stats
+
+        if 'error' in record:
+            print(f"{key[:16]:<16} {record['num_teachers']:>8} {record['num_students']:>8} FAILED: {record['error']}")
+        else:
+            print(f"{key[:16]:<16} {record['num_teachers']:>8} {record['num_students']:>8} "
+                  f"{record['num_assignments']:>8} {stats['counters'].get('units_unassigned', 0):>10} "
+                  f"{stats['timings_ms'].get('total', 0.0):>10.1f}")
+        if output:
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+    if output:
+        output.close()
+    return 1 if num_failed else 0
+
+
+def _list(args):
+    entries = list_entries(args.archive_dir)
+    for key, _, mtime, size in entries:
+        print(f"{key}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))}  {size:>10}")
+    print(f"{len(entries)} entries, {sum(entry[3] for entry in entries)} bytes")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="アーカイブした入力の一覧表示・ソルバーへの再投入")
+    parser.add_argument('--archive-dir', default=os.environ.get('SHIFT_ARCHIVE_DIR') or DEFAULT_ARCHIVE_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help="エントリを古い順に表示する")
+
+    replay_parser = subparsers.add_parser('replay', help="エントリをソルバーで解き直して計測値を表示する")
+    replay_parser.add_argument('--key', action='append', help="キー (前方一致)。複数指定可")
+    replay_parser.add_argument('--limit', type=int, help="新しい方から N 件だけ解く")
+    replay_parser.add_argument('--scoring', choices=['vectorized', 'scalar'], help="solverOptions.scoring を上書きする")
+    replay_parser.add_argument('--solver', choices=['greedy', 'cpsat', 'multistart'], help="solverOptions.solver を上書きする")
+    replay_parser.add_argument('--output', help="エントリごとの結果と stats を JSON Lines で書き出すファイル")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.environ.get("SHIFT_LOG_LEVEL", "WARNING"),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.command == 'list':
+        return _list(args)
+    return _replay(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
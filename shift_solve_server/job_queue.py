@@ -0,0 +1,414 @@
+# python_shift_solver/job_queue.py
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from multiprocessing.connection import wait
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_TIMED_OUT = 'timed_out'
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED, JOB_TIMED_OUT)
+
+JOB_FILE_SUFFIX = '.json.gz'
+CANCEL_FILE_SUFFIX = '.cancel'
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+# 他のプロセスのジョブをキャンセルしたとき、そのプロセスが停止するのを待つ秒数
+REMOTE_CANCEL_WAIT_SECONDS = 3.0
+# state_dir の古いファイル (終了したプロセスのジョブなど) を掃除する間隔
+STATE_PURGE_INTERVAL_SECONDS = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def get_mp_context(preload_modules):
+    # forkserver: スレッドを持つサーバープロセスから fork せずに済み、
+    # preload したモジュール (ソルバー) の import は forkserver で1回だけ行われる
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload(preload_modules)
+        return ctx
+    return multiprocessing.get_context('spawn')
+
+
+def _run_job(target, payload, conn):
+    """ワーカープロセスで実行される。進捗・結果・エラーを conn 経由で親プロセスに送る。"""
+    def progress_callback(event):
+        # 割り当て1件ごとのイベント (ストリーミング用) はジョブの進捗には不要なので送らない
+        if event['event'] not in ('assignment', 'unassigned'):
+            conn.send(('progress', event))
+
+    try:
+        result = target(payload, progress_callback=progress_callback)
+        conn.send(('result', result))
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {e}", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class JobQueue:
+    """
+    シフト生成ジョブのキュー。ジョブごとにワーカープロセスを起動し、同時実行数を max_workers に制限する。
+    実行中のジョブもプロセスを停止することでキャンセル・タイムアウトできる
+    (ProcessPoolExecutor では実行中のタスクを止められないため、プロセスを直接管理する)。
+
+    target は target(payload, progress_callback=...) の形で呼ばれ、戻り値がジョブの結果になる。
+    on_complete は成功したジョブの dict (result, metadata を含む) を引数にディスパッチャースレッドで呼ばれる。
+
+    state_dir を指定すると、ジョブの状態が変わるたびに <job_id>.json.gz に書き出す。同じ state_dir を使う
+    他のプロセス (gunicorn の別のワーカー) のジョブも get で参照でき、cancel は <job_id>.cancel を置いて
+    ジョブを持つプロセスに停止を依頼する。
+    """
+
+    def __init__(self, target, max_workers=2, max_pending=32, default_time_limit_seconds=600,
+                 retention_seconds=3600, on_complete=None, preload_modules=(), state_dir=None):
+        self.target = target
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.default_time_limit_seconds = default_time_limit_seconds
+        self.retention_seconds = retention_seconds
+        self.on_complete = on_complete
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self._last_state_purge = 0.0
+        self._ctx = get_mp_context(list(preload_modules))
+        self._jobs = {}  # job_id -> job dict
+        self._pending = deque()  # job_id
+        self._running = {}  # job_id -> (process, conn)
+        self._lock = threading.Condition()
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='job-dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, payload, time_limit_seconds=None, metadata=None):
+        """time_limit_seconds は default_time_limit_seconds を上限とする (None なら既定値)。"""
+        if time_limit_seconds is None:
+            time_limit_seconds = self.default_time_limit_seconds
+        else:
+            time_limit_seconds = min(float(time_limit_seconds), self.default_time_limit_seconds)
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs ({len(self._pending)}). Try again later.")
+            self._jobs[job_id] = {
+                'id': job_id,
+                'status': JOB_QUEUED,
+                'progress': None,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'time_limit_seconds': time_limit_seconds,
+                'error': None,
+                'details': None,
+                'result': None,
+                'payload': payload,
+                'metadata': metadata or {},
+            }
+            self._save(self._jobs[job_id])
+            self._pending.append(job_id)
+            self._lock.notify()
+        return job_id
+
+    def add_completed(self, result):
+        """既に結果がある (キャッシュヒットなど) 場合に、完了済みのジョブとして登録する。"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                'id': job_id, 'status': JOB_SUCCEEDED, 'progress': None,
+                'submitted_at': now, 'started_at': now, 'finished_at': now,
+                'time_limit_seconds': None, 'error': None, 'details': None,
+                'result': result, 'payload': None, 'metadata': {},
+            }
+            self._save(self._jobs[job_id])
+        return job_id
+
+    def get(self, job_id, include_result=False):
+        """ジョブの状態を dict で返す。存在しない場合は None。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return self._get_remote(job_id, include_result)
+            info = {k: v for k, v in job.items() if k not in ('result', 'payload', 'metadata')}
+            if job['status'] == JOB_QUEUED:
+                info['queue_position'] = list(self._pending).index(job_id) + 1
+            if include_result:
+                info['result'] = job['result']
+            return info
+
+    def cancel(self, job_id):
+        """ジョブをキャンセルする。キャンセルできた (未完了だった) 場合は True。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if job['status'] in FINISHED_STATUSES:
+                    return False
+                self._cancel_locked(job)
+                self._lock.notify()
+                return True
+        return self._cancel_remote(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'running': len(self._running),
+                'pending': len(self._pending),
+                'jobs_by_status': counts,
+            }
+
+    # --- 状態の共有 (state_dir) ---
+
+    def _job_path(self, job_id, suffix=JOB_FILE_SUFFIX):
+        return os.path.join(self.state_dir, job_id + suffix)
+
+    def _save(self, job):
+        """ジョブの状態を書き出す (lock を取って呼ぶ)。"""
+        if not self.state_dir:
+            return
+        snapshot = {k: v for k, v in job.items() if k != 'payload'}
+        snapshot['owner_pid'] = os.getpid()
+        tmp_path = self._job_path(job['id']) + f'.{os.getpid()}.tmp'
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self._job_path(job['id']))
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Failed to save state of job %s: %s", job['id'], e)
+
+    def _load(self, job_id):
+        """他のプロセスが書き出したジョブの状態。なければ None。"""
+        if not self.state_dir or not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        try:
+            with gzip.open(self._job_path(job_id), 'rt', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping unreadable state of job %s: %s", job_id, e)
+            return None
+        if snapshot['status'] not in FINISHED_STATUSES and not _process_alive(snapshot.get('owner_pid')):
+            # ジョブを持っていたプロセスが (再起動などで) 終了した
+            snapshot.update(status=JOB_FAILED, error="The server process running the job exited", result=None)
+        return snapshot
+
+    def _get_remote(self, job_id, include_result):
+        snapshot = self._load(job_id)
+        if snapshot is None:
+            return None
+        info = {k: v for k, v in snapshot.items() if k not in ('result', 'metadata', 'owner_pid')}
+        if include_result:
+            info['result'] = snapshot['result']
+        return info
+
+    def _cancel_remote(self, job_id):
+        """他のプロセスのジョブに停止を依頼し、停止するまで少し待つ。未完了だった場合は True。"""
+        snapshot = self._load(job_id)
+        if snapshot is None or snapshot['status'] in FINISHED_STATUSES:
+            return False
+        try:
+            open(self._job_path(job_id, CANCEL_FILE_SUFFIX), 'w').close()
+        except OSError as e:
+            logger.warning("Failed to request cancellation of job %s: %s", job_id, e)
+            return False
+        deadline = time.time() + REMOTE_CANCEL_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(0.1)
+            snapshot = self._load(job_id)
+            if snapshot is None or snapshot['status'] in FINISHED_STATUSES:
+                break
+        return True
+
+    # --- 以下はディスパッチャースレッド内で lock を取って呼ばれる ---
+
+    def _cancel_locked(self, job):
+        if job['status'] == JOB_QUEUED:
+            self._pending.remove(job['id'])
+        else:
+            self._stop_process(job['id'])
+        self._finish(job, JOB_CANCELLED, error="Cancelled by request")
+
+    def _apply_remote_cancels(self):
+        """他のプロセスから依頼されたキャンセル (<job_id>.cancel) を処理する。"""
+        if not self.state_dir:
+            return
+        for job_id in list(self._pending) + list(self._running):
+            cancel_path = self._job_path(job_id, CANCEL_FILE_SUFFIX)
+            if os.path.exists(cancel_path):
+                self._cancel_locked(self._jobs[job_id])
+                try:
+                    os.remove(cancel_path)
+                except OSError:
+                    pass
+
+    def _finish(self, job, status, result=None, error=None, details=None):
+        job['status'] = status
+        job['finished_at'] = time.time()
+        job['result'] = result
+        job['error'] = error
+        job['details'] = details
+        job['payload'] = None
+        self._save(job)
+
+    def _stop_process(self, job_id):
+        process, conn = self._running.pop(job_id)
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout=5)
+        conn.close()
+
+    def _start_pending(self):
+        while self._pending and len(self._running) < self.max_workers:
+            job_id = self._pending.popleft()
+            job = self._jobs[job_id]
+            parent_conn, child_conn = self._ctx.Pipe(duplex=False)
+            process = self._ctx.Process(target=_run_job, args=(self.target, job['payload'], child_conn),
+                                        name=f'shift-job-{job_id[:8]}', daemon=True)
+            try:
+                process.start()
+            except Exception as e:
+                parent_conn.close()
+                self._finish(job, JOB_FAILED, error=f"Failed to start worker process: {e}",
+                             details=traceback.format_exc())
+                continue
+            finally:
+                child_conn.close()
+            job['status'] = JOB_RUNNING
+            job['started_at'] = time.time()
+            self._running[job_id] = (process, parent_conn)
+            self._save(job)
+
+    def _handle_messages(self, job_id):
+        """ワーカーからのメッセージを読む。ジョブが終了した場合は True。"""
+        process, conn = self._running[job_id]
+        job = self._jobs[job_id]
+        progressed = False
+        try:
+            while conn.poll():
+                message = conn.recv()
+                if message[0] == 'progress':
+                    job['progress'] = message[1]
+                    progressed = True
+                elif message[0] == 'result':
+                    self._running.pop(job_id)
+                    process.join(timeout=5)
+                    conn.close()
+                    self._finish(job, JOB_SUCCEEDED, result=message[1])
+                    return True
+                elif message[0] == 'error':
+                    self._running.pop(job_id)
+                    process.join(timeout=5)
+                    conn.close()
+                    self._finish(job, JOB_FAILED, error=message[1], details=message[2])
+                    return True
+        except (EOFError, OSError):
+            self._stop_process(job_id)
+            self._finish(job, JOB_FAILED, error=f"Worker process exited unexpectedly (exit code {process.exitcode})")
+            return True
+        if progressed:
+            self._save(job)
+        return False
+
+    def _dispatch_loop(self):
+        while True:
+            try:
+                self._dispatch_once()
+            except Exception:
+                # 1つのジョブの不具合でディスパッチャーが止まると、以降のジョブがすべて queued のままになる
+                logger.exception("Job dispatcher iteration failed")
+                time.sleep(0.5)
+
+    def _dispatch_once(self):
+        with self._lock:
+            self._purge_expired()
+            self._apply_remote_cancels()
+            self._start_pending()
+            conns = [conn for _, conn in self._running.values()]
+            if not conns:
+                self._lock.wait(timeout=1.0)
+                return
+        try:
+            ready = wait(conns, timeout=0.5)
+        except OSError:
+            # 待機中にキャンセルされて conn が閉じられた
+            return
+        completed = []
+        with self._lock:
+            now = time.time()
+            for job_id in list(self._running):
+                job = self._jobs[job_id]
+                try:
+                    if self._running[job_id][1] in ready and self._handle_messages(job_id):
+                        completed.append(job)
+                        continue
+                    if now - job['started_at'] > job['time_limit_seconds']:
+                        self._stop_process(job_id)
+                        self._finish(job, JOB_TIMED_OUT,
+                                     error=f"Job exceeded time limit of {job['time_limit_seconds']} seconds")
+                except Exception as e:
+                    # このジョブだけを失敗にして、他のジョブの処理は続ける
+                    logger.exception("Failed to handle job %s", job_id)
+                    if job_id in self._running:
+                        self._stop_process(job_id)
+                    self._finish(job, JOB_FAILED, error=f"Job dispatcher error: {type(e).__name__}: {e}",
+                                 details=traceback.format_exc())
+        for job in completed:
+            if self.on_complete and job['status'] == JOB_SUCCEEDED:
+                try:
+                    self.on_complete(job)
+                except Exception:
+                    logger.exception("on_complete callback failed for job %s", job['id'])
+
+    def _purge_expired(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in FINISHED_STATUSES and now - job['finished_at'] > self.retention_seconds]:
+            del self._jobs[job_id]
+            if self.state_dir:
+                try:
+                    os.remove(self._job_path(job_id))
+                except OSError:
+                    pass
+        if self.state_dir and now - self._last_state_purge > STATE_PURGE_INTERVAL_SECONDS:
+            # 終了したプロセスが残したファイル。実行中のジョブも制限時間内に状態を書き出すので、それより古いものを消す
+            self._last_state_purge = now
+            max_age = self.retention_seconds + self.default_time_limit_seconds
+            for file_name in os.listdir(self.state_dir):
+                path = os.path.join(self.state_dir, file_name)
+                try:
+                    if now - os.path.getmtime(path) > max_age:
+                        os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,169 @@
+# python_shift_solver/load_test.py
+"""
+起動中のサーバーへの負荷試験。benchmark.py のケース (season_generator の入力) を
+同時に concurrency 本ずつ POST し、スループットとレイテンシ (p50 / p90 / p99) を表示する。
+
+    python load_test.py --case medium --concurrency 8 --requests 200
+    python load_test.py --url http://127.0.0.1:5001 --endpoint /generate_schedule --unique
+    python load_test.py --case small --duration 30 --output load_test_result.json
+
+--unique を付けるとリクエストごとに solverOptions.randomSeed を変えて結果キャッシュを外す
+(貪欲法の結果には影響しない)。付けない場合は2件目以降がキャッシュから返る。
+"""
+import argparse
+import gzip
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import BENCHMARK_CASES
+from season_generator import generate_season
+
+DEFAULT_URL = 'http://127.0.0.1:5001'
+
+
+def percentile(sorted_values, q):
+    """最近傍順位法のパーセンタイル (sorted_values は昇順)。"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-q * len(sorted_values) // 100)))  # ceil
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def post(url, body, accept_gzip, timeout):
+    """1リクエスト送って (ステータス, 経過ミリ秒, 受信バイト数, 展開後バイト数) を返す。"""
+    headers = {'Content-Type': 'application/json'}
+    if accept_gzip:
+        headers['Accept-Encoding'] = 'gzip'
+    req = urllib.request.Request(url, data=body, headers=headers, method='POST')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as res:
+            status = res.status
+            data = res.read()
+            encoding = res.headers.get('Content-Encoding')
+    except urllib.error.HTTPError as e:
+        status, data, encoding = e.code, e.read(), e.headers.get('Content-Encoding')
+    except (urllib.error.URLError, OSError) as e:
+        return f"{type(e).__name__}", (time.perf_counter() - started) * 1000, 0, 0
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    decoded_size = len(gzip.decompress(data)) if encoding == 'gzip' else len(data)
+    return status, elapsed_ms, len(data), decoded_size
+
+
+def run_load_test(args):
+    _, seed, num_people, num_days = next(case for case in BENCHMARK_CASES if case[0] == args.case)
+    input_data = generate_season(seed, num_people=num_people, num_days=num_days)
+    url = args.url.rstrip('/') + args.endpoint
+    base_body = json.dumps(input_data, ensure_ascii=False).encode('utf-8')
+
+    counter = iter(range(sys.maxsize))
+    counter_lock = threading.Lock()
+
+    def next_body():
+        with counter_lock:
+            index = next(counter)
+        if not args.unique:
+            return base_body
+        varied = {**input_data, 'solverOptions': {**input_data.get('solverOptions', {}), 'randomSeed': index}}
+        return json.dumps(varied, ensure_ascii=False).encode('utf-8')
+
+    for _ in range(args.warmup):
+        post(url, next_body(), not args.no_gzip, args.timeout)
+
+    results = []
+    results_lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    remaining = [args.requests]
+
+    def take_request():
+        with results_lock:
+            if deadline is not None:
+                return time.perf_counter() < deadline
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker():
+        while take_request():
+            result = post(url, next_body(), not args.no_gzip, args.timeout)
+            with results_lock:
+                results.append(result)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for _ in range(args.concurrency):
+            executor.submit(worker)
+    wall_seconds = time.perf_counter() - started
+
+    latencies = sorted(r[1] for r in results if r[0] == 200)
+    statuses = {}
+    for r in results:
+        statuses[str(r[0])] = statuses.get(str(r[0]), 0) + 1
+    num_ok = len(latencies)
+    return {
+        'url': url,
+        'case': args.case,
+        'num_teachers': len(input_data['teachers']),
+        'num_students': len(input_data['students']),
+        'request_bytes': len(base_body),
+        'concurrency': args.concurrency,
+        'unique': args.unique,
+        'gzip': not args.no_gzip,
+        'requests': len(results),
+        'statuses': statuses,
+        'wall_seconds': wall_seconds,
+        'throughput_rps': num_ok / wall_seconds if wall_seconds else 0.0,
+        'latency_ms': {
+            'mean': sum(latencies) / num_ok if num_ok else None,
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'response_bytes_mean': sum(r[2] for r in results if r[0] == 200) / num_ok if num_ok else None,
+        'response_decoded_bytes_mean': sum(r[3] for r in results if r[0] == 200) / num_ok if num_ok else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="シフト生成サーバーの負荷試験")
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--endpoint', default='/generate_schedule')
+    parser.add_argument('--case', default='small', choices=[name for name, _, _, _ in BENCHMARK_CASES])
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100, help="送るリクエスト数 (--duration 指定時は無視)")
+    parser.add_argument('--duration', type=float, help="この秒数のあいだ送り続ける")
+    parser.add_argument('--warmup', type=int, default=1, help="計測前に送るリクエスト数")
+    parser.add_argument('--unique', action='store_true', help="リクエストごとに入力を変えて結果キャッシュを外す")
+    parser.add_argument('--no-gzip', action='store_true', help="Accept-Encoding: gzip を付けない")
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--output', help="結果を JSON で書き出すファイル")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(args)
+    latency = report['latency_ms']
+
+    def fmt(value):
+        return f"{value:.1f}" if value is not None else "-"
+
+    print(f"{report['url']} case={report['case']} ({report['num_teachers']} teachers, {report['num_students']} students, "
+          f"{report['request_bytes']} bytes) concurrency={report['concurrency']} unique={report['unique']} gzip={report['gzip']}")
+    print(f"requests: {report['requests']} in {report['wall_seconds']:.2f} s  statuses: {report['statuses']}")
+    print(f"throughput: {report['throughput_rps']:.2f} req/s")
+    print(f"latency ms: mean {fmt(latency['mean'])}  p50 {fmt(latency['p50'])}  p90 {fmt(latency['p90'])}  "
+          f"p99 {fmt(latency['p99'])}  max {fmt(latency['max'])}")
+    print(f"response bytes: {fmt(report['response_bytes_mean'])} (decoded {fmt(report['response_decoded_bytes_mean'])})")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report['requests'] and report['statuses'].get('200', 0) == report['requests'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
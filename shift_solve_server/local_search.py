@@ -0,0 +1,363 @@
+# python_shift_solver/local_search.py
+"""
+フェーズ4: 貪欲法の結果に対する局所探索。
+
+目的関数は schedule_quality.schedule_cost と同じ項 (未割り当て・空きコマの希望違反・
+minDesiredPeriods 不足・空きコマ数) に、空きコマ許容の生徒の3コマ以上の空き (貪欲法では割り当て不可、
+CP-SAT では WEIGHT_IDLE_OVER_LIMIT) のペナルティを加えたもの。小さいほど良い。
+目的関数は (生徒, 日) と (講師, 日) ごとの項の和なので、変更で影響を受ける日の項だけを計算し直して差分で評価する。
+
+近傍:
+  move: 割り当て1件を同じ講師のまま別のコマに移す
+  swap: 別の日の割り当て2件の講師を入れ替える (講師の日ごとのコマ数を変える)
+  fill_gap: 生徒の空きコマに、その生徒の別のコマを移すか未割り当てのコマを入れる
+  fill: 未割り当てのコマを空いているコマに入れる
+改善する変更だけを採用し (最良改善)、改善がなくなるか時間・反復回数の上限に達したら終了する。
+固定済みの割り当て (スケジュール修復時) と、レギュラー講師との割り当ての講師は変えない。
+"""
+import random
+import time
+
+from schedule_quality import (COST_IDLE_GAP_VIOLATION, COST_IDLE_PERIOD, COST_MIN_DESIRED_SHORTFALL,
+                              COST_UNASSIGNED_UNIT, IDLE_PREF_GAP_OK, IDLE_PREF_NO_GAP, MAX_IDLE_GAP_OK)
+
+COST_IDLE_OVER_LIMIT = 1500  # 空きコマ許容の生徒の3コマ以上の空き (cpsat_solver.WEIGHT_IDLE_OVER_LIMIT と同じ)
+DEFAULT_TIME_LIMIT_SECONDS = 2.0
+
+NEIGHBORHOODS = ('move', 'swap', 'fill_gap', 'fill')
+
+
+class LocalSearch:
+    """
+    フェーズ2の後の状態 (teachers_status / students_status / availability) と assignments を直接更新する。
+    更新した割り当ては新しい dict に置き換える (進捗通知で送った dict は変更しない)。
+    """
+
+    def __init__(self, assignments, num_fixed, teachers_status, students_status, availability, regular_pairings,
+                 seed=None):
+        self.assignments = assignments
+        self.teachers_status = teachers_status
+        self.students_status = students_status
+        self.availability = availability
+        self.num_periods = availability.num_periods
+        self.rng = random.Random(seed)
+        self.moves = {name: 0 for name in NEIGHBORHOODS}
+
+        self._capable_sets = {}
+        self._student_day_cost_cache = {}
+        self._regular_teacher = {}  # (生徒ID, 科目) -> レギュラー講師ID
+        for s_id, s_stat in students_status.items():
+            for subject, t_id in regular_pairings.get(s_id, s_stat.obj).items():
+                self._regular_teacher[(s_id, subject)] = t_id
+        self._min_desired = {t_id: t_stat.obj.get('minDesiredPeriods', 1) for t_id, t_stat in teachers_status.items()}
+
+        # 動かせる割り当て (固定済みでなく、講師・生徒とも状態がある) の索引
+        self.teacher_units = {t_id: set() for t_id in teachers_status}
+        self.student_units = {s_id: set() for s_id in students_status}
+        for i, a in enumerate(assignments):
+            if i >= num_fixed and a['teacherId'] in teachers_status and a['studentId'] in students_status:
+                self.teacher_units[a['teacherId']].add(i)
+                self.student_units[a['studentId']].add(i)
+
+        self.objective = self.compute_objective()
+
+    # --- 目的関数 ---
+
+    def student_day_cost(self, idle_pref, day_mask):
+        key = (idle_pref, day_mask)
+        cost = self._student_day_cost_cache.get(key)
+        if cost is None:
+            cost = 0
+            periods = [p for p_idx, p in enumerate(self.availability.periods) if day_mask >> p_idx & 1]
+            if len(periods) > 1:
+                max_gap = max(b - a - 1 for a, b in zip(periods, periods[1:]))
+                cost = (periods[-1] - periods[0] + 1 - len(periods)) * COST_IDLE_PERIOD
+                if idle_pref == IDLE_PREF_NO_GAP and max_gap > 0:
+                    cost += COST_IDLE_GAP_VIOLATION
+                elif idle_pref == IDLE_PREF_GAP_OK and max_gap > MAX_IDLE_GAP_OK:
+                    cost += COST_IDLE_GAP_VIOLATION + COST_IDLE_OVER_LIMIT
+            self._student_day_cost_cache[key] = cost
+        return cost
+
+    def teacher_day_cost(self, t_id, count):
+        return COST_MIN_DESIRED_SHORTFALL if 0 < count < self._min_desired[t_id] else 0
+
+    def compute_objective(self):
+        """目的関数を状態から計算し直す (初期値と検証用)。"""
+        objective = 0
+        for s_stat in self.students_status.values():
+            idle_pref = s_stat.obj.get('idleTimePreference')
+            objective += sum(max(0, units) for units in s_stat.remaining_desired_units.values()) * COST_UNASSIGNED_UNIT
+            for d_idx in self._assigned_days(s_stat):
+                objective += self.student_day_cost(idle_pref, s_stat.day_mask(d_idx, self.num_periods))
+        for t_id, t_stat in self.teachers_status.items():
+            objective += sum(self.teacher_day_cost(t_id, count) for count in t_stat.day_counts)
+        return objective
+
+    def delta(self, changes):
+        """
+        changes ([(生徒ID, 科目, 元の講師ID, 元のビット, 新しい講師ID, 新しいビット)]、元/新は None 可) を
+        適用したときの目的関数の増減。
+        """
+        num_periods = self.num_periods
+        student_masks = {}
+        teacher_counts = {}
+        delta = 0
+        for s_id, _, old_t, old_bit, new_t, new_bit in changes:
+            for t_id, bit, sign in ((old_t, old_bit, -1), (new_t, new_bit, 1)):
+                if bit is None:
+                    delta += sign * COST_UNASSIGNED_UNIT  # 新規の割り当ては未割り当てを減らし、外すと増やす
+                    continue
+                d_idx, p_idx = divmod(bit, num_periods)
+                key = (s_id, d_idx)
+                mask = student_masks.get(key)
+                if mask is None:
+                    mask = self.students_status[s_id].day_mask(d_idx, num_periods)
+                student_masks[key] = mask | (1 << p_idx) if sign > 0 else mask & ~(1 << p_idx)
+                key = (t_id, d_idx)
+                teacher_counts[key] = teacher_counts.get(key, self.teachers_status[t_id].day_counts[d_idx]) + sign
+        for (s_id, d_idx), mask in student_masks.items():
+            s_stat = self.students_status[s_id]
+            idle_pref = s_stat.obj.get('idleTimePreference')
+            delta += (self.student_day_cost(idle_pref, mask)
+                      - self.student_day_cost(idle_pref, s_stat.day_mask(d_idx, num_periods)))
+        for (t_id, d_idx), count in teacher_counts.items():
+            delta += self.teacher_day_cost(t_id, count) - self.teacher_day_cost(t_id, self.teachers_status[t_id].day_counts[d_idx])
+        return delta
+
+    # --- 状態の更新 ---
+
+    def _remove(self, i, s_id, subject, t_id, bit):
+        d_idx = bit // self.num_periods
+        self.availability.teacher_free[t_id] |= 1 << bit
+        self.availability.student_free[s_id] |= 1 << bit
+        s_stat = self.students_status[s_id]
+        s_stat.assigned_mask &= ~(1 << bit)
+        if subject in s_stat.remaining_desired_units:
+            s_stat.remaining_desired_units[subject] += 1
+        self.teachers_status[t_id].day_counts[d_idx] -= 1
+        self.teacher_units[t_id].discard(i)
+
+    def _add(self, i, s_id, subject, t_id, bit):
+        d_idx = bit // self.num_periods
+        self.availability.teacher_free[t_id] &= ~(1 << bit)
+        self.availability.student_free[s_id] &= ~(1 << bit)
+        s_stat = self.students_status[s_id]
+        s_stat.assigned_mask |= 1 << bit
+        if subject in s_stat.remaining_desired_units:
+            s_stat.remaining_desired_units[subject] -= 1
+        self.teachers_status[t_id].day_counts[d_idx] += 1
+        self.teacher_units[t_id].add(i)
+        self.student_units[s_id].add(i)
+
+    def apply(self, moves, delta, neighborhood):
+        """moves ([(割り当てのインデックス (新規は None), 変更)]) を適用する。"""
+        for i, (s_id, subject, old_t, old_bit, new_t, new_bit) in moves:
+            if i is not None:
+                self._remove(i, s_id, subject, old_t, old_bit)
+                a = self.assignments[i]
+            else:
+                i = len(self.assignments)
+                a = {"date": None, "period": None, "teacherId": None, "teacherName": None, "studentId": s_id,
+                     "studentName": self.students_status[s_id].obj.get('name'), "subject": subject}
+                self.assignments.append(a)
+            d_idx, p_idx = divmod(new_bit, self.num_periods)
+            self.assignments[i] = {**a, "date": self.availability.available_dates[d_idx],
+                                   "period": self.availability.periods[p_idx], "teacherId": new_t,
+                                   "teacherName": self.teachers_status[new_t].obj.get('name')}
+            self._add(i, s_id, subject, new_t, new_bit)
+        self.objective += delta
+        self.moves[neighborhood] += 1
+
+    # --- 近傍 ---
+
+    def _bit_of(self, a):
+        return self.availability.slot_bit(a['date'], a['period'])
+
+    def _capable(self, s_id, subject):
+        affiliation = self.students_status[s_id].obj.get('affiliation')
+        key = (affiliation, subject)
+        capable = self._capable_sets.get(key)
+        if capable is None:
+            capable = self._capable_sets[key] = set(self.availability.get_capable_teachers(affiliation, subject))
+        return capable
+
+    def _can_change_teacher(self, s_id, subject, t_id):
+        return self._regular_teacher.get((s_id, subject)) != t_id
+
+    def _assigned_days(self, s_stat):
+        """生徒に割り当てのある日付インデックス (昇順)。"""
+        days = []
+        for bit in self._iter_bits(s_stat.assigned_mask):
+            d_idx = bit // self.num_periods
+            if not days or days[-1] != d_idx:
+                days.append(d_idx)
+        return days
+
+    @staticmethod
+    def _iter_bits(mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def try_move(self, i):
+        a = self.assignments[i]
+        s_id, subject, t_id = a['studentId'], a['subject'], a['teacherId']
+        old_bit = self._bit_of(a)
+        best = None
+        common = self.availability.teacher_free[t_id] & self.availability.student_free[s_id]
+        for bit in self._iter_bits(common):
+            change = (s_id, subject, t_id, old_bit, t_id, bit)
+            delta = self.delta([change])
+            if delta < 0 and (best is None or delta < best[0]):
+                best = (delta, [(i, change)])
+        return best
+
+    def try_swap(self, i):
+        a = self.assignments[i]
+        s1, subject1, t1 = a['studentId'], a['subject'], a['teacherId']
+        if not self._can_change_teacher(s1, subject1, t1):
+            return None
+        bit1 = self._bit_of(a)
+        day1 = bit1 // self.num_periods
+        teacher_free = self.availability.teacher_free
+        best = None
+        for t2 in self._capable(s1, subject1):
+            if t2 == t1 or not teacher_free[t2] >> bit1 & 1:
+                continue
+            for j in self.teacher_units[t2]:
+                b = self.assignments[j]
+                s2, subject2 = b['studentId'], b['subject']
+                bit2 = self._bit_of(b)
+                if bit2 // self.num_periods == day1 or not teacher_free[t1] >> bit2 & 1:
+                    continue
+                if t1 not in self._capable(s2, subject2) or not self._can_change_teacher(s2, subject2, t2):
+                    continue
+                changes = [(s1, subject1, t1, bit1, t2, bit1), (s2, subject2, t2, bit2, t1, bit2)]
+                delta = self.delta(changes)
+                if delta < 0 and (best is None or delta < best[0]):
+                    best = (delta, [(i, changes[0]), (j, changes[1])])
+        return best
+
+    def _insert_candidates(self, s_id, subject, mask):
+        """未割り当ての (生徒, 科目) を mask のコマに入れる変更の候補。"""
+        student_free = self.availability.student_free[s_id]
+        for t_id in self._capable(s_id, subject):
+            for bit in self._iter_bits(self.availability.teacher_free[t_id] & student_free & mask):
+                yield None, (s_id, subject, None, None, t_id, bit)
+
+    def try_fill_gap(self, s_id, d_idx):
+        s_stat = self.students_status[s_id]
+        day_mask = s_stat.day_mask(d_idx, self.num_periods)
+        if day_mask & (day_mask - 1) == 0:
+            return None  # その日のコマが1つ以下
+        low, high = (day_mask & -day_mask).bit_length() - 1, day_mask.bit_length() - 1
+        gap_mask = 0
+        for p_idx in range(low + 1, high):
+            if not day_mask >> p_idx & 1:
+                gap_mask |= 1 << (d_idx * self.num_periods + p_idx)
+        gap_mask &= self.availability.student_free[s_id]
+
+        candidates = []
+        for subject, units in s_stat.remaining_desired_units.items():
+            if units > 0:
+                candidates.extend(self._insert_candidates(s_id, subject, gap_mask))
+        teacher_free = self.availability.teacher_free
+        for j in self.student_units[s_id]:
+            b = self.assignments[j]
+            subject, t_id = b['subject'], b['teacherId']
+            if t_id not in self.teachers_status or j not in self.teacher_units[t_id]:
+                continue
+            bit = self._bit_of(b)
+            teachers = self._capable(s_id, subject) if self._can_change_teacher(s_id, subject, t_id) else (t_id,)
+            for new_t in teachers:
+                for gap_bit in self._iter_bits(teacher_free[new_t] & gap_mask):
+                    candidates.append((j, (s_id, subject, t_id, bit, new_t, gap_bit)))
+
+        best = None
+        for j, change in candidates:
+            delta = self.delta([change])
+            if delta < 0 and (best is None or delta < best[0]):
+                best = (delta, [(j, change)])
+        return best
+
+    def try_fill(self, s_id, subject):
+        if self.students_status[s_id].remaining_desired_units.get(subject, 0) <= 0:
+            return None
+        best = None
+        for j, change in self._insert_candidates(s_id, subject, -1):
+            delta = self.delta([change])
+            if delta < 0 and (best is None or delta < best[0]):
+                best = (delta, [(j, change)])
+        return best
+
+    def _targets(self):
+        """今の状態で改善の余地がある対象の一覧 (近傍, 引数)。"""
+        num_periods = self.num_periods
+        targets = []
+        for s_id, s_stat in self.students_status.items():
+            for subject, units in s_stat.remaining_desired_units.items():
+                if units > 0 and self._capable(s_id, subject):
+                    targets.append(('fill', (s_id, subject)))
+            idle_pref = s_stat.obj.get('idleTimePreference')
+            for d_idx in self._assigned_days(s_stat):
+                if self.student_day_cost(idle_pref, s_stat.day_mask(d_idx, num_periods)):
+                    targets.append(('fill_gap', (s_id, d_idx)))
+        for t_id, units in self.teacher_units.items():
+            day_counts = self.teachers_status[t_id].day_counts
+            for i in units:
+                a = self.assignments[i]
+                d_idx = self.availability.date_index[a['date']]
+                s_stat = self.students_status[a['studentId']]
+                if self.teacher_day_cost(t_id, day_counts[d_idx]):
+                    targets.append(('swap', (i,)))
+                    targets.append(('move', (i,)))
+                elif self.student_day_cost(s_stat.obj.get('idleTimePreference'), s_stat.day_mask(d_idx, num_periods)):
+                    targets.append(('move', (i,)))
+        return targets
+
+    def run(self, time_limit_seconds=DEFAULT_TIME_LIMIT_SECONDS, max_iterations=None, cancel_event=None):
+        """
+        改善がなくなるか上限に達するまで探索し、結果の概要を返す
+        (iterations, moves, objective_before / after, improvement, elapsed_ms, improvement_per_second, converged)。
+        time_limit_seconds / max_iterations が None なら上限なし、0 なら探索しない。
+        cancel_event (threading.Event) がセットされたら、上限に達したときと同じくそこで止める。
+        """
+        started = time.perf_counter()
+        deadline = started + time_limit_seconds if time_limit_seconds is not None else None
+        objective_before = self.objective
+        tries = {'move': self.try_move, 'swap': self.try_swap, 'fill_gap': self.try_fill_gap, 'fill': self.try_fill}
+        iterations = 0
+        converged = False
+        budget_left = True
+        while budget_left:
+            targets = self._targets()
+            self.rng.shuffle(targets)
+            improved = 0
+            for neighborhood, args in targets:
+                if (max_iterations is not None and iterations >= max_iterations) or \
+                        (deadline is not None and time.perf_counter() > deadline) or \
+                        (cancel_event is not None and cancel_event.is_set()):
+                    budget_left = False
+                    break
+                iterations += 1
+                best = tries[neighborhood](*args)
+                if best is not None:
+                    self.apply(best[1], best[0], neighborhood)
+                    improved += 1
+            if budget_left and not improved:
+                converged = True
+                break
+        elapsed = time.perf_counter() - started
+        improvement = objective_before - self.objective
+        return {
+            'iterations': iterations,
+            'moves': dict(self.moves),
+            'objective_before': objective_before,
+            'objective_after': self.objective,
+            'improvement': improvement,
+            'elapsed_ms': elapsed * 1000,
+            'improvement_per_second': improvement / elapsed if elapsed > 0 else 0.0,
+            'converged': converged,
+        }
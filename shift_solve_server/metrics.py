@@ -0,0 +1,75 @@
+# python_shift_solver/metrics.py
+import threading
+import time
+
+
+def new_solve_stats():
+    """
+    1回のシフト生成の計測値。generate_actual_shifts(stats=...) に渡して埋めてもらう。
+    SolverMetrics が合計するのは timings_ms と counters だけで、1回分の情報は別のキー (multistart など) に入れる。
+    """
+    return {
+        'timings_ms': {},  # フェーズ名 -> 経過時間 (ミリ秒)
+        'counters': {},  # カウンター名 -> 値
+    }
+
+
+def record_timing(stats, phase_name, started):
+    """time.perf_counter() で取った started からの経過時間を stats['timings_ms'][phase_name] に加算する。"""
+    if stats is not None:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats['timings_ms'][phase_name] = stats['timings_ms'].get(phase_name, 0.0) + elapsed_ms
+
+
+def increment(stats, counter_name, value=1):
+    if stats is not None:
+        stats['counters'][counter_name] = stats['counters'].get(counter_name, 0) + value
+
+
+class SolverMetrics:
+    """サーバー全体の計測値の集計 (/metrics で公開する)。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._num_solves = 0
+        self._num_failures = 0
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._timings_ms_total = {}
+        self._counters_total = {}
+        self._last_solve = None
+
+    def record_solve(self, stats):
+        with self._lock:
+            self._num_solves += 1
+            for name, value in stats['timings_ms'].items():
+                self._timings_ms_total[name] = self._timings_ms_total.get(name, 0.0) + value
+            for name, value in stats['counters'].items():
+                self._counters_total[name] = self._counters_total.get(name, 0) + value
+            self._last_solve = stats
+
+    def record_failure(self):
+        with self._lock:
+            self._num_failures += 1
+
+    def record_cache(self, hit):
+        with self._lock:
+            if hit:
+                self._cache_hits += 1
+            else:
+                self._cache_misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'uptime_seconds': time.time() - self._started_at,
+                'solves': self._num_solves,
+                'failures': self._num_failures,
+                'cache': {'hits': self._cache_hits, 'misses': self._cache_misses},
+                'timings_ms_total': dict(self._timings_ms_total),
+                'timings_ms_mean': {name: value / self._num_solves for name, value in self._timings_ms_total.items()}
+                if self._num_solves else {},
+                'counters_total': dict(self._counters_total),
+                'last_solve': self._last_solve,
+            }
@@ -0,0 +1,143 @@
+# python_shift_solver/multistart.py
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+from job_queue import get_mp_context
+from metrics import increment, new_solve_stats, record_timing
+from schedule_quality import evaluate_schedule, schedule_cost
+from shift_generater import generate_actual_shifts
+
+DEFAULT_NUM_STARTS = 8
+DEFAULT_TIME_LIMIT_SECONDS = 10.0
+DEFAULT_ORDER_NOISE = 0.3
+
+logger = logging.getLogger(__name__)
+
+
+def start_options(solver_options, start_index):
+    """
+    各スタートの solverOptions。
+    0: 入力順 (通常の貪欲法)、1: 制約の厳しい順、2以降: 制約の厳しい順に乱数 (orderNoise) を掛けた順。
+    乱数の seed は randomSeed + スタート番号なので、同じ randomSeed なら同じ結果になる。
+    """
+    options = {**solver_options, 'solver': 'greedy',
+               'randomSeed': int(solver_options.get('randomSeed', 0)) + start_index}
+    if start_index == 0:
+        options['unitOrder'] = 'input'
+    else:
+        options['unitOrder'] = 'priority'
+        options['orderNoise'] = 0.0 if start_index == 1 else float(solver_options.get('orderNoise', DEFAULT_ORDER_NOISE))
+    return options
+
+
+def run_start(input_data, start_index):
+    options = start_options(input_data.get('solverOptions', {}), start_index)
+    stats = new_solve_stats()
+    diagnostics = {}
+    assignments = generate_actual_shifts({**input_data, 'solverOptions': options}, stats=stats,
+                                         diagnostics=diagnostics)
+    quality = evaluate_schedule(input_data, assignments)
+    return {'start': start_index, 'cost': schedule_cost(quality), 'quality': quality,
+            'assignments': assignments, 'stats': stats, 'diagnostics': diagnostics}
+
+
+# ワーカープロセスの入力 (プールの初期化時に1回だけ受け取り、スタートごとには送らない)
+_worker_input = None
+
+
+def _init_worker(input_data):
+    global _worker_input
+    _worker_input = input_data
+
+
+def _run_start_in_worker(start_index):
+    return run_start(_worker_input, start_index)
+
+
+def solve_multistart(input_data, progress_callback=None, stats=None, diagnostics=None):
+    """
+    並び順を変えた貪欲法を numStarts 回実行し、schedule_cost が最小のシフトを返す (同点はスタート番号の小さい方)。
+    スタート1以降はワーカープロセス (numWorkers - 1 個) で並列に実行し、スタート0 (通常の貪欲法) は
+    このプロセスで実行するので、結果が通常の貪欲法より悪くなることはない。
+    timeLimitSeconds を過ぎたら実行中のスタートを打ち切り、それまでの最良を返す。
+    diagnostics には最良のスタートの診断情報が入る。
+    """
+    solver_options = input_data.get('solverOptions', {})
+    num_starts = max(1, int(solver_options.get('numStarts', DEFAULT_NUM_STARTS)))
+    num_workers = max(1, int(solver_options.get('numWorkers', os.cpu_count() or 1)))
+    time_limit = float(solver_options.get('timeLimitSeconds', DEFAULT_TIME_LIMIT_SECONDS))
+    started = time.perf_counter()
+    deadline = started + time_limit
+
+    def report_progress(results):
+        if progress_callback is not None:
+            progress_callback({"event": "progress", "phase": "multistart", "starts_done": len(results),
+                               "starts_total": num_starts, "best_cost": min(r['cost'] for r in results)})
+
+    remaining = list(range(1, num_starts))
+    # ジョブのワーカー (daemon プロセス) は子プロセスを持てないので、その場合は順に実行する
+    parallel = num_workers > 1 and remaining and not multiprocessing.current_process().daemon
+    pool = None
+    done = queue.Queue()
+    if parallel:
+        pool = get_mp_context(['shift_generater']).Pool(
+            processes=min(num_workers - 1, len(remaining)), initializer=_init_worker, initargs=(input_data,))
+        for start_index in remaining:
+            pool.apply_async(_run_start_in_worker, (start_index,), callback=done.put, error_callback=done.put)
+
+    try:
+        results = [run_start(input_data, 0)]
+        report_progress(results)
+        first_duration = time.perf_counter() - started
+        if parallel:
+            for _ in remaining:
+                try:
+                    item = done.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if isinstance(item, BaseException):
+                    logger.warning("Multi-start run failed: %s", item)
+                    continue
+                results.append(item)
+                report_progress(results)
+        else:
+            for start_index in remaining:
+                # 1回分の時間 (スタート0で計測) が残り時間に収まらなければ打ち切る
+                if time.perf_counter() + first_duration > deadline:
+                    break
+                results.append(run_start(input_data, start_index))
+                report_progress(results)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    best = min(results, key=lambda r: (r['cost'], r['start']))
+    logger.info("Multi-start: %d/%d starts finished; best start %d (cost %d, greedy cost %d).",
+                len(results), num_starts, best['start'], best['cost'], results[0]['cost'])
+    if stats is not None:
+        for name, value in best['stats']['timings_ms'].items():
+            if name != 'total':
+                stats['timings_ms'][name] = value
+        for name, value in best['stats']['counters'].items():
+            increment(stats, name, value)
+        # 局所探索などの1回分の値も最良のスタートのものを使う
+        for name, value in best['stats'].items():
+            if name not in ('timings_ms', 'counters'):
+                stats[name] = value
+        # 1回の求解についての値なので、/metrics で合計される counters には入れない
+        stats['multistart'] = {
+            'starts_total': num_starts,
+            'starts_finished': len(results),
+            'best_start': best['start'],
+            'best_cost': best['cost'],
+            'greedy_cost': results[0]['cost'],
+            'cost_improvement': results[0]['cost'] - best['cost'],
+        }
+        record_timing(stats, 'total', started)
+    if diagnostics is not None:
+        diagnostics.update(best['diagnostics'])
+    return best['assignments']
@@ -0,0 +1,72 @@
+# python_shift_solver/regular_pairing.py
+
+ISSUE_CONFLICTING_TEACHERS = 'conflicting_teachers'  # 同じ生徒・科目に別々の講師がレギュラー登録されている
+ISSUE_DUPLICATE_PAIRING = 'duplicate_pairing'  # 同じ講師が同じ生徒・科目・曜日・時限を重複して登録している
+ISSUE_AMBIGUOUS_STUDENT = 'ambiguous_student'  # 名前・所属・学年が同じ生徒が複数いて、どの生徒か特定できない
+
+
+class RegularPairingIndex:
+    """
+    講師の regularClasses から作るレギュラー講師の索引。リクエストごとに1回だけ構築する。
+
+    - (生徒名, 所属, 学年) -> {科目: 講師ID}
+    - 生徒ID -> {科目: 講師ID} (regularClasses に studentId がある場合は名前ではなく ID で照合する)
+
+    同じ生徒・科目に複数の登録がある場合は従来どおり最初の登録 (講師順・登録順) を採用し、
+    issues に記録する。
+    """
+
+    def __init__(self, teachers_status, students_status):
+        self.by_student_key = {}
+        self.by_student_id = {}
+        self.issues = []
+
+        student_ids_by_key = {}
+        for s_id, s_stat in students_status.items():
+            student_ids_by_key.setdefault(self.student_key(s_stat.obj), []).append(s_id)
+
+        ambiguous_keys = set()
+        # 登録済みの (講師ID, 生徒ID または生徒キー, 科目, 曜日, 時限)。週2回のレギュラーは曜日・時限で区別する
+        seen_entries = set()
+        for t_id, t_stat in teachers_status.items():
+            for reg_class in t_stat.obj.get('regularClasses', []):
+                subject = reg_class.get('subject')
+                student_id = reg_class.get('studentId')
+                if student_id:
+                    key = student_id
+                    pairings = self.by_student_id.setdefault(student_id, {})
+                    student_ref = {'studentId': student_id}
+                else:
+                    key = (reg_class.get('studentName'), reg_class.get('studentAffiliation'), reg_class.get('studentGrade'))
+                    pairings = self.by_student_key.setdefault(key, {})
+                    student_ref = {'studentName': key[0], 'studentAffiliation': key[1], 'studentGrade': key[2]}
+                    matched_ids = student_ids_by_key.get(key, [])
+                    if len(matched_ids) > 1 and key not in ambiguous_keys:
+                        ambiguous_keys.add(key)
+                        self.issues.append({'type': ISSUE_AMBIGUOUS_STUDENT, **student_ref, 'studentIds': matched_ids})
+
+                entry = (t_id, key, subject, reg_class.get('day'), reg_class.get('period'))
+                is_duplicate = entry in seen_entries
+                seen_entries.add(entry)
+                current_teacher_id = pairings.get(subject)
+                if current_teacher_id is None:
+                    pairings[subject] = t_id
+                elif current_teacher_id == t_id:
+                    if is_duplicate:
+                        self.issues.append({'type': ISSUE_DUPLICATE_PAIRING, **student_ref, 'subject': subject,
+                                            'teacherIds': [t_id], 'day': entry[3], 'period': entry[4]})
+                else:
+                    self.issues.append({'type': ISSUE_CONFLICTING_TEACHERS, **student_ref, 'subject': subject,
+                                        'teacherIds': [current_teacher_id, t_id], 'usedTeacherId': current_teacher_id})
+
+    @staticmethod
+    def student_key(student):
+        return (student.get('name'), student.get('affiliation'), student.get('grade'))
+
+    def get(self, student_id, student):
+        """生徒のレギュラー講師を {科目: 講師ID} で返す。ID での登録が名前での登録より優先される。"""
+        pairings = self.by_student_key.get(self.student_key(student), {})
+        pairings_by_id = self.by_student_id.get(student_id)
+        if pairings_by_id:
+            pairings = {**pairings, **pairings_by_id}
+        return pairings
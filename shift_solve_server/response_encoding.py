@@ -0,0 +1,76 @@
+# python_shift_solver/response_encoding.py
+"""
+レスポンスのエンコード (JSON のシリアライズと gzip 圧縮)。
+
+- FastJSONProvider: orjson があれば jsonify / request.get_json を orjson で行う Flask の JSON プロバイダー
+  (数千件の assignments を返すときに標準の json より大幅に速い)。orjson がなければ標準の json のまま。
+- gzip_response: クライアントが gzip を受け付ける場合に、一定サイズ以上の JSON レスポンスを圧縮する
+  (after_request で使う。ストリーミングのレスポンスは逐次送信を妨げないよう圧縮しない)。
+"""
+import gzip
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson は任意 (なければ標準の json を使う)
+    orjson = None
+
+# 標準の json と同じく、数値などの dict キーは文字列にする
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+GZIP_MIN_BYTES = 1024
+GZIP_MIME_TYPES = ('application/json',)
+
+
+def dumps_bytes(obj):
+    """obj を UTF-8 の JSON (空白なし) にする。NDJSON の1行など、jsonify を通さない出力用。"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=ORJSON_OPTIONS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=DefaultJSONProvider.default).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """orjson でシリアライズ・パースする JSON プロバイダー (app.json = FastJSONProvider(app))。"""
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def accepts_gzip(accept_encoding):
+    return any(part.split(';')[0].strip() == 'gzip' for part in (accept_encoding or '').split(','))
+
+
+def gzip_response(response, accept_encoding, compresslevel=6, min_bytes=GZIP_MIN_BYTES):
+    """条件を満たすレスポンスの本文を gzip 圧縮する (compresslevel が 0 なら何もしない)。"""
+    if not compresslevel or response.is_streamed or response.direct_passthrough:
+        return response
+    if response.mimetype not in GZIP_MIME_TYPES or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    if not accepts_gzip(accept_encoding):
+        return response
+    body = response.get_data()
+    if len(body) < min_bytes:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=compresslevel))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
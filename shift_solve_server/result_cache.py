@@ -0,0 +1,150 @@
+# python_shift_solver/result_cache.py
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from cachetools import TTLCache
+
+# キャッシュキーに含める入力項目 (これ以外の項目は結果に影響しないので無視する)
+CACHE_KEY_FIELDS = ('teachers', 'students', 'adminSettings', 'constants', 'solverOptions')
+CACHE_FILE_SUFFIX = '.json.gz'
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(input_data):
+    """入力を正規化 (キー順ソート・空白なし) した JSON の SHA-256 をキャッシュキーにする。"""
+    normalized = {field: input_data.get(field) for field in CACHE_KEY_FIELDS}
+    canonical = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    /generate_schedule の結果キャッシュ。件数 (LRU) と経過時間 (TTL) で上限を設ける。
+    persist_dir を指定すると各エントリを gzip 圧縮した JSON として保存し、再起動後に読み込む。
+    メモリにないキーはディスクも探すので、persist_dir を共有すれば複数のプロセス (gunicorn のワーカー) で
+    結果を共有できる。ディスク上のエントリも件数 (新しい順に maxsize 件) と TTL で削除する。
+    """
+
+    def __init__(self, maxsize=128, ttl_seconds=3600, persist_dir=None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.persist_dir = persist_dir
+        # 永続化したエントリの有効期限を再起動後も保てるよう、壁時計を使う
+        # (読み込み時だけ _load_time に作成時刻を入れて、元の時刻で挿入する)
+        self._load_time = None
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl_seconds, timer=self._timer)
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+            self._load_from_disk()
+
+    def _timer(self):
+        return self._load_time if self._load_time is not None else time.time()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is None and self.persist_dir:
+            # 他のプロセスが保存したエントリ
+            entry = self._read_entry(key)
+            if entry is None:
+                return None
+            with self._lock:
+                self._load_time = entry['created_at']
+                try:
+                    self._cache[key] = entry
+                finally:
+                    self._load_time = None
+        return entry['value'] if entry is not None else None
+
+    def put(self, key, value):
+        entry = {'created_at': time.time(), 'value': value}
+        with self._lock:
+            self._cache[key] = entry
+        if self.persist_dir:
+            with self._disk_lock:
+                self._write_entry(key, entry)
+                self._prune_disk()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._cache)
+
+    def _entry_path(self, key):
+        return os.path.join(self.persist_dir, key + CACHE_FILE_SUFFIX)
+
+    def _write_entry(self, key, entry):
+        tmp_path = self._entry_path(key) + f'.{os.getpid()}.tmp'
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self._entry_path(key))
+        except OSError as e:
+            logger.warning("Failed to persist cache entry %s: %s", key, e)
+
+    def _read_entry(self, key):
+        """ディスク上の期限内のエントリ。なければ None。"""
+        try:
+            with gzip.open(self._entry_path(key), 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping unreadable cache entry %s: %s", key, e)
+            return None
+        if time.time() - entry.get('created_at', 0) >= self.ttl_seconds:
+            return None
+        return entry
+
+    def _prune_disk(self):
+        """
+        期限切れのエントリと、新しい順に maxsize 件を超えたエントリのファイルを削除する。
+        ディスクは他のプロセスと共有しうるので、このプロセスのメモリ上の LRU ではなくファイルの更新時刻で判断する。
+        """
+        now = time.time()
+        files = []
+        for file_name in os.listdir(self.persist_dir):
+            if not file_name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            path = os.path.join(self.persist_dir, file_name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        files.sort(reverse=True)
+        for index, (mtime, path) in enumerate(files):
+            if index >= self.maxsize or now - mtime >= self.ttl_seconds:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _load_from_disk(self):
+        """期限内のエントリを古い順に読み込む (上限を超えた分は LRU で古いものから追い出される)。"""
+        entries = []
+        now = time.time()
+        for file_name in os.listdir(self.persist_dir):
+            if not file_name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            try:
+                with gzip.open(os.path.join(self.persist_dir, file_name), 'rt', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping unreadable cache file %s: %s", file_name, e)
+                continue
+            if now - entry.get('created_at', 0) < self.ttl_seconds:
+                entries.append((entry['created_at'], file_name[:-len(CACHE_FILE_SUFFIX)], entry))
+        entries.sort(key=lambda item: item[0])
+        for created_at, key, entry in entries:
+            self._load_time = created_at
+            self._cache[key] = entry
+        self._load_time = None
+        self._prune_disk()
+        logger.info("Loaded %d cached schedule results from %s", len(self._cache), self.persist_dir)
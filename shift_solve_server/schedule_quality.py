@@ -0,0 +1,93 @@
+# python_shift_solver/schedule_quality.py
+"""
+生成済みのシフト (assignments) の品質指標を、入力と割り当てだけから計算する。
+ソルバーの内部状態に依存しないので、ソルバーの実装やモードが違っても同じ基準で比べられる。
+"""
+import hashlib
+import json
+
+IDLE_PREF_NO_GAP = '空きコマなし希望'
+IDLE_PREF_GAP_OK = '空きコマ許容'
+MAX_IDLE_GAP_OK = 2  # 空きコマ許容の生徒でも、これを超える空きは違反
+
+# schedule_cost の重み (cpsat_solver の目的関数と同じ優先順位。小さいほど良い)
+COST_UNASSIGNED_UNIT = 1000      # 未割り当ての希望コマ1コマ
+COST_IDLE_GAP_VIOLATION = 200    # 空きコマの希望に反する (生徒, 日) 1件
+COST_MIN_DESIRED_SHORTFALL = 100  # minDesiredPeriods に満たない (講師, 日) 1件
+COST_IDLE_PERIOD = 10            # 生徒の空きコマ1つ
+
+
+def _max_gap(periods):
+    periods = sorted(periods)
+    return max((b - a - 1 for a, b in zip(periods, periods[1:])), default=0)
+
+
+def assignments_digest(assignments):
+    """割り当ての内容 (順序は無視) のハッシュ。リファクタリング前後で結果が変わっていないかの確認に使う。"""
+    rows = sorted((a['date'], a['period'], a['teacherId'], a['studentId'], a['subject']) for a in assignments)
+    return hashlib.sha256(json.dumps(rows, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def evaluate_schedule(input_data, assignments):
+    """
+    品質指標を dict で返す。
+      units_desired / units_assigned / units_unassigned: 希望コマ数・割り当て済み・未割り当て
+      idle_gap_violations: 空きコマの希望に反する (生徒, 日) の数
+      idle_periods: 生徒の空きコマの合計
+      min_desired_shortfalls: 担当コマ数が minDesiredPeriods に満たない (講師, 日) の数
+      conflicts: 講師または生徒が同じコマに二重に入っている数 (0 でなければバグ)
+    """
+    teachers = {t['id']: t for t in input_data.get('teachers', [])}
+    students = {s['id']: s for s in input_data.get('students', [])}
+
+    assigned_units = {}  # (student_id, subject) -> 件数
+    student_periods = {}  # (student_id, date) -> [period]
+    teacher_day_count = {}  # (teacher_id, date) -> 件数
+    teacher_slots, student_slots = set(), set()
+    conflicts = 0
+    for a in assignments:
+        key = (a['studentId'], a['subject'])
+        assigned_units[key] = assigned_units.get(key, 0) + 1
+        student_periods.setdefault((a['studentId'], a['date']), []).append(a['period'])
+        teacher_day_count[(a['teacherId'], a['date'])] = teacher_day_count.get((a['teacherId'], a['date']), 0) + 1
+        teacher_slot = (a['teacherId'], a['date'], a['period'])
+        student_slot = (a['studentId'], a['date'], a['period'])
+        conflicts += (teacher_slot in teacher_slots) + (student_slot in student_slots)
+        teacher_slots.add(teacher_slot)
+        student_slots.add(student_slot)
+
+    units_desired = units_unassigned = 0
+    for s_id, student in students.items():
+        for course in student.get('desiredCourses', []):
+            units_desired += course.get('units', 0)
+            units_unassigned += max(0, course.get('units', 0) - assigned_units.get((s_id, course.get('subject')), 0))
+
+    idle_gap_violations = idle_periods = 0
+    for (s_id, _), periods in student_periods.items():
+        max_gap = _max_gap(periods)
+        idle_periods += max(periods) - min(periods) + 1 - len(set(periods))
+        idle_pref = students.get(s_id, {}).get('idleTimePreference')
+        if (idle_pref == IDLE_PREF_NO_GAP and max_gap > 0) or (idle_pref == IDLE_PREF_GAP_OK and max_gap > MAX_IDLE_GAP_OK):
+            idle_gap_violations += 1
+
+    min_desired_shortfalls = sum(
+        1 for (t_id, _), count in teacher_day_count.items()
+        if count < teachers.get(t_id, {}).get('minDesiredPeriods', 1))
+
+    return {
+        'units_desired': units_desired,
+        'units_assigned': len(assignments),
+        'units_unassigned': units_unassigned,
+        'idle_gap_violations': idle_gap_violations,
+        'idle_periods': idle_periods,
+        'min_desired_shortfalls': min_desired_shortfalls,
+        'conflicts': conflicts,
+    }
+
+
+def schedule_cost(quality):
+    """evaluate_schedule の指標から、シフトの良し悪しを1つの値 (小さいほど良い) にまとめる。"""
+    return (quality['units_unassigned'] * COST_UNASSIGNED_UNIT
+            + quality['idle_gap_violations'] * COST_IDLE_GAP_VIOLATION
+            + quality['min_desired_shortfalls'] * COST_MIN_DESIRED_SHORTFALL
+            + quality['idle_periods'] * COST_IDLE_PERIOD)
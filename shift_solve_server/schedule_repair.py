@@ -0,0 +1,135 @@
+# python_shift_solver/schedule_repair.py
+from shift_generater import (
+    can_teacher_teach_subject,
+    generate_actual_shifts,
+    get_available_dates,
+    get_default_periods,
+)
+
+
+def _changed_ids(previous_items, current_items):
+    """id ごとに前回と今回の内容を比較し、追加・削除・変更された id の集合を返す。"""
+    previous_by_id = {item.get('id'): item for item in previous_items}
+    current_by_id = {item.get('id'): item for item in current_items}
+    changed = set()
+    for item_id in previous_by_id.keys() | current_by_id.keys():
+        if previous_by_id.get(item_id) != current_by_id.get(item_id):
+            changed.add(item_id)
+    return changed
+
+
+def diff_inputs(previous_input, input_data):
+    """前回の入力と今回の入力を比較し、(変更された講師ID, 変更された生徒ID) を返す。"""
+    changed_teacher_ids = _changed_ids(previous_input.get('teachers', []), input_data.get('teachers', []))
+    changed_student_ids = _changed_ids(previous_input.get('students', []), input_data.get('students', []))
+    return changed_teacher_ids, changed_student_ids
+
+
+def validate_assignments(input_data, previous_assignments):
+    """
+    前回の割り当てを今回の入力に照らして検証し、(有効な割り当て, 無効になった割り当て) を返す。
+    日付・時限・講師/生徒の空き・担当可能科目・ダブルブッキング・希望コマ数を確認する。
+    ダブルブッキングや希望コマ数の超過は、リストの先にある割り当てを優先して残す。
+    """
+    admin_settings = input_data.get('adminSettings', {})
+    days_of_week_jp = input_data.get('constants', {}).get('DAYS_OF_WEEK_JP', [])
+    teachers_by_id = {t['id']: t for t in input_data.get('teachers', [])}
+    students_by_id = {s['id']: s for s in input_data.get('students', [])}
+    available_dates = set(get_available_dates(admin_settings))
+
+    default_periods_cache = {}
+    used_teacher_slots = set()
+    used_student_slots = set()
+    used_units = {}  # (student_id, subject) -> count
+    kept, removed = [], []
+    for assignment in previous_assignments:
+        date_str, period = assignment.get('date'), assignment.get('period')
+        teacher = teachers_by_id.get(assignment.get('teacherId'))
+        student = students_by_id.get(assignment.get('studentId'))
+        subject = assignment.get('subject')
+
+        is_valid = teacher is not None and student is not None and date_str in available_dates
+        if is_valid:
+            if date_str not in default_periods_cache:
+                default_periods_cache[date_str] = get_default_periods(date_str, admin_settings, days_of_week_jp)
+            desired_units = {course['subject']: course['units'] for course in student.get('desiredCourses', [])}
+            unit_key = (student['id'], subject)
+            is_valid = period in default_periods_cache[date_str] and \
+                period in teacher.get('selectedDateSlots', {}).get(date_str, []) and \
+                period in student.get('availableLectureSlots', {}).get(date_str, []) and \
+                can_teacher_teach_subject(teacher, student.get('affiliation'), subject, admin_settings) and \
+                (teacher['id'], date_str, period) not in used_teacher_slots and \
+                (student['id'], date_str, period) not in used_student_slots and \
+                used_units.get(unit_key, 0) < desired_units.get(subject, 0)
+
+        if not is_valid:
+            removed.append(assignment)
+            continue
+        used_teacher_slots.add((teacher['id'], date_str, period))
+        used_student_slots.add((student['id'], date_str, period))
+        used_units[unit_key] = used_units.get(unit_key, 0) + 1
+        kept.append({
+            **assignment,
+            "teacherName": teacher.get('name'),
+            "studentName": student.get('name'),
+        })
+    return kept, removed
+
+
+def repair_shifts(input_data, previous_assignments, previous_input=None,
+                  changed_teacher_ids=None, changed_student_ids=None):
+    """
+    既存のシフトを入力の差分に合わせて修復する。
+
+    前回の割り当てのうち今回の入力でも有効なものはそのまま固定し、
+    影響を受けた生徒だけを貪欲法で再割り当てする。影響を受けた生徒は
+    (1) 変更された生徒、(2) 割り当てを失った生徒、(3) 変更された講師が担当できる科目に
+    未割り当てコマが残っている生徒。差分が与えられない場合は未割り当てコマが残る全生徒。
+
+    戻り値: (assignments, summary)
+    """
+    if previous_input is not None:
+        changed_teacher_ids, changed_student_ids = diff_inputs(previous_input, input_data)
+    has_diff = changed_teacher_ids is not None or changed_student_ids is not None
+    changed_teacher_ids = set(changed_teacher_ids or [])
+    changed_student_ids = set(changed_student_ids or [])
+
+    kept, removed = validate_assignments(input_data, previous_assignments)
+
+    assigned_units = {}  # (student_id, subject) -> count
+    for assignment in kept:
+        key = (assignment['studentId'], assignment['subject'])
+        assigned_units[key] = assigned_units.get(key, 0) + 1
+
+    changed_teachers = [t for t in input_data.get('teachers', []) if t['id'] in changed_teacher_ids]
+    affected_student_ids = changed_student_ids | {a.get('studentId') for a in removed}
+    for student in input_data.get('students', []):
+        if student['id'] in affected_student_ids:
+            continue
+        for course in student.get('desiredCourses', []):
+            if assigned_units.get((student['id'], course['subject']), 0) >= course['units']:
+                continue
+            # 未割り当てコマが残っている
+            if not has_diff or any(
+                    can_teacher_teach_subject(t, student.get('affiliation'), course['subject'], input_data.get('adminSettings', {}))
+                    for t in changed_teachers):
+                affected_student_ids.add(student['id'])
+                break
+
+    # 影響を受けた生徒だけを対象に、固定済みの割り当てを前提として貪欲法で割り当てる
+    # (CP-SAT は固定済みの割り当てを扱わないため、修復では常に貪欲法を使う)
+    repair_input = {
+        **input_data,
+        'students': [s for s in input_data.get('students', []) if s['id'] in affected_student_ids],
+        'solverOptions': {**input_data.get('solverOptions', {}), 'solver': 'greedy'},
+    }
+    assignments = generate_actual_shifts(repair_input, fixed_assignments=kept)
+
+    summary = {
+        "num_kept": len(kept),
+        "num_removed": len(removed),
+        "num_added": len(assignments) - len(kept),
+        "affected_student_ids": sorted(affected_student_ids, key=str),
+        "changed_teacher_ids": sorted(changed_teacher_ids, key=str),
+    }
+    return assignments, summary
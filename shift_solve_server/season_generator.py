@@ -0,0 +1,150 @@
+# python_shift_solver/season_generator.py
+"""
+ベンチマーク・負荷試験用の講習会データ (講師・生徒・管理設定) を乱数で生成する。
+出力はフロントエンド (App.jsx) が /generate_schedule に送る入力と同じ形で、seed が同じなら同じ入力になる。
+"""
+import random
+from datetime import date, timedelta
+
+DAYS_OF_WEEK_JP = ["日", "月", "火", "水", "木", "金", "土"]
+PERIOD_DEFINITIONS = {
+    1: {"id": 1, "label": "1限", "time": "14:00-15:30"},
+    2: {"id": 2, "label": "2限", "time": "16:20-17:50"},
+    3: {"id": 3, "label": "3限", "time": "18:00-19:30"},
+    4: {"id": 4, "label": "4限", "time": "19:40-21:10"},
+    5: {"id": 5, "label": "5限", "time": "21:20-22:00"},
+    6: {"id": 6, "label": "6限", "time": "22:10-22:50"},
+}
+DEFAULT_SHIFT_PERIODS_BY_DAY = {
+    "月": [2, 3, 4, 5, 6], "火": [2, 3, 4, 5, 6], "水": [2, 3, 4, 5, 6],
+    "木": [2, 3, 4, 5, 6], "金": [2, 3, 4, 5, 6], "土": [2, 3, 4, 5], "日": [],
+}
+SUBJECT_SETTINGS = {
+    "小学生": {"grades": ["1年", "2年", "3年", "4年", "5年", "6年"],
+              "availableSubjects": ["算数", "国語", "理科", "社会", "英語"]},
+    "中学生": {"grades": ["1年", "2年", "3年"],
+              "availableSubjects": ["数学", "国語", "理科", "社会", "英語"]},
+    "高校生": {"grades": ["1年", "2年", "3年"],
+              "availableSubjects": ["数学I", "数学A", "数学II", "数学B", "英語", "現代文", "古文", "物理基礎", "化学基礎"]},
+}
+AFFILIATION_WEIGHTS = {"小学生": 3, "中学生": 4, "高校生": 3}
+IDLE_TIME_PREFERENCES = ["空きコマなし希望", "空きコマ許容"]
+SCHEDULING_PREFERENCES = ["集中希望", "分散希望", ""]
+MIN_DESIRED_PERIODS_OPTIONS = [1, 2, 3, 4]
+TEACHER_RATIO = 0.2  # 人数のうち講師の割合
+DEFAULT_START_DATE = "2025-07-21"  # 夏期講習 (月曜始まり)
+
+
+def _pick_block(rng, periods, min_length=1):
+    """その日の開講時限から連続した時限のまとまりを選ぶ (生徒・講師とも通しで来ることが多い)。"""
+    length = rng.randint(min(min_length, len(periods)), len(periods))
+    start = rng.randint(0, len(periods) - length)
+    return periods[start:start + length]
+
+
+def generate_season(seed, num_people=None, num_days=30, num_teachers=None, num_students=None,
+                    start_date=DEFAULT_START_DATE, num_holidays=None):
+    """
+    講習会1期分の入力を生成する。人数は num_people (講師が約2割) か num_teachers / num_students で指定する。
+    期間は start_date から num_days 日で、休日 (num_holidays 日、既定は約10日に1日) を含む。
+    """
+    rng = random.Random(seed)
+    if num_teachers is None or num_students is None:
+        num_people = num_people or 50
+        num_teachers = max(1, round(num_people * TEACHER_RATIO)) if num_teachers is None else num_teachers
+        num_students = max(1, num_people - num_teachers) if num_students is None else num_students
+
+    start = date.fromisoformat(start_date)
+    dates = [(start + timedelta(days=i)).isoformat() for i in range(num_days)]
+    if num_holidays is None:
+        num_holidays = num_days // 10
+    holidays = sorted(rng.sample(dates[1:-1], min(num_holidays, max(0, len(dates) - 2))))
+    # 休日以外で開講時限のある日と、その日の時限
+    open_days = []
+    for date_str in dates:
+        periods = DEFAULT_SHIFT_PERIODS_BY_DAY[DAYS_OF_WEEK_JP[date.fromisoformat(date_str).isoweekday() % 7]]
+        if date_str not in holidays and periods:
+            open_days.append((date_str, periods))
+
+    affiliations = list(AFFILIATION_WEIGHTS)
+    weights = [AFFILIATION_WEIGHTS[aff] for aff in affiliations]
+
+    students = []
+    for i in range(num_students):
+        affiliation = rng.choices(affiliations, weights)[0]
+        settings = SUBJECT_SETTINGS[affiliation]
+        subjects = rng.sample(settings["availableSubjects"], rng.randint(1, 3))
+        # 受講コマ数は期間の長さにおおよそ比例させる
+        max_units = max(1, min(20, round(len(open_days) * 0.3)))
+        attendance = rng.uniform(0.3, 0.8)
+        available_slots = {}
+        for date_str, periods in open_days:
+            if rng.random() < attendance:
+                available_slots[date_str] = _pick_block(rng, periods)
+        students.append({
+            "id": f"student-{i:05d}",
+            "name": f"生徒{i:05d}",
+            "affiliation": affiliation,
+            "grade": rng.choice(settings["grades"]),
+            "desiredCourses": [{"subject": subject, "units": rng.randint(1, max_units)} for subject in subjects],
+            "schedulingPreference": rng.choice(SCHEDULING_PREFERENCES),
+            "idleTimePreference": rng.choices(IDLE_TIME_PREFERENCES, [6, 4])[0],
+            "availableLectureSlots": available_slots,
+        })
+
+    teachers = []
+    regular_pairs = set()  # (生徒ID, 科目): 1人の生徒・科目にレギュラー講師は1人
+    for i in range(num_teachers):
+        teachable = {}
+        for affiliation in rng.sample(affiliations, rng.randint(1, 2)):
+            available_subjects = SUBJECT_SETTINGS[affiliation]["availableSubjects"]
+            teachable[affiliation] = rng.sample(available_subjects, rng.randint(2, len(available_subjects)))
+        attendance = rng.uniform(0.3, 0.7)
+        selected_slots = {}
+        for date_str, periods in open_days:
+            if rng.random() < attendance:
+                selected_slots[date_str] = _pick_block(rng, periods, min_length=2)
+
+        regular_classes = []
+        for student in rng.sample(students, min(len(students), rng.randint(0, 4))):
+            subjects = [course["subject"] for course in student["desiredCourses"]
+                        if course["subject"] in teachable.get(student["affiliation"], [])
+                        and (student["id"], course["subject"]) not in regular_pairs]
+            if not subjects:
+                continue
+            subject = rng.choice(subjects)
+            regular_pairs.add((student["id"], subject))
+            regular_classes.append({
+                "studentName": student["name"],
+                "studentAffiliation": student["affiliation"],
+                "studentGrade": student["grade"],
+                "subject": subject,
+                "day": rng.choice([day for day, periods in DEFAULT_SHIFT_PERIODS_BY_DAY.items() if periods]),
+                "period": rng.choice(list(PERIOD_DEFINITIONS)),
+            })
+
+        teachers.append({
+            "id": f"teacher-{i:04d}",
+            "name": f"講師{i:04d}",
+            "teachableSubjectsByAffiliation": teachable,
+            "minDesiredPeriods": rng.choices(MIN_DESIRED_PERIODS_OPTIONS, [4, 3, 2, 1])[0],
+            "regularClasses": regular_classes,
+            "selectedDateSlots": selected_slots,
+        })
+
+    return {
+        "teachers": teachers,
+        "students": students,
+        "adminSettings": {
+            "commonShiftStartDate": dates[0] if dates else "",
+            "commonShiftEndDate": dates[-1] if dates else "",
+            "holidays": holidays,
+            "suspensionDays": [],
+            "defaultShiftPeriodsByDay": DEFAULT_SHIFT_PERIODS_BY_DAY,
+            "subjectSettingsByAffiliation": SUBJECT_SETTINGS,
+        },
+        "constants": {
+            "DAYS_OF_WEEK_JP": DAYS_OF_WEEK_JP,
+            "PERIOD_DEFINITIONS": PERIOD_DEFINITIONS,
+        },
+    }
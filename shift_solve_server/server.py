@@ -1,24 +1,142 @@
-from flask import Flask, request, jsonify
-import json
+from flask import Flask, Response, request, jsonify, stream_with_context
+import logging
+import math
 import os
+import queue
+import threading
+import time
+import traceback
 from flask_cors import CORS # CORSを有効にするために追加
-from shift_generater import generate_actual_shifts # shift_solver.py から関数をインポート
+from shift_generater import SolveCancelled, generate_actual_shifts, solve_schedule # shift_solver.py から関数をインポート
+from schedule_repair import repair_shifts
+from batch_solver import build_scenario_input, compare_scenarios, find_invalid_field, scenario_name, solve_batch
+from schedule_quality import evaluate_schedule, schedule_cost
+from result_cache import ResultCache, make_cache_key
+from job_queue import JobQueue, JobQueueFull, JOB_SUCCEEDED, JOB_FAILED, FINISHED_STATUSES
+from metrics import SolverMetrics, new_solve_stats
+from input_archive import InputArchive, DEFAULT_ARCHIVE_DIR
+from response_encoding import FastJSONProvider, dumps_bytes, gzip_response
+
+# ソルバーのログレベル (DEBUG にすると割り当て1件ごとのログやスコアの詳細も出力する)
+logging.basicConfig(level=os.environ.get("SHIFT_LOG_LEVEL", "INFO"),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app) # すべてのオリジンからのリクエストを許可 (開発用)
+app.json = FastJSONProvider(app) # orjson があれば jsonify / get_json を orjson で行う
+
+# リクエストの大きさの上限 (超えると 413)。レスポンスは JSON を gzip 圧縮する (SHIFT_GZIP_LEVEL=0 で無効)
+app.config["MAX_CONTENT_LENGTH"] = int(float(os.environ.get("SHIFT_MAX_REQUEST_MB", "32")) * 1024 * 1024)
+GZIP_LEVEL = int(os.environ.get("SHIFT_GZIP_LEVEL", "6"))
+
+@app.before_request
+def check_request_size():
+    max_length = app.config["MAX_CONTENT_LENGTH"]
+    if request.content_length is not None and max_length and request.content_length > max_length:
+        return jsonify({"error": f"Request body is too large ({request.content_length} bytes > {max_length} bytes)"}), 413
+
+@app.after_request
+def compress_response(response):
+    return gzip_response(response, request.headers.get("Accept-Encoding"), compresslevel=GZIP_LEVEL)
+
+# 受け取った入力のアーカイブ (回帰・性能確認用のコーパス。python input_archive.py replay で再投入できる)
+# 書き込みはバックグラウンドスレッドで行う。SHIFT_ARCHIVE_DIR を空にすると保存しない
+# (ジョブのワーカープロセスでライタースレッドを起動しないよう、最初のリクエストで生成する)
+ARCHIVE_DIR = os.environ.get("SHIFT_ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)
+input_archive = None
+input_archive_lock = threading.Lock()
+
+def archive_input(key, data):
+    global input_archive
+    if not ARCHIVE_DIR:
+        return None
+    with input_archive_lock:
+        if input_archive is None:
+            input_archive = InputArchive(
+                ARCHIVE_DIR,
+                max_entries=int(os.environ.get("SHIFT_ARCHIVE_MAX_ENTRIES", "1000")),
+                max_age_days=float(os.environ.get("SHIFT_ARCHIVE_MAX_AGE_DAYS", "30")),
+                max_total_mb=float(os.environ.get("SHIFT_ARCHIVE_MAX_TOTAL_MB", "512")),
+            )
+    input_archive.submit(key, data)
+    return key
+
+# フェーズごとの経過時間・カウンターの集計 (/metrics)
+solver_metrics = SolverMetrics()
 
-# 保存先フォルダのパス (このスクリプトが python_shift_solver フォルダ内にあると仮定)
-# スクリプトの場所を基準に絶対パスを生成
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SAVE_DIR = BASE_DIR # python_shift_solver フォルダのルートに保存
-FILE_NAME = "received_schedule_input.json"
-SAVE_PATH = os.path.join(SAVE_DIR, FILE_NAME)
+# /generate_schedule の結果キャッシュ (同じ入力での再生成を省く)
+# SHIFT_CACHE_DIR を指定するとディスクにも保存し、再起動後も引き継ぐ (gunicorn のワーカー間でも共有する)
+# 値は {"assignments": [...], "diagnostics": {...}}
+result_cache = ResultCache(
+    maxsize=int(os.environ.get("SHIFT_CACHE_MAXSIZE", "128")),
+    ttl_seconds=float(os.environ.get("SHIFT_CACHE_TTL_SECONDS", "3600")),
+    persist_dir=os.environ.get("SHIFT_CACHE_DIR") or None,
+)
+
+def get_cached_result(cache_key):
+    cached = result_cache.get(cache_key)
+    if isinstance(cached, list):
+        # 診断情報を返す前にディスクへ保存された結果 (割り当てのリストのみ)
+        cached = {"assignments": cached, "diagnostics": None}
+    return cached
+
+# 非同期ジョブ (/jobs) のワーカー。同時実行数・待ち行列の上限・ジョブごとの制限時間を環境変数で設定する
+# ワーカープロセスはこのモジュールを import し直すため、最初のリクエストで生成する
+# SHIFT_JOB_STATE_DIR を指定するとジョブの状態をディスクに書き出し、gunicorn の別のワーカーからも参照できる
+job_queue = None
+job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = JobQueue(
+                solve_schedule,
+                max_workers=int(os.environ.get("SHIFT_JOB_WORKERS", str(os.cpu_count() or 1))),
+                max_pending=int(os.environ.get("SHIFT_JOB_MAX_PENDING", "32")),
+                default_time_limit_seconds=float(os.environ.get("SHIFT_JOB_TIME_LIMIT_SECONDS", "600")),
+                on_complete=lambda job: result_cache.put(
+                    job['metadata']['cache_key'],
+                    {"assignments": job['result']['assignments'], "diagnostics": job['result']['diagnostics']}),
+                preload_modules=['shift_generater'],
+                state_dir=os.environ.get("SHIFT_JOB_STATE_DIR") or None,
+            )
+        return job_queue
+
+def build_response_data(data, actual_assignments, stats=None, input_key=None, diagnostics=None):
+    response_data = {
+        "message": "シフト生成に成功しました。",
+        "received_data_summary": {
+            "num_teachers": len(data.get("teachers", [])),
+            "num_students": len(data.get("students", [])),
+            "input_archive_key": input_key
+        },
+        "assignments": actual_assignments, # 生成された実際のシフト
+        # 未割り当てのコマと理由、講師の minDesiredPeriods 不足、生徒の空きコマ、レギュラー講師の登録の問題
+        "diagnostics": diagnostics
+    }
+    if stats is not None:
+        response_data["stats"] = stats # フェーズごとの経過時間とカウンター
+    return response_data
+
+def invalid_input_response(data):
+    """
+    入力が JSON オブジェクトで teachers / students / adminSettings / constants / solverOptions の型が正しければ None、
+    そうでなければ 400 のレスポンス。キャッシュキーの計算や data.get() の前に確認する。
+    """
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    invalid_field = find_invalid_field(data)
+    if invalid_field is not None:
+        return jsonify({"error": f"{invalid_field} has an invalid type"}), 400
+    return None
 
 @app.route('/generate_schedule', methods=['POST'])
 def generate_schedule_route():
     """
     Reactアプリケーションからシフト生成データを受け取り、
-    JSONファイルとして保存し、shift_solver.py を使ってシフトを生成し結果を返す。
+    入力をアーカイブに積んで (保存はバックグラウンド)、shift_solver.py を使ってシフトを生成し結果を返す。
     """
     if not request.is_json:
         return jsonify({"error": "Request must be JSON"}), 400
@@ -28,41 +146,406 @@ def generate_schedule_route():
     except Exception as e:
         return jsonify({"error": f"Failed to parse JSON: {str(e)}"}), 400
 
-    # --- 1. JSONデータをファイルに保存 ---
-    try:
-        if not os.path.exists(SAVE_DIR):
-            os.makedirs(SAVE_DIR)
-        with open(SAVE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        print(f"Data saved to {SAVE_PATH}")
-    except Exception as e:
-        print(f"Error saving data to file: {str(e)}")
-        return jsonify({"error": f"Failed to save data to file: {str(e)}"}), 500
+    invalid_response = invalid_input_response(data)
+    if invalid_response is not None:
+        return invalid_response
+
+    # --- 0. 入力をアーカイブし、同じ入力の結果がキャッシュにあればそのまま返す ---
+    cache_key = make_cache_key(data)
+    input_key = archive_input(cache_key, data)
+    cached = get_cached_result(cache_key)
+    solver_metrics.record_cache(cached is not None)
+    if cached is not None:
+        logger.info("Cache hit for %s. Returning %d cached assignments.", cache_key, len(cached['assignments']))
+        response = jsonify(build_response_data(data, cached["assignments"], input_key=input_key,
+                                               diagnostics=cached["diagnostics"]))
+        response.headers["X-Cache"] = "HIT"
+        response.headers["X-Cache-Key"] = cache_key
+        return response, 200
 
-    # --- 2. Pythonでシフト生成コードを実行 ---
+    # --- 1. Pythonでシフト生成コードを実行 ---
     try:
         # shift_solver.py の関数を呼び出してシフトを生成
-        actual_assignments = generate_actual_shifts(data)
-        print(f"Shift generation successful. Generated {len(actual_assignments)} assignments.")
+        stats = new_solve_stats()
+        diagnostics = {}
+        actual_assignments = generate_actual_shifts(data, stats=stats, diagnostics=diagnostics)
+        solver_metrics.record_solve(stats)
+        logger.info("Shift generation successful. Generated %d assignments.", len(actual_assignments))
     except Exception as e:
+        solver_metrics.record_failure()
         error_message = f"Shift generation failed: {str(e)}"
-        print(error_message)
         # エラーの詳細をログに出力（スタックトレースなど）
-        import traceback
-        traceback.print_exc()
+        logger.exception("Shift generation failed: %s", e)
         return jsonify({"error": error_message, "details": traceback.format_exc()}), 500
 
-    # --- 3. 結果をReactアプリケーションに返す ---
+    result_cache.put(cache_key, {"assignments": actual_assignments, "diagnostics": diagnostics})
+
+    # --- 2. 結果をReactアプリケーションに返す ---
+    response = jsonify(build_response_data(data, actual_assignments, stats, input_key=input_key,
+                                           diagnostics=diagnostics))
+    response.headers["X-Cache"] = "MISS"
+    response.headers["X-Cache-Key"] = cache_key
+    return response, 200
+
+# /generate_schedule/batch のシナリオ数の上限と、シナリオを並列に解くワーカープロセス数
+BATCH_MAX_SCENARIOS = int(os.environ.get("SHIFT_BATCH_MAX_SCENARIOS", "16"))
+BATCH_WORKERS = int(os.environ.get("SHIFT_BATCH_WORKERS", str(os.cpu_count() or 1)))
+
+@app.route('/generate_schedule/batch', methods=['POST'])
+def generate_schedule_batch_route():
+    """
+    複数シナリオのシフトを1回のリクエストで生成し、結果を並べて比較指標と一緒に返す。
+    入力は /generate_schedule と同じ項目 (全シナリオ共通) に加えて scenarios (シナリオのリスト)。
+    各シナリオは name と、共通の入力に対する上書き (adminSettings / solverOptions は項目単位、
+    teachers / students / constants はリストごと) を持つ。シナリオごとに結果キャッシュを使う。
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    try:
+        data = request.get_json()
+    except Exception as e:
+        return jsonify({"error": f"Failed to parse JSON: {str(e)}"}), 400
+
+    invalid_response = invalid_input_response(data)
+    if invalid_response is not None:
+        return invalid_response
+    scenarios = data.get("scenarios")
+    if not isinstance(scenarios, list) or not scenarios or not all(isinstance(s, dict) for s in scenarios):
+        return jsonify({"error": "scenarios must be a non-empty list of objects"}), 400
+    if len(scenarios) > BATCH_MAX_SCENARIOS:
+        return jsonify({"error": f"Too many scenarios ({len(scenarios)} > {BATCH_MAX_SCENARIOS})"}), 400
+    names = [scenario_name(scenario, index) for index, scenario in enumerate(scenarios)]
+    if len(set(names)) != len(names):
+        return jsonify({"error": "Scenario names must be unique"}), 400
+    for name, scenario in zip(names, scenarios):
+        invalid_field = find_invalid_field(scenario)
+        if invalid_field is not None:
+            return jsonify({"error": f"Scenario {name}: {invalid_field} has an invalid type"}), 400
+
+    # --- 1. キャッシュにあるシナリオはそのまま使い、残りをまとめて解く ---
+    results = [None] * len(scenarios)
+    cache_keys = []
+    to_solve = []
+    for index, scenario in enumerate(scenarios):
+        scenario_input = build_scenario_input(data, scenario)
+        cache_key = make_cache_key(scenario_input)
+        cache_keys.append(cache_key)
+        archive_input(cache_key, scenario_input)
+        cached = get_cached_result(cache_key)
+        solver_metrics.record_cache(cached is not None)
+        if cached is None:
+            to_solve.append(index)
+            continue
+        quality = evaluate_schedule(scenario_input, cached["assignments"])
+        results[index] = {"index": index, "name": names[index], "assignments": cached["assignments"],
+                          "diagnostics": cached["diagnostics"], "quality": quality, "cost": schedule_cost(quality)}
+
+    started = time.perf_counter()
+    if to_solve:
+        try:
+            solved = solve_batch(data, [scenarios[index] for index in to_solve], num_workers=BATCH_WORKERS)
+        except Exception as e:
+            # ワーカープロセスの例外は result.get() で再送出される
+            solver_metrics.record_failure()
+            error_message = f"Batch shift generation failed: {str(e)}"
+            logger.exception("Batch shift generation failed: %s", e)
+            return jsonify({"error": error_message, "details": traceback.format_exc()}), 500
+        for index, result in zip(to_solve, solved):
+            result["index"] = index
+            results[index] = result
+            if "error" in result:
+                solver_metrics.record_failure()
+                continue
+            solver_metrics.record_solve(result["stats"])
+            result_cache.put(cache_keys[index], {"assignments": result["assignments"], "diagnostics": result["diagnostics"]})
+    logger.info("Batch shift generation: %d scenarios (%d cached) in %.0f ms.",
+                len(scenarios), len(scenarios) - len(to_solve), (time.perf_counter() - started) * 1000)
+
+    # --- 2. 結果を並べて返す ---
+    for index, result in enumerate(results):
+        result["cache"] = "MISS" if index in to_solve else "HIT"
+        result["cache_key"] = cache_keys[index]
     response_data = {
         "message": "シフト生成に成功しました。",
         "received_data_summary": {
             "num_teachers": len(data.get("teachers", [])),
             "num_students": len(data.get("students", [])),
-            "input_file_path": SAVE_PATH
+            "num_scenarios": len(scenarios),
+            "num_cached": len(scenarios) - len(to_solve),
         },
-        "assignments": actual_assignments # 生成された実際のシフト
+        "scenarios": results,
+        "comparison": compare_scenarios(results),
     }
     return jsonify(response_data), 200
 
+# /generate_schedule/stream でイベントがない間に keepalive を送る間隔 (秒)。
+# 書き込みが失敗して初めて切断に気づくので、これが切断を検知してソルバーを止めるまでの時間の目安になる
+STREAM_KEEPALIVE_SECONDS = float(os.environ.get("SHIFT_STREAM_KEEPALIVE_SECONDS", "10"))
+
+
+def ndjson_line(event):
+    return dumps_bytes(event) + b"\n"
+
+
+@app.route('/generate_schedule/stream', methods=['POST'])
+def generate_schedule_stream_route():
+    """
+    /generate_schedule のストリーミング版。入力は同じで、進行状況を NDJSON (1行1イベント) で返す。
+      start: 受け付け (num_teachers, num_students, cache)
+      phase_start / phase_end / progress: フェーズの開始・終了・フェーズ2の進捗
+      assignment: 確定した割り当て1件 (assignment)
+      unassigned: 割り当てられなかった (生徒, 科目) の一覧 (items。理由付き)
+      done: 終了。stats・diagnostics と割り当て件数。CP-SAT やマルチスタートで結果が途中の assignment イベントと異なる場合は
+            assignments に最終結果を入れ、replaces_streamed を true にする
+      error: 失敗 (error, details)
+      keepalive: イベントがない間 STREAM_KEEPALIVE_SECONDS ごとに送る (内容なし。読み飛ばしてよい)
+    クライアントが接続を切ると (keepalive などの書き込みで検知して) ソルバーを打ち切る。
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    try:
+        data = request.get_json()
+    except Exception as e:
+        return jsonify({"error": f"Failed to parse JSON: {str(e)}"}), 400
+
+    invalid_response = invalid_input_response(data)
+    if invalid_response is not None:
+        return invalid_response
+
+    cache_key = make_cache_key(data)
+    archive_input(cache_key, data)
+    cached = get_cached_result(cache_key)
+    solver_metrics.record_cache(cached is not None)
+    start_event = {"event": "start", "num_teachers": len(data.get("teachers", [])),
+                   "num_students": len(data.get("students", [])),
+                   "cache": "HIT" if cached is not None else "MISS", "cache_key": cache_key}
+
+    if cached is not None:
+        def generate_cached():
+            yield ndjson_line(start_event)
+            for assignment in cached["assignments"]:
+                yield ndjson_line({"event": "assignment", "phase": "cache", "assignment": assignment})
+            yield ndjson_line({"event": "done", "num_assignments": len(cached["assignments"]),
+                               "diagnostics": cached["diagnostics"]})
+        return Response(generate_cached(), mimetype="application/x-ndjson", headers={"X-Cache": "HIT"})
+
+    events = queue.Queue()
+    cancelled = threading.Event()
+    streamed = []  # assignment イベントで送った割り当て
+
+    def progress_callback(event):
+        if cancelled.is_set():
+            raise SolveCancelled()
+        if event["event"] == "assignment":
+            streamed.append(event["assignment"])
+        events.put(event)
+
+    def solve():
+        stats = new_solve_stats()
+        diagnostics = {}
+        try:
+            actual_assignments = generate_actual_shifts(data, progress_callback=progress_callback, stats=stats,
+                                                        diagnostics=diagnostics, cancel_event=cancelled)
+        except SolveCancelled:
+            logger.info("Streaming shift generation cancelled by client.")
+            events.put(None)
+            return
+        except Exception as e:
+            solver_metrics.record_failure()
+            logger.exception("Streaming shift generation failed")
+            events.put({"event": "error", "error": f"Shift generation failed: {str(e)}", "details": traceback.format_exc()})
+            events.put(None)
+            return
+        solver_metrics.record_solve(stats)
+        result_cache.put(cache_key, {"assignments": actual_assignments, "diagnostics": diagnostics})
+        done_event = {"event": "done", "num_assignments": len(actual_assignments), "stats": stats,
+                      "diagnostics": diagnostics}
+        if len(streamed) != len(actual_assignments) or any(a is not b for a, b in zip(streamed, actual_assignments)):
+            done_event["assignments"] = actual_assignments
+            done_event["replaces_streamed"] = True
+        events.put(done_event)
+        events.put(None)
+
+    def generate():
+        yield ndjson_line(start_event)
+        threading.Thread(target=solve, name="shift-stream-solver", daemon=True).start()
+        try:
+            while True:
+                # 溜まっているイベントはまとめて1回で書き出す
+                lines = []
+                try:
+                    event = events.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # 切断されていればこの書き込みで GeneratorExit になり、finally でソルバーに打ち切りを伝える
+                    yield ndjson_line({"event": "keepalive"})
+                    continue
+                while event is not None:
+                    lines.append(ndjson_line(event))
+                    try:
+                        event = events.get_nowait()
+                    except queue.Empty:
+                        break
+                if lines:
+                    yield b"".join(lines)
+                if event is None:
+                    return
+        finally:
+            cancelled.set()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"X-Cache": "MISS", "X-Accel-Buffering": "no"})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """ソルバーの計測値 (フェーズごとの経過時間・カウンターの累計と直近の値、キャッシュ・ジョブの状況)。"""
+    metrics = solver_metrics.snapshot()
+    metrics["cache"]["size"] = len(result_cache)
+    metrics["jobs"] = job_queue.stats() if job_queue is not None else None
+    metrics["input_archive"] = input_archive.stats() if input_archive is not None else None
+    return jsonify(metrics), 200
+
+@app.route('/repair_schedule', methods=['POST'])
+def repair_schedule_route():
+    """
+    既存のシフトを入力の変更に合わせて修復する。
+    リクエストは /generate_schedule と同じ入力 (teachers, students, adminSettings, constants) に加えて
+    previousAssignments (前回の割り当て) と、差分として previousInput (前回の入力) または
+    changedTeacherIds / changedStudentIds を受け取る。影響のない割り当てはそのまま残す。
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    try:
+        data = request.get_json()
+    except Exception as e:
+        return jsonify({"error": f"Failed to parse JSON: {str(e)}"}), 400
+
+    invalid_response = invalid_input_response(data)
+    if invalid_response is not None:
+        return invalid_response
+
+    previous_assignments = data.get("previousAssignments")
+    if not isinstance(previous_assignments, list):
+        return jsonify({"error": "previousAssignments must be a list"}), 400
+
+    try:
+        actual_assignments, repair_summary = repair_shifts(
+            data,
+            previous_assignments,
+            previous_input=data.get("previousInput"),
+            changed_teacher_ids=data.get("changedTeacherIds"),
+            changed_student_ids=data.get("changedStudentIds"),
+        )
+        logger.info("Shift repair successful. Kept %d, removed %d, added %d assignments.",
+                    repair_summary['num_kept'], repair_summary['num_removed'], repair_summary['num_added'])
+    except Exception as e:
+        error_message = f"Shift repair failed: {str(e)}"
+        logger.exception("Shift repair failed: %s", e)
+        return jsonify({"error": error_message, "details": traceback.format_exc()}), 500
+
+    response_data = {
+        "message": "シフトの修復に成功しました。",
+        "received_data_summary": {
+            "num_teachers": len(data.get("teachers", [])),
+            "num_students": len(data.get("students", [])),
+        },
+        "repair_summary": repair_summary,
+        "assignments": actual_assignments
+    }
+    return jsonify(response_data), 200
+
+@app.route('/jobs', methods=['POST'])
+def submit_job_route():
+    """
+    シフト生成をジョブとして受け付け、すぐに jobId を返す (202)。
+    入力は /generate_schedule と同じ。jobTimeLimitSeconds (秒) でジョブの制限時間を指定できる
+    (SHIFT_JOB_TIME_LIMIT_SECONDS を上限とする)。
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    try:
+        data = request.get_json()
+    except Exception as e:
+        return jsonify({"error": f"Failed to parse JSON: {str(e)}"}), 400
+
+    invalid_response = invalid_input_response(data)
+    if invalid_response is not None:
+        return invalid_response
+
+    time_limit_seconds = data.get("jobTimeLimitSeconds")
+    if time_limit_seconds is not None:
+        try:
+            time_limit_seconds = float(time_limit_seconds)
+        except (TypeError, ValueError):
+            return jsonify({"error": "jobTimeLimitSeconds must be a number"}), 400
+        if not math.isfinite(time_limit_seconds) or time_limit_seconds <= 0:
+            return jsonify({"error": "jobTimeLimitSeconds must be a positive number"}), 400
+
+    cache_key = make_cache_key(data)
+    archive_input(cache_key, data)
+    cached = get_cached_result(cache_key)
+    if cached is not None:
+        job_id = get_job_queue().add_completed({**cached, "stats": None})
+    else:
+        try:
+            job_id = get_job_queue().submit(data, time_limit_seconds=time_limit_seconds,
+                                            metadata={"cache_key": cache_key})
+        except JobQueueFull as e:
+            return jsonify({"error": str(e)}), 429
+
+    response = jsonify({
+        "jobId": job_id,
+        "status": get_job_queue().get(job_id)["status"],
+        "statusUrl": f"/jobs/{job_id}",
+        "resultUrl": f"/jobs/{job_id}/result",
+    })
+    response.headers["Location"] = f"/jobs/{job_id}"
+    response.headers["X-Cache"] = "HIT" if cached is not None else "MISS"
+    return response, 202
+
+@app.route('/jobs', methods=['GET'])
+def job_stats_route():
+    return jsonify(get_job_queue().stats()), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_route(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result_route(job_id):
+    job = get_job_queue().get(job_id, include_result=True)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    if job["status"] not in FINISHED_STATUSES:
+        return jsonify({"error": f"Job {job_id} is not finished", "status": job["status"]}), 409
+    if job["status"] == JOB_FAILED:
+        return jsonify({"error": f"Shift generation failed: {job['error']}", "details": job["details"]}), 500
+    if job["status"] != JOB_SUCCEEDED:
+        return jsonify({"error": job["error"], "status": job["status"]}), 410
+    return jsonify({
+        "message": "シフト生成に成功しました。",
+        "jobId": job_id,
+        "assignments": job["result"]["assignments"],
+        "diagnostics": job["result"]["diagnostics"],
+        "stats": job["result"]["stats"]
+    }), 200
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_route(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    if not get_job_queue().cancel(job_id):
+        return jsonify({"error": f"Job {job_id} is already finished", "status": job["status"]}), 409
+    return jsonify(get_job_queue().get(job_id)), 200
+
 if __name__ == '__main__':
+    # 開発用 (Werkzeug のデバッグサーバー)。本番は wsgi.py (gunicorn -c gunicorn.conf.py wsgi:app)
     app.run(host='0.0.0.0', port=5001, debug=True)
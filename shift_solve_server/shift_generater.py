@@ -1,6 +1,28 @@
 # python_shift_solver/shift_solver.py
-import copy
+import logging
+import random
+import time
 from datetime import date, timedelta
+from availability_index import AvailabilityIndex
+from batch_scoring import BatchScorer
+from regular_pairing import RegularPairingIndex
+from solver_state import build_solver_state
+from metrics import increment, new_solve_stats, record_timing
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_REPORT_INTERVAL = 50 # フェーズ2で進捗を通知する間隔 (コマ数)
+SCORE_CUTOFF = -500 # フェーズ2でこのスコア以下の候補は割り当てない
+
+# 割り当てられなかった理由 (diagnostics の unassigned[].reason)
+UNASSIGNED_NO_CAPABLE_TEACHER = 'no_capable_teacher' # 担当できる講師がいない
+UNASSIGNED_NO_COMMON_SLOT = 'no_overlapping_slot' # 担当できる講師と空きコマが重ならない (残っていない)
+UNASSIGNED_PENALTY_CUTOFF = 'penalty_cutoff' # 候補はあるが、どれもスコアが SCORE_CUTOFF 以下
+UNASSIGNED_NOT_SELECTED = 'not_selected_by_cpsat' # 貪欲法では割り当てたが、CP-SAT の解では外れた
+
+
+class SolveCancelled(Exception):
+    """cancel_event がセットされたため、シフト生成を途中で打ち切った。"""
 
 def get_teacher_by_id(teachers_orig, teacher_id):
     for teacher in teachers_orig:
@@ -22,7 +44,27 @@ def can_teacher_teach_subject(teacher, student_affiliation, subject, admin_setti
         return False
     return subject in teachable_subjects_by_aff[student_affiliation]
 
-def get_score_for_assignment(student, teacher_status, date_str, period_num, subject, assignments_for_student_on_date):
+def get_available_dates(admin_settings):
+    """commonShiftStartDate〜commonShiftEndDate のうち休日を除いた日付 (ISO形式) のリスト。"""
+    available_dates = []
+    if admin_settings.get('commonShiftStartDate') and admin_settings.get('commonShiftEndDate'):
+        start_date = date.fromisoformat(admin_settings['commonShiftStartDate'])
+        end_date = date.fromisoformat(admin_settings['commonShiftEndDate'])
+        current_date = start_date
+        holidays = set(admin_settings.get('holidays', []))
+        while current_date <= end_date:
+            date_str = current_date.isoformat()
+            if date_str not in holidays:
+                available_dates.append(date_str)
+            current_date += timedelta(days=1)
+    return available_dates
+
+def get_default_periods(date_str, admin_settings, days_of_week_jp):
+    """その日の曜日に開講する時限 (defaultShiftPeriodsByDay) のリスト。"""
+    day_jp_str = days_of_week_jp[date.fromisoformat(date_str).isoweekday() % 7]
+    return admin_settings.get('defaultShiftPeriodsByDay', {}).get(day_jp_str, [])
+
+def get_score_for_assignment(student, teacher_slots_on_day, date_str, period_num, subject, assignments_for_student_on_date):
     """
     特定の割り当て候補に対するスコアを計算する（簡易版）。
     スコアが高いほど良い割り当て。ペナルティは負の値で表現。
@@ -55,7 +97,8 @@ def get_score_for_assignment(student, teacher_status, date_str, period_num, subj
 
         if not is_continuous and len(assignments_for_student_on_date) > 0 : # 既にその日にコマがあり、連続しない場合
             score -= 200 # 大きなペナルティ
-            print(f"  Debug Score: Student {student.get('name')} idle_pref='空きコマなし希望', but assignment on {date_str} P{period_num} is not continuous with {assignments_for_student_on_date}. Score: {score}")
+            logger.debug("Score: Student %s idle_pref='空きコマなし希望', but assignment on %s P%s is not continuous with %s. Score: %s",
+                         student.get('name'), date_str, period_num, assignments_for_student_on_date, score)
 
 
     elif idle_pref == '空きコマ許容':
@@ -72,14 +115,14 @@ def get_score_for_assignment(student, teacher_status, date_str, period_num, subj
                 score -= 50
             elif max_idle > 2: # 3コマ以上の空きは不可
                 score -= 1000 # 実質的に割り当て不可
-                print(f"  Debug Score: Student {student.get('name')} idle_pref='空きコマ許容', but assignment on {date_str} P{period_num} creates >2 idle. Score: {score}")
+                logger.debug("Score: Student %s idle_pref='空きコマ許容', but assignment on %s P%s creates >2 idle. Score: %s",
+                             student.get('name'), date_str, period_num, score)
 
 
     # 2. 講師の負荷分散 (担当コマ数が少ない講師を優先)
-    # teacher_status['assigned_slots_count_total'] のようなものが必要
-    # 今回は teacher_status['assigned_slots_count_on_day'].get(date_str, 0) でその日のコマ数を見る
+    # teacher_slots_on_day はその日の講師の担当コマ数
     # 値が小さいほどスコアを高くしたいので、マイナスで加算
-    score -= teacher_status.get('assigned_slots_count_on_day', {}).get(date_str, 0) * 5 
+    score -= teacher_slots_on_day * 5
 
 
     # 3. 生徒の集中/分散希望 (簡易的)
@@ -94,13 +137,193 @@ def get_score_for_assignment(student, teacher_status, date_str, period_num, subj
     #         score -= 30 # 分散希望なのに同日はペナルティ
 
 
-    # print(f"  Score for {student.get('name')}-{subject} with {teacher_status['obj'].get('name')} on {date_str} P{period_num}: {score}")
+    # print(f"  Score for {student.get('name')}-{subject} with {teacher_name} on {date_str} P{period_num}: {score}")
     return score
 
 
-def generate_actual_shifts(input_data_orig):
-    print("Initializing shift generation process...")
-    input_data = copy.deepcopy(input_data_orig)
+def find_best_candidate_scalar(availability, teachers_status, student_id, student_stat, subject, capable_teachers, stats=None):
+    """
+    候補を1件ずつ get_score_for_assignment で評価するスカラー版。
+    BatchScorer の検証用に残している。戻り値は (score, date_str, period_num, teacher_id) または None。
+    """
+    student = student_stat.obj
+    best_candidate = None
+    for teacher_id_cand in capable_teachers:
+        t_stat_cand = teachers_status[teacher_id_cand]
+        teacher_obj_cand = t_stat_cand.obj
+
+        # 共通の空きコマ (既に埋まっているコマは除外済み) を日付順・時限昇順に走査
+        for date_str_cand, period_cand in availability.iter_common_slots(teacher_id_cand, student_id):
+            d_idx_cand = availability.date_index[date_str_cand]
+            # minDesiredPeriods の事前チェック（簡易）
+            # この1コマを割り当てたとして、その日の講師のコマ数が minDesiredPeriods に届くか、
+            # または既に超えているか。もしこの1コマだけで、minDesiredPeriods に満たないなら避ける。
+            current_teacher_day_slots = t_stat_cand.day_counts[d_idx_cand]
+            min_desired_for_teacher = teacher_obj_cand.get('minDesiredPeriods', 1)
+            
+            # このコマを割り当てると min_desired を満たせるか、または既に満たしているか
+            # ただし、このコマが min_desired を満たすための最後の1コマでない限り、
+            # 他のコマで満たされる可能性もある。
+            # ここでは、「このコマを割り当てても、その日の合計が min_desired 未満で、かつ、
+            # 他に割り当てられる見込みがない（希望コマが少ないなど）」場合はペナルティ。
+            # 今回は単純化のため、スコアリング関数内で考慮する。
+            
+            score = get_score_for_assignment(student, current_teacher_day_slots, date_str_cand, period_cand, subject,
+                                             student_stat.periods_on_day(d_idx_cand, availability.periods))
+            
+            # 講師のminDesiredPeriodsペナルティ
+            # もしこの割り当てでその日のコマ数が min_desired 未満のままなら大きなペナルティ
+            # ただし、他のコマで充足する可能性もあるので、ここでは「この1コマだけ」になる場合を特に問題視
+            if current_teacher_day_slots + 1 < min_desired_for_teacher and len(teacher_obj_cand.get('selectedDateSlots', {}).get(date_str_cand, [])) == current_teacher_day_slots + 1 : # この日がこのコマだけになる場合
+                 if min_desired_for_teacher > 1: # 1コマ希望なら問題なし
+                    score -= 500 # minDesiredPeriods未達で、かつこの日これ以上希望がない場合
+                    logger.debug("Score: Teacher %s minDesiredPeriods penalty for %s. Score: %s",
+                                 teacher_obj_cand.get('name'), date_str_cand, score)
+
+
+            increment(stats, 'candidates_evaluated')
+            if best_candidate is None or score > best_candidate[0]:
+                best_candidate = (score, date_str_cand, period_cand, teacher_id_cand)
+    return best_candidate
+
+
+def order_units_by_priority(units, students_status, availability, noise=0.0, seed=None):
+    """
+    フェーズ2のコマリストを制約の厳しい順に並べ替える: 担当可能講師が少ない科目 → 空きコマが少ない生徒。
+    noise > 0 なら優先度に ±noise の比率で乱数を掛け、同点は乱数で決める (同じ seed なら同じ順序)。
+    同じ (生徒, 科目) のコマは同じ優先度なので並び順は連続したままになる。
+    """
+    rng = random.Random(seed)
+    priority = {}
+    for student_id, subject, _ in units:
+        if (student_id, subject) in priority:
+            continue
+        student = students_status[student_id].obj
+        num_capable = len(availability.get_capable_teachers(student.get('affiliation'), subject))
+        num_free_slots = availability.student_free[student_id].bit_count()
+        priority[(student_id, subject)] = (num_capable * rng.uniform(1 - noise, 1 + noise),
+                                           num_free_slots * rng.uniform(1 - noise, 1 + noise),
+                                           rng.random())
+    return sorted(units, key=lambda unit: priority[(unit[0], unit[1])])
+
+
+def collect_unassigned(students_status, unassigned_reasons, no_capable_teacher_units, default_reason):
+    """
+    割り当てが足りない (生徒, 科目) を理由付きで返す。
+    unassigned_reasons は (生徒ID, 科目) -> (理由, 最良スコア) で、フェーズ2で最後に失敗したときの理由。
+    """
+    unassigned = []
+    for s_id, s_stat in students_status.items():
+        student_obj = s_stat.obj
+        for subject, units_left in s_stat.remaining_desired_units.items():
+            if (s_id, subject) in no_capable_teacher_units:
+                units_left = no_capable_teacher_units[(s_id, subject)]
+            if units_left > 0:
+                reason, best_score = unassigned_reasons.get((s_id, subject), (default_reason, None))
+                unassigned.append({
+                    'studentName': student_obj.get('name'),
+                    'studentId': s_id,
+                    'subject': subject,
+                    'units_left': units_left,
+                    'reason': reason,
+                    'best_score': best_score
+                })
+    return unassigned
+
+
+def collect_teacher_shortfalls(teachers_status, available_dates):
+    """出勤希望日の担当コマ数が minDesiredPeriods に満たない (講師, 日) の一覧。"""
+    shortfalls = []
+    for t_id, t_stat in teachers_status.items():
+        teacher = t_stat.obj
+        min_desired = teacher.get('minDesiredPeriods', 1)
+        selected_date_slots = teacher.get('selectedDateSlots', {})
+        for d_idx, date_str in enumerate(available_dates):
+            if date_str in selected_date_slots: # その日に出勤希望がある
+                assigned_on_day = t_stat.day_counts[d_idx]
+                if 0 < assigned_on_day < min_desired:
+                    shortfalls.append({
+                        'teacherId': t_id,
+                        'teacherName': teacher.get('name'),
+                        'date': date_str,
+                        'assigned': assigned_on_day,
+                        'minDesiredPeriods': min_desired,
+                        'shortfall': min_desired - assigned_on_day
+                    })
+    return shortfalls
+
+
+def collect_student_idle_gaps(students_status, availability):
+    """
+    空きコマのある生徒ごとに、空きコマ数の合計・空きコマのある日数・空きコマの希望に反する日数を返す
+    (空きコマなし希望は空きが1つでもあれば、空きコマ許容は3コマ以上の空きで違反)。
+    """
+    idle_gaps = []
+    for s_id, s_stat in students_status.items():
+        if not s_stat.assigned_mask:
+            continue
+        idle_pref = s_stat.obj.get('idleTimePreference')
+        idle_periods = days_with_idle = violations = 0
+        for d_idx in range(len(availability.available_dates)):
+            periods = sorted(s_stat.periods_on_day(d_idx, availability.periods))
+            if len(periods) < 2:
+                continue
+            idle_on_day = periods[-1] - periods[0] + 1 - len(periods)
+            if idle_on_day == 0:
+                continue
+            idle_periods += idle_on_day
+            days_with_idle += 1
+            max_gap = max(b - a - 1 for a, b in zip(periods, periods[1:]))
+            if idle_pref == '空きコマなし希望' or (idle_pref == '空きコマ許容' and max_gap > 2):
+                violations += 1
+        if idle_periods:
+            idle_gaps.append({
+                'studentId': s_id,
+                'studentName': s_stat.obj.get('name'),
+                'idleTimePreference': idle_pref,
+                'idle_periods': idle_periods,
+                'days_with_idle': days_with_idle,
+                'preference_violations': violations
+            })
+    return idle_gaps
+
+
+def generate_actual_shifts(input_data_orig, fixed_assignments=None, progress_callback=None, stats=None, diagnostics=None,
+                           precomputed=None, cancel_event=None):
+    """
+    シフトを生成して割り当てのリストを返す。
+    progress_callback を渡すと、フェーズの開始やフェーズ2の進捗を dict で通知する。
+    stats (metrics.new_solve_stats()) を渡すと、フェーズごとの経過時間とカウンターを記録する。
+    diagnostics (dict) を渡すと、未割り当てのコマとその理由、講師の minDesiredPeriods 不足、
+    生徒の空きコマ、レギュラー講師の登録の問題を書き込む。
+    precomputed (batch_solver.ScenarioPrecompute) を渡すと、日付の展開と名簿から決まる空き状況の事前計算を
+    同じ講師・生徒リストの他のシナリオと共有する。
+    cancel_event (threading.Event) がセットされると、局所探索と CP-SAT を止めて、次の進捗の通知で SolveCancelled を送出する。
+    """
+    solver_options = input_data_orig.get('solverOptions', {})
+    # --- マルチスタート (solverOptions.solver == "multistart"): 並び順を変えた貪欲法を並列に実行して最良を返す ---
+    if solver_options.get('solver') == 'multistart' and not fixed_assignments:
+        from multistart import solve_multistart
+        return solve_multistart(input_data_orig, progress_callback=progress_callback, stats=stats,
+                                diagnostics=diagnostics)
+
+    logger.info("Initializing shift generation process...")
+    solve_started = phase_started = time.perf_counter()
+
+    def report_progress(event):
+        if cancel_event is not None and cancel_event.is_set():
+            raise SolveCancelled()
+        if progress_callback is not None:
+            progress_callback(event)
+
+    def report_phase_end(phase):
+        if cancel_event is not None and cancel_event.is_set():
+            raise SolveCancelled()
+        if progress_callback is not None:
+            progress_callback({"event": "phase_end", "phase": phase, "assignments": len(assignments),
+                               "elapsed_ms": (time.perf_counter() - phase_started) * 1000})
+    # 入力は読むだけで変更しない (生成中の状態は solver_state の TeacherState / StudentState に持つ)
+    input_data = input_data_orig
 
     teachers_orig = input_data.get('teachers', [])
     students_orig = input_data.get('students', [])
@@ -109,261 +332,305 @@ def generate_actual_shifts(input_data_orig):
     period_definitions = constants.get('PERIOD_DEFINITIONS', {})
     days_of_week_jp = constants.get('DAYS_OF_WEEK_JP', [])
 
-    teachers_status = {
-        t['id']: {
-            'assigned_slots': set(), # (date_str, period_num)
-            'assigned_slots_count_on_day': {}, # {date_str: count}
-            'obj': t
-        } for t in teachers_orig
-    }
-    students_status = {
-        s['id']: {
-            'remaining_desired_units': {
-                course['subject']: course['units'] for course in s.get('desiredCourses', [])
-            },
-            'assigned_slots': set(), # (date_str, period_num)
-            'assigned_periods_on_date': {}, # {date_str: set(period_num)}
-            'obj': s
-        } for s in students_orig
-    }
-    
-    unassigned_student_courses = [] # (student_id, subject, remaining_units)
+    unassigned_reasons = {} # (student_id, subject) -> (reason, best_score): フェーズ2で最後に失敗した理由
+    no_capable_teacher_units = {} # (student_id, subject) -> 担当できる講師がいなかったコマ数
     assignments = []
     
-    available_dates = []
-    if admin_settings.get('commonShiftStartDate') and admin_settings.get('commonShiftEndDate'):
-        start_date = date.fromisoformat(admin_settings['commonShiftStartDate'])
-        end_date = date.fromisoformat(admin_settings['commonShiftEndDate'])
-        current_date = start_date
-        holidays = set(admin_settings.get('holidays', []))
-        while current_date <= end_date:
-            date_str = current_date.isoformat()
-            if date_str not in holidays:
-                available_dates.append(date_str)
-            current_date += timedelta(days=1)
+    if precomputed is not None:
+        available_dates = precomputed.available_dates(admin_settings)
+    else:
+        available_dates = get_available_dates(admin_settings)
+    teachers_status, students_status = build_solver_state(teachers_orig, students_orig, len(available_dates))
     
-    print(f"Processing for {len(available_dates)} available dates: {available_dates}")
+    logger.info("Processing for %d available dates.", len(available_dates))
+    logger.debug("Available dates: %s", available_dates)
+
+    # --- 事前コンパイル: 担当可能講師インデックスと空きコマのビットマスク ---
+    if precomputed is not None:
+        availability = precomputed.availability_index(teachers_orig, students_orig, teachers_status, students_status,
+                                                      available_dates, admin_settings, days_of_week_jp)
+    else:
+        availability = AvailabilityIndex(teachers_status, students_status, available_dates, admin_settings, days_of_week_jp)
+
+    # --- 固定済みの割り当て (スケジュール修復時) を状態に反映 ---
+    # 講師側は全員分、生徒側は students_status に含まれる生徒分だけ反映する
+    for fixed in fixed_assignments or []:
+        d, p, t_id, s_id = fixed['date'], fixed['period'], fixed['teacherId'], fixed['studentId']
+        assignments.append(fixed)
+        if t_id in teachers_status:
+            teachers_status[t_id].day_counts[availability.date_index[d]] += 1
+        if s_id in students_status:
+            s_stat = students_status[s_id]
+            s_stat.assigned_mask |= 1 << availability.slot_bit(d, p)
+            if fixed['subject'] in s_stat.remaining_desired_units:
+                s_stat.remaining_desired_units[fixed['subject']] -= 1
+        availability.mark_assigned(t_id, s_id, d, p)
+
+    record_timing(stats, 'precompile', phase_started)
 
     # --- フェーズ1: レギュラー生徒と講師の講習会マッチングを最優先 ---
-    print("Phase 1: Prioritizing regular student-teacher pairings for workshops...")
+    logger.info("Phase 1: Prioritizing regular student-teacher pairings for workshops...")
+    phase_started = time.perf_counter()
+    phase_start_assignments = len(assignments)
+    report_progress({"event": "phase_start", "phase": "phase1", "assignments": len(assignments)})
+    # レギュラー講師の索引 ((生徒名, 所属, 学年) または生徒ID -> {科目: 講師ID}) を1回だけ構築
+    regular_pairings = RegularPairingIndex(teachers_status, students_status)
+    for issue in regular_pairings.issues:
+        logger.warning("Regular class issue (%s): %s", issue['type'], issue)
+    increment(stats, 'regular_pairing_issues', len(regular_pairings.issues))
     for s_id, s_stat in students_status.items():
-        student = s_stat['obj']
-        # (フェーズ1のロジックは前回とほぼ同じだが、ステータス更新を新しい構造に合わせる)
-        regular_teachers_info = []
-        for t_id, t_stat in teachers_status.items():
-            teacher = t_stat['obj']
-            for reg_class in teacher.get('regularClasses', []):
-                if reg_class.get('studentName') == student.get('name') and \
-                   reg_class.get('studentAffiliation') == student.get('affiliation') and \
-                   reg_class.get('studentGrade') == student.get('grade'):
-                    regular_teachers_info.append({'teacher_id': t_id, 'subject': reg_class.get('subject')})
-        
+        student = s_stat.obj
+        regular_teacher_by_subject = regular_pairings.get(s_id, student)
+        if not regular_teacher_by_subject: continue
+
         for course_info in student.get('desiredCourses', []):
             subject = course_info.get('subject')
-            units_to_assign = s_stat['remaining_desired_units'].get(subject, 0)
+            units_to_assign = s_stat.remaining_desired_units.get(subject, 0)
             if units_to_assign <= 0: continue
 
-            # この科目を担当するレギュラー講師を探す
-            reg_teacher_for_subject = next((rti for rti in regular_teachers_info if rti['subject'] == subject), None)
-            if not reg_teacher_for_subject: continue
-
-            teacher_id = reg_teacher_for_subject['teacher_id']
-            teacher = teachers_status[teacher_id]['obj']
+            # この科目を担当するレギュラー講師
+            teacher_id = regular_teacher_by_subject.get(subject)
+            if teacher_id is None: continue
+            t_stat = teachers_status[teacher_id]
+            teacher = t_stat.obj
 
             if not can_teacher_teach_subject(teacher, student.get('affiliation'), subject, admin_settings):
                 continue
 
-            teacher_available_slots = teacher.get('selectedDateSlots', {})
-            student_available_slots = student.get('availableLectureSlots', {})
-            
             assigned_count_for_this_course_phase1 = 0
-            for date_str in available_dates:
+            # 講師・生徒の空きコママスクの AND で共通の空きコマを日付順・時限昇順に走査
+            for date_str, period in availability.iter_common_slots(teacher_id, s_id):
                 if units_to_assign <= assigned_count_for_this_course_phase1: break
-                if date_str not in teacher_available_slots or date_str not in student_available_slots: continue
-
-                day_jp_str = days_of_week_jp[date.fromisoformat(date_str).isoweekday() % 7]
-                default_periods = admin_settings.get('defaultShiftPeriodsByDay', {}).get(day_jp_str, [])
-                
-                possible_t_periods = set(teacher_available_slots.get(date_str, [])).intersection(default_periods)
-                possible_s_periods = set(student_available_slots.get(date_str, [])).intersection(default_periods)
-                common_periods = sorted(list(possible_t_periods.intersection(possible_s_periods)))
-
-                for period in common_periods:
-                    if units_to_assign <= assigned_count_for_this_course_phase1: break
-                    slot_key = (date_str, period)
-                    if slot_key not in teachers_status[teacher_id]['assigned_slots'] and \
-                       slot_key not in s_stat['assigned_slots']:
-                        
-                        # minDesiredPeriods のチェック (簡易版: この割り当てで0より大きくなるか)
-                        # 本来は、この日の合計が minDesiredPeriods に達する見込みがあるかなど、より詳細なチェックが必要
-                        min_desired = teacher.get('minDesiredPeriods', 1)
-                        # この日の担当コマ数が min_desired 未満で、かつこれが唯一のコマになる可能性は避ける
-                        # (ただし、他のコマが後で割り当てられる可能性もあるので難しい)
-                        # ここでは一旦、単純に割り当ててみる
-
-                        assignments.append({
-                            "date": date_str, "period": period, "teacherId": teacher_id,
-                            "teacherName": teacher.get('name'), "studentId": s_id,
-                            "studentName": student.get('name'), "subject": subject
-                        })
-                        teachers_status[teacher_id]['assigned_slots'].add(slot_key)
-                        teachers_status[teacher_id]['assigned_slots_count_on_day'][date_str] = \
-                            teachers_status[teacher_id]['assigned_slots_count_on_day'].get(date_str, 0) + 1
-                        
-                        s_stat['assigned_slots'].add(slot_key)
-                        s_stat['assigned_periods_on_date'].setdefault(date_str, set()).add(period)
-                        s_stat['remaining_desired_units'][subject] -= 1
-                        assigned_count_for_this_course_phase1 += 1
-                        print(f"Phase 1 Assign (Regular): {student.get('name')}({subject}) with {teacher.get('name')} on {date_str} P{period}")
+                # minDesiredPeriods のチェック (簡易版: この割り当てで0より大きくなるか)
+                # 本来は、この日の合計が minDesiredPeriods に達する見込みがあるかなど、より詳細なチェックが必要
+                min_desired = teacher.get('minDesiredPeriods', 1)
+                # この日の担当コマ数が min_desired 未満で、かつこれが唯一のコマになる可能性は避ける
+                # (ただし、他のコマが後で割り当てられる可能性もあるので難しい)
+                # ここでは一旦、単純に割り当ててみる
+
+                assignments.append({
+                    "date": date_str, "period": period, "teacherId": teacher_id,
+                    "teacherName": teacher.get('name'), "studentId": s_id,
+                    "studentName": student.get('name'), "subject": subject
+                })
+                report_progress({"event": "assignment", "phase": "phase1", "assignment": assignments[-1]})
+                t_stat.day_counts[availability.date_index[date_str]] += 1
+                s_stat.assigned_mask |= 1 << availability.slot_bit(date_str, period)
+                s_stat.remaining_desired_units[subject] -= 1
+                availability.mark_assigned(teacher_id, s_id, date_str, period)
+                assigned_count_for_this_course_phase1 += 1
+                logger.debug("Phase 1 Assign (Regular): %s(%s) with %s on %s P%s",
+                             student.get('name'), subject, teacher.get('name'), date_str, period)
+
 
+    increment(stats, 'assignments_phase1', len(assignments) - phase_start_assignments)
+    record_timing(stats, 'phase1', phase_started)
+    report_phase_end('phase1')
 
     # --- フェーズ2: 残りの希望コマをスコアリングベースで割り当て ---
-    print("Phase 2: Assigning remaining desired courses with scoring...")
+    logger.info("Phase 2: Assigning remaining desired courses with scoring...")
+    phase_started = time.perf_counter()
+    phase_start_assignments = len(assignments)
+    report_progress({"event": "phase_start", "phase": "phase2", "assignments": len(assignments)})
     
     # 割り当てるべきコマのリストを作成 (生徒ID, 科目, 残りユニット数)
     コマリスト = []
     for s_id, s_stat in students_status.items():
-        for subject, units in s_stat['remaining_desired_units'].items():
+        for subject, units in s_stat.remaining_desired_units.items():
             if units > 0:
                 コマリスト.extend([(s_id, subject, unit_num) for unit_num in range(units)]) # 1コマずつ処理
 
-    # コマリストを何らかの順序でソート（例：制約の厳しい生徒優先など。今回は単純な順）
-    # コマリスト.sort(key=lambda x: students_status[x[0]]['obj'].get('some_priority_factor', 0), reverse=True)
-
-    for student_id, subject, _ in コマリスト: # 1コマずつ割り当てを試みる
+    # 候補スコアリング: 既定は NumPy の一括計算。solverOptions.scoring == "scalar" で従来のスカラー版
+    batch_scorer = None
+    if solver_options.get('scoring', 'vectorized') != 'scalar':
+        batch_scorer = BatchScorer(availability, teachers_status, students_status)
+
+    # コマリストの順序: 既定は入力順。solverOptions.unitOrder == "priority" で制約の厳しいコマから
+    # (orderNoise で優先度に乱数を掛け、randomSeed で再現できる。マルチスタートで使う)
+    if solver_options.get('unitOrder', 'input') == 'priority':
+        コマリスト = order_units_by_priority(コマリスト, students_status, availability,
+                                         noise=float(solver_options.get('orderNoise', 0.0)),
+                                         seed=solver_options.get('randomSeed'))
+
+    for unit_index, (student_id, subject, _) in enumerate(コマリスト): # 1コマずつ割り当てを試みる
+        if unit_index % PROGRESS_REPORT_INTERVAL == 0:
+            report_progress({"event": "progress", "phase": "phase2", "units_done": unit_index,
+                             "units_total": len(コマリスト), "assignments": len(assignments)})
         student_stat = students_status[student_id]
-        student = student_stat['obj']
+        student = student_stat.obj
         
-        if student_stat['remaining_desired_units'].get(subject, 0) <= 0:
+        if student_stat.remaining_desired_units.get(subject, 0) <= 0:
             continue # この科目は既に充足
 
-        best_candidate = None # (score, date_str, period_num, teacher_id)
-        
-        # 候補となる講師をリストアップ
-        capable_teachers = []
-        for t_id, t_stat_loop in teachers_status.items():
-            teacher_loop = t_stat_loop['obj']
-            if can_teacher_teach_subject(teacher_loop, student.get('affiliation'), subject, admin_settings):
-                capable_teachers.append(teacher_loop)
+        # 候補となる講師をリストアップ (事前コンパイル済みの (所属, 科目) インデックスを参照)
+        capable_teachers = availability.get_capable_teachers(student.get('affiliation'), subject)
 
         if not capable_teachers:
-            print(f"  No capable teacher for {student.get('name')} - {subject}. Skipping this unit.")
-            unassigned_student_courses.append({'studentName': student.get('name'), 'studentId': student_id, 'subject': subject, 'units_left': student_stat['remaining_desired_units'].get(subject,0) })
-            student_stat['remaining_desired_units'][subject] = 0 # これ以上探さない
+            logger.debug("No capable teacher for %s - %s. Skipping this unit.", student.get('name'), subject)
+            no_capable_teacher_units[(student_id, subject)] = student_stat.remaining_desired_units.get(subject, 0)
+            unassigned_reasons[(student_id, subject)] = (UNASSIGNED_NO_CAPABLE_TEACHER, None)
+            increment(stats, 'units_no_capable_teacher', student_stat.remaining_desired_units.get(subject, 0))
+            student_stat.remaining_desired_units[subject] = 0 # これ以上探さない
             continue
             
-        for teacher_obj_cand in capable_teachers:
-            teacher_id_cand = teacher_obj_cand.get('id')
-            t_stat_cand = teachers_status[teacher_id_cand]
-            
-            teacher_available_slots = teacher_obj_cand.get('selectedDateSlots', {})
-            student_available_slots = student.get('availableLectureSlots', {})
-
-            for date_str_cand in available_dates:
-                if date_str_cand not in teacher_available_slots or date_str_cand not in student_available_slots:
-                    continue
-
-                day_jp_str = days_of_week_jp[date.fromisoformat(date_str_cand).isoweekday() % 7]
-                default_periods = admin_settings.get('defaultShiftPeriodsByDay', {}).get(day_jp_str, [])
-
-                possible_t_periods = set(teacher_available_slots.get(date_str_cand, [])).intersection(default_periods)
-                possible_s_periods = set(student_available_slots.get(date_str_cand, [])).intersection(default_periods)
-                common_periods = sorted(list(possible_t_periods.intersection(possible_s_periods)))
-
-                for period_cand in common_periods:
-                    slot_key = (date_str_cand, period_cand)
-                    if slot_key in t_stat_cand['assigned_slots'] or slot_key in student_stat['assigned_slots']:
-                        continue # 既にどちらかが埋まっている
-
-                    # minDesiredPeriods の事前チェック（簡易）
-                    # この1コマを割り当てたとして、その日の講師のコマ数が minDesiredPeriods に届くか、
-                    # または既に超えているか。もしこの1コマだけで、minDesiredPeriods に満たないなら避ける。
-                    current_teacher_day_slots = t_stat_cand['assigned_slots_count_on_day'].get(date_str_cand, 0)
-                    min_desired_for_teacher = teacher_obj_cand.get('minDesiredPeriods', 1)
-                    
-                    # このコマを割り当てると min_desired を満たせるか、または既に満たしているか
-                    # ただし、このコマが min_desired を満たすための最後の1コマでない限り、
-                    # 他のコマで満たされる可能性もある。
-                    # ここでは、「このコマを割り当てても、その日の合計が min_desired 未満で、かつ、
-                    # 他に割り当てられる見込みがない（希望コマが少ないなど）」場合はペナルティ。
-                    # 今回は単純化のため、スコアリング関数内で考慮する。
-                    
-                    # 割り当てた場合の生徒のその日のコマ状況
-                    student_assignments_on_date_if_assigned = student_stat['assigned_periods_on_date'].get(date_str_cand, set()).copy()
-                    # student_assignments_on_date_if_assigned.add(period_cand) # スコアリング関数内で仮追加して評価
-
-                    score = get_score_for_assignment(student, t_stat_cand, date_str_cand, period_cand, subject, student_stat['assigned_periods_on_date'].get(date_str_cand, set()))
-                    
-                    # 講師のminDesiredPeriodsペナルティ
-                    # もしこの割り当てでその日のコマ数が min_desired 未満のままなら大きなペナルティ
-                    # ただし、他のコマで充足する可能性もあるので、ここでは「この1コマだけ」になる場合を特に問題視
-                    if current_teacher_day_slots + 1 < min_desired_for_teacher and len(teacher_obj_cand.get('selectedDateSlots', {}).get(date_str_cand, [])) == current_teacher_day_slots + 1 : # この日がこのコマだけになる場合
-                         if min_desired_for_teacher > 1: # 1コマ希望なら問題なし
-                            score -= 500 # minDesiredPeriods未達で、かつこの日これ以上希望がない場合
-                            print(f"  Debug Score: Teacher {teacher_obj_cand.get('name')} minDesiredPeriods penalty for {date_str_cand}. Score: {score}")
-
-
-                    if best_candidate is None or score > best_candidate[0]:
-                        best_candidate = (score, date_str_cand, period_cand, teacher_id_cand)
+        if batch_scorer is not None:
+            # NumPy による一括スコアリング (結果はスカラー版と同一)
+            best_candidate = batch_scorer.best_candidate(student_id, student, capable_teachers)
+        else:
+            best_candidate = find_best_candidate_scalar(availability, teachers_status, student_id, student_stat, subject, capable_teachers, stats)
         
-        if best_candidate and best_candidate[0] > -500: # ペナルティが大きすぎるものは避ける
+        if best_candidate and best_candidate[0] > SCORE_CUTOFF: # ペナルティが大きすぎるものは避ける
             score, d, p, t_id = best_candidate
-            slot_key = (d, p)
+            t_stat = teachers_status[t_id]
             
             assignments.append({
                 "date": d, "period": p, "teacherId": t_id,
-                "teacherName": teachers_status[t_id]['obj'].get('name'), "studentId": student_id,
+                "teacherName": t_stat.obj.get('name'), "studentId": student_id,
                 "studentName": student.get('name'), "subject": subject
             })
-            teachers_status[t_id]['assigned_slots'].add(slot_key)
-            teachers_status[t_id]['assigned_slots_count_on_day'][d] = \
-                teachers_status[t_id]['assigned_slots_count_on_day'].get(d, 0) + 1
-            
-            student_stat['assigned_slots'].add(slot_key)
-            student_stat['assigned_periods_on_date'].setdefault(d, set()).add(p)
-            student_stat['remaining_desired_units'][subject] -= 1
-            print(f"Phase 2 Assign (Scored): {student.get('name')}({subject}) with {teachers_status[t_id]['obj'].get('name')} on {d} P{p} (Score: {score:.0f})")
+            report_progress({"event": "assignment", "phase": "phase2", "assignment": assignments[-1]})
+            t_stat.day_counts[availability.date_index[d]] += 1
+            student_stat.assigned_mask |= 1 << availability.slot_bit(d, p)
+            student_stat.remaining_desired_units[subject] -= 1
+            availability.mark_assigned(t_id, student_id, d, p)
+            if batch_scorer is not None:
+                batch_scorer.mark_assigned(t_id, student_id, d, p)
+            logger.debug("Phase 2 Assign (Scored): %s(%s) with %s on %s P%s (Score: %.0f)",
+                         student.get('name'), subject, t_stat.obj.get('name'), d, p, score)
         else:
             # この1ユニットは割り当てられなかった
-            print(f"  Could not find suitable assignment for {student.get('name')} - {subject} (best score: {best_candidate[0] if best_candidate else 'N/A'}).")
-            # unassigned_student_courses にはループの最初で追加済みなので、ここでは何もしない
-
-    # --- 最終チェック: 未割り当てコマの整理 ---
-    final_unassigned = []
-    for s_id, s_stat in students_status.items():
-        student_obj = s_stat['obj']
-        for subject, units_left in s_stat['remaining_desired_units'].items():
-            if units_left > 0:
-                final_unassigned.append({
-                    'studentName': student_obj.get('name'),
-                    'studentId': s_id,
-                    'subject': subject,
-                    'units_left': units_left
-                })
+            logger.debug("Could not find suitable assignment for %s - %s (best score: %s).",
+                         student.get('name'), subject, best_candidate[0] if best_candidate else 'N/A')
+            if best_candidate:
+                unassigned_reasons[(student_id, subject)] = (UNASSIGNED_PENALTY_CUTOFF, best_candidate[0])
+            else:
+                unassigned_reasons[(student_id, subject)] = (UNASSIGNED_NO_COMMON_SLOT, None)
+
+    if batch_scorer is not None:
+        increment(stats, 'candidates_evaluated', batch_scorer.candidates_evaluated)
+    increment(stats, 'assignments_phase2', len(assignments) - phase_start_assignments)
+    record_timing(stats, 'phase2', phase_started)
+    report_phase_end('phase2')
+
+    # --- フェーズ3 (プレースホルダー) ---
+    logger.info("Phase 3: Adjusting for teacher's minDesiredPeriods (Placeholder)...")
+    phase_started = time.perf_counter()
+    report_progress({"event": "phase_start", "phase": "phase3", "assignments": len(assignments)})
+    # 講師のminDesiredPeriods充足チェックと報告
+    teacher_shortfalls = collect_teacher_shortfalls(teachers_status, available_dates)
+    for item in teacher_shortfalls:
+        logger.debug("Teacher %s on %s has %s assignments, less than minDesired %s.",
+                     item['teacherName'], item['date'], item['assigned'], item['minDesiredPeriods'])
+        # ここでペナルティを再計算したり、調整ロジックを入れることも可能
+    if teacher_shortfalls:
+        logger.warning("%d teacher-days have fewer assignments than minDesiredPeriods.", len(teacher_shortfalls))
+    record_timing(stats, 'phase3', phase_started)
+    report_phase_end('phase3')
+
+    # --- フェーズ4: 局所探索 (solverOptions.localSearch) ---
+    # 割り当ての移動・講師の入れ替え・空きコマの穴埋めで schedule_cost を下げる。状態はその場で更新する
+    if solver_options.get('localSearch'):
+        from local_search import DEFAULT_TIME_LIMIT_SECONDS, LocalSearch
+        logger.info("Phase 4: Improving assignments by local search...")
+        phase_started = time.perf_counter()
+        report_progress({"event": "phase_start", "phase": "phase4", "assignments": len(assignments)})
+        local_search = LocalSearch(assignments, len(fixed_assignments or []), teachers_status, students_status,
+                                   availability, regular_pairings, seed=solver_options.get('randomSeed'))
+        time_limit = solver_options.get('localSearchTimeLimitSeconds')
+        max_iterations = solver_options.get('localSearchMaxIterations')
+        summary = local_search.run(
+            time_limit_seconds=float(time_limit) if time_limit is not None else DEFAULT_TIME_LIMIT_SECONDS,
+            max_iterations=int(max_iterations) if max_iterations is not None else None, cancel_event=cancel_event)
+        logger.info("Phase 4: objective %d -> %d in %d iterations, %.0f ms (%.0f per second, moves %s%s).",
+                    summary['objective_before'], summary['objective_after'], summary['iterations'],
+                    summary['elapsed_ms'], summary['improvement_per_second'], summary['moves'],
+                    ", converged" if summary['converged'] else "")
+        increment(stats, 'local_search_iterations', summary['iterations'])
+        increment(stats, 'local_search_moves', sum(summary['moves'].values()))
+        increment(stats, 'local_search_improvement', summary['improvement'])
+        if stats is not None:
+            # 1回の求解についての値 (速度など) は、/metrics で合計される counters には入れない
+            stats['local_search'] = {
+                'objective_before': summary['objective_before'],
+                'objective_after': summary['objective_after'],
+                'moves': summary['moves'],
+                'elapsed_ms': summary['elapsed_ms'],
+                'improvement_per_second': summary['improvement_per_second'],
+                'converged': summary['converged'],
+            }
+        record_timing(stats, 'phase4', phase_started)
+        report_phase_end('phase4')
+        if sum(summary['moves'].values()):
+            teacher_shortfalls = collect_teacher_shortfalls(teachers_status, available_dates)
+    else:
+        logger.info("Phase 4: Local search is disabled (solverOptions.localSearch).")
+
+    # --- CP-SAT による全体最適化 (solverOptions.solver == "cpsat") ---
+    # 貪欲法の結果を warm start に使う。ortools はこのモードでのみ読み込む
+    if solver_options.get('solver', 'greedy') == 'cpsat':
+        from cpsat_solver import solve_with_cpsat
+        logger.info("CP-SAT: Re-solving globally with greedy solution as hint...")
+        report_progress({"event": "phase_start", "phase": "cpsat", "assignments": len(assignments)})
+        phase_started = time.perf_counter()
+        cpsat_summary = {}
+        assignments = solve_with_cpsat(input_data, assignments, available_dates, solver_options, summary=cpsat_summary,
+                                       cancel_event=cancel_event)
+        record_timing(stats, 'cpsat', phase_started)
+        if cpsat_summary['improvement'] <= 0:
+            logger.info("CP-SAT: No improvement over the greedy assignments (%s).",
+                        cpsat_summary['fallback'] or cpsat_summary['status'])
+            increment(stats, 'cpsat_not_improved')
+        if stats is not None:
+            # 1回の求解についての値なので、/metrics で合計される counters には入れない
+            stats['cpsat'] = cpsat_summary
+        report_phase_end('cpsat')
+        # 最終チェックと診断情報のため、講師・生徒の状態を CP-SAT の解から作り直す
+        teachers_status, students_status = build_solver_state(teachers_orig, students_orig, len(available_dates))
+        for a in assignments:
+            teachers_status[a['teacherId']].day_counts[availability.date_index[a['date']]] += 1
+            if a['studentId'] in students_status:
+                s_stat = students_status[a['studentId']]
+                s_stat.assigned_mask |= 1 << availability.slot_bit(a['date'], a['period'])
+                if a['subject'] in s_stat.remaining_desired_units:
+                    s_stat.remaining_desired_units[a['subject']] -= 1
+        teacher_shortfalls = collect_teacher_shortfalls(teachers_status, available_dates)
+        # 未割り当ての理由は貪欲法で失敗したときのもの (貪欲法で割り当てたコマは CP-SAT が外したもの)
+        default_reason = UNASSIGNED_NOT_SELECTED
+    else:
+        default_reason = UNASSIGNED_NO_COMMON_SLOT
+
+    # --- 最終チェック: 未割り当てコマの整理 (理由付き) ---
+    final_unassigned = collect_unassigned(students_status, unassigned_reasons, no_capable_teacher_units,
+                                          default_reason)
+    increment(stats, 'units_unassigned', sum(item['units_left'] for item in final_unassigned))
+    increment(stats, 'min_desired_shortfalls', len(teacher_shortfalls))
+    report_progress({"event": "unassigned", "items": final_unassigned})
     if final_unassigned:
-        print("--- Unassigned Student Courses ---")
+        logger.info("%d student courses have unassigned units.", len(final_unassigned))
         for item in final_unassigned:
-            print(f"  Student: {item['studentName']} (ID: {item['studentId']}), Subject: {item['subject']}, Units Left: {item['units_left']}")
-        # assignments リストに未割り当て情報を含めるか、別のキーで返すかは要検討
-        # ここでは、assignments とは別に返す想定で、Flask側でレスポンスに含める
-        # (ただし、現在のFlaskのレスポンスは assignments のみ期待している)
-        # assignments.append({"unassigned_info": final_unassigned}) # 一時的な対策
+            logger.debug("Unassigned: Student %s (ID: %s), Subject: %s, Units Left: %s, Reason: %s",
+                         item['studentName'], item['studentId'], item['subject'], item['units_left'], item['reason'])
 
+    if diagnostics is not None:
+        unassigned_units_by_reason = {}
+        for item in final_unassigned:
+            unassigned_units_by_reason[item['reason']] = unassigned_units_by_reason.get(item['reason'], 0) + item['units_left']
+        diagnostics['unassigned'] = final_unassigned
+        diagnostics['unassigned_units_by_reason'] = unassigned_units_by_reason
+        diagnostics['teacher_shortfalls'] = teacher_shortfalls
+        diagnostics['student_idle_gaps'] = collect_student_idle_gaps(students_status, availability)
+        diagnostics['regular_class_issues'] = regular_pairings.issues
+
+    increment(stats, 'assignments_total', len(assignments))
+    record_timing(stats, 'total', solve_started)
+    logger.info("Shift generation process finished. Total assignments: %d", len(assignments))
+    return assignments
 
-    # --- フェーズ3 & 4 (プレースホルダー) ---
-    print("Phase 3: Adjusting for teacher's minDesiredPeriods (Placeholder)...")
-    # 講師のminDesiredPeriods充足チェックと報告
-    for t_id, t_stat in teachers_status.items():
-        teacher = t_stat['obj']
-        min_desired = teacher.get('minDesiredPeriods', 1)
-        for date_str in available_dates:
-            if date_str in teacher.get('selectedDateSlots', {}): # その日に出勤希望がある
-                assigned_on_day = t_stat['assigned_slots_count_on_day'].get(date_str, 0)
-                if 0 < assigned_on_day < min_desired:
-                    print(f"  Warning: Teacher {teacher.get('name')} on {date_str} has {assigned_on_day} assignments, less than minDesired {min_desired}.")
-                    # ここでペナルティを再計算したり、調整ロジックを入れることも可能
-
-    print("Phase 4: Optimizing based on student preferences (Placeholder)...")
 
-    print(f"Shift generation process finished. Total assignments: {len(assignments)}")
-    return assignments
+def solve_schedule(input_data, progress_callback=None):
+    """シフトを生成して {"assignments", "stats", "diagnostics"} を返す (ジョブのワーカー用)。"""
+    stats = new_solve_stats()
+    diagnostics = {}
+    assignments = generate_actual_shifts(input_data, progress_callback=progress_callback, stats=stats,
+                                         diagnostics=diagnostics)
+    return {"assignments": assignments, "stats": stats, "diagnostics": diagnostics}
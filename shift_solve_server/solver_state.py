@@ -0,0 +1,48 @@
+# python_shift_solver/solver_state.py
+from array import array
+
+
+class TeacherState:
+    """
+    シフト生成中の講師の状態。入力の講師 dict (obj) は参照するだけで変更しない。
+    day_counts[日付idx] はその日の担当コマ数。
+    """
+    __slots__ = ('id', 'obj', 'day_counts')
+
+    def __init__(self, teacher, num_dates):
+        self.id = teacher['id']
+        self.obj = teacher
+        self.day_counts = array('i', bytes(4 * num_dates))
+
+
+class StudentState:
+    """
+    シフト生成中の生徒の状態。入力の生徒 dict (obj) は参照するだけで変更しない。
+    assigned_mask は割り当て済みコマのビットマスクで、ビット位置は AvailabilityIndex と同じ
+    「日付idx * 時限数 + 時限idx」。
+    """
+    __slots__ = ('id', 'obj', 'remaining_desired_units', 'assigned_mask')
+
+    def __init__(self, student):
+        self.id = student['id']
+        self.obj = student
+        self.remaining_desired_units = {
+            course['subject']: course['units'] for course in student.get('desiredCourses', [])
+        }
+        self.assigned_mask = 0
+
+    def day_mask(self, d_idx, num_periods):
+        """その日の割り当て済み時限のビットマスク (時限idx)。"""
+        return (self.assigned_mask >> (d_idx * num_periods)) & ((1 << num_periods) - 1)
+
+    def periods_on_day(self, d_idx, periods):
+        """その日の割り当て済み時限の集合 (時限の値)。"""
+        mask = self.day_mask(d_idx, len(periods))
+        return {p for p_idx, p in enumerate(periods) if mask >> p_idx & 1}
+
+
+def build_solver_state(teachers, students, num_dates):
+    """入力の講師・生徒リストから {id: TeacherState}, {id: StudentState} を作る (入力の順序を保持)。"""
+    teachers_status = {t['id']: TeacherState(t, num_dates) for t in teachers}
+    students_status = {s['id']: StudentState(s) for s in students}
+    return teachers_status, students_status
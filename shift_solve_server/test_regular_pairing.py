@@ -0,0 +1,36 @@
+# python_shift_solver/test_regular_pairing.py
+from regular_pairing import ISSUE_CONFLICTING_TEACHERS, ISSUE_DUPLICATE_PAIRING, RegularPairingIndex
+from solver_state import build_solver_state
+
+STUDENT = {'id': 's1', 'name': '生徒1', 'affiliation': '中学生', 'grade': '2年',
+           'desiredCourses': [{'subject': '数学', 'units': 2}]}
+
+
+def regular_class(day, period, subject='数学'):
+    return {'studentName': '生徒1', 'studentAffiliation': '中学生', 'studentGrade': '2年',
+            'subject': subject, 'day': day, 'period': period}
+
+
+def build_index(teachers):
+    teachers_status, students_status = build_solver_state(teachers, [STUDENT], 1)
+    return RegularPairingIndex(teachers_status, students_status)
+
+
+def test_twice_weekly_regular_class_is_not_an_issue():
+    index = build_index([{'id': 't1', 'name': '講師1',
+                          'regularClasses': [regular_class('火', 3), regular_class('木', 3)]}])
+    assert index.issues == []
+    assert index.get('s1', STUDENT) == {'数学': 't1'}
+
+
+def test_exact_duplicate_entry_is_reported():
+    index = build_index([{'id': 't1', 'name': '講師1',
+                          'regularClasses': [regular_class('火', 3), regular_class('火', 3)]}])
+    assert [issue['type'] for issue in index.issues] == [ISSUE_DUPLICATE_PAIRING]
+
+
+def test_different_teachers_are_reported_as_conflict():
+    index = build_index([{'id': 't1', 'name': '講師1', 'regularClasses': [regular_class('火', 3)]},
+                         {'id': 't2', 'name': '講師2', 'regularClasses': [regular_class('木', 3)]}])
+    assert [issue['type'] for issue in index.issues] == [ISSUE_CONFLICTING_TEACHERS]
+    assert index.get('s1', STUDENT) == {'数学': 't1'}
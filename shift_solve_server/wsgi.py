@@ -0,0 +1,38 @@
+# python_shift_solver/wsgi.py
+"""
+本番用の WSGI エントリーポイント (開発時は従来どおり python server.py)。
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py は preload_app = True なので、このモジュールの import (Flask アプリ・ソルバー・NumPy・OR-Tools)
+と小さな入力での試し解きはマスタープロセスで1回だけ行われ、各ワーカーは fork でそれを引き継ぐ。
+
+結果キャッシュ・ジョブ (/jobs) の状態は gunicorn.conf.py が設定するディレクトリ (SHIFT_CACHE_DIR /
+SHIFT_JOB_STATE_DIR) を通じてワーカー間で共有する。
+"""
+import logging
+import os
+import time
+
+import batch_solver  # noqa: F401  ワーカーで使うモジュールも preload する
+import cpsat_solver  # noqa: F401  OR-Tools の import をマスタープロセスで済ませる
+import multistart  # noqa: F401
+from season_generator import generate_season
+from server import app
+from shift_generater import generate_actual_shifts
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """
+    小さな入力を貪欲法で1回解いて、初回だけかかる処理 (NumPy の初期化など) を済ませる。
+    CP-SAT はスレッドを起動するので、fork 前のマスタープロセスでは解かない。
+    """
+    started = time.perf_counter()
+    generate_actual_shifts(generate_season(0, num_people=10, num_days=2))
+    logger.info("Solver warm-up finished in %.0f ms.", (time.perf_counter() - started) * 1000)
+
+
+if os.environ.get("SHIFT_WARMUP", "1") != "0":
+    warm_up()